@@ -0,0 +1,162 @@
+using UnityEngine;
+using System;
+using System.Collections.Generic;
+using Newtonsoft.Json;
+using Meta.Net.NativeWebSocket;
+
+public class CalibrationWebSocketClient : WebSocketClient
+{
+    // VR-side references placed on the physical markers (e.g. anchors moved onto them), paired by index with markerIds
+    [SerializeField]
+    private int[] markerIds = { 1, 2, 3, 4, 5 };
+    [SerializeField]
+    private Transform[] markerTransforms;
+
+    // Optional: the root of the camera space, moved to the solved camera-to-VR pose
+    [SerializeField]
+    private Transform cameraSpaceRoot;
+
+    public CalibrationResult LatestResult { get; private set; }
+    public event Action<CalibrationResult> CalibrationUpdated;
+
+    void Start()
+    {
+        ConnectToWebSocket();
+    }
+
+    // Send the current VR positions of the markers; the server pairs them with its camera observations.
+    // Call while holding the markers (or the VR anchors) still.
+    public async void SendCalibrationSample()
+    {
+        if (websocket == null || websocket.State != WebSocketState.Open)
+        {
+            Log("WebSocket is not connected.");
+            return;
+        }
+
+        var markers = new List<Dictionary<string, object>>();
+        for (int i = 0; i < markerIds.Length && i < markerTransforms.Length; i++)
+        {
+            if (markerTransforms[i] == null)
+            {
+                continue;
+            }
+            Vector3 position = markerTransforms[i].position;
+            markers.Add(new Dictionary<string, object>
+            {
+                { "marker_id", markerIds[i] },
+                { "x", position.x },
+                { "y", position.y },
+                { "z", position.z }
+            });
+        }
+
+        var message = new Dictionary<string, object>
+        {
+            { "command", "calibration_sample" },
+            { "client_id", clientId },
+            { "markers", markers }
+        };
+        await websocket.SendText(JsonConvert.SerializeObject(message));
+        Log($"Sent calibration sample with {markers.Count} marker(s).");
+    }
+
+    public async void RequestCalibration()
+    {
+        if (websocket != null && websocket.State == WebSocketState.Open)
+        {
+            await websocket.SendText(JsonConvert.SerializeObject(new Dictionary<string, string>
+            {
+                { "command", "request_calibration" },
+                { "client_id", clientId }
+            }));
+        }
+    }
+
+    public async void ResetCalibration()
+    {
+        if (websocket != null && websocket.State == WebSocketState.Open)
+        {
+            await websocket.SendText(JsonConvert.SerializeObject(new Dictionary<string, string>
+            {
+                { "command", "reset_calibration" },
+                { "client_id", clientId }
+            }));
+            Log("Calibration reset requested.");
+        }
+    }
+
+    protected override void HandleServerMessage(string message)
+    {
+        try
+        {
+            var resultMessage = JsonConvert.DeserializeObject<CalibrationResultMessage>(message);
+            if (resultMessage != null && resultMessage.command == "error" && resultMessage.request == "request_calibration")
+            {
+                Log($"Calibration not available: {resultMessage.message}");
+                return;
+            }
+            if (resultMessage == null || resultMessage.command != "calibration_result" || resultMessage.data == null)
+            {
+                return;
+            }
+
+            LatestResult = resultMessage.data;
+            Log($"Calibration: rms {LatestResult.rms:F4} m, {LatestResult.inliers}/{LatestResult.samples} inliers");
+
+            if (cameraSpaceRoot != null)
+            {
+                cameraSpaceRoot.SetPositionAndRotation(LatestResult.position.ToVector3(), LatestResult.rotation.ToQuaternion());
+            }
+            CalibrationUpdated?.Invoke(LatestResult);
+        }
+        catch (JsonException ex)
+        {
+            Debug.LogError("Failed to parse message as JSON: " + ex.Message);
+        }
+    }
+}
+
+public class CalibrationResultMessage
+{
+    public string command { get; set; }
+    public CalibrationResult data { get; set; }
+    // Set on error replies
+    public string request { get; set; }
+    public string message { get; set; }
+}
+
+public class CalibrationResult
+{
+    public CalibrationVector position { get; set; }
+    public CalibrationQuaternion rotation { get; set; }
+    public float rms { get; set; }
+    public int inliers { get; set; }
+    public int samples { get; set; }
+    public double timestamp { get; set; }
+}
+
+public class CalibrationVector
+{
+    public float x { get; set; }
+    public float y { get; set; }
+    public float z { get; set; }
+
+    public Vector3 ToVector3()
+    {
+        return new Vector3(x, y, z);
+    }
+}
+
+public class CalibrationQuaternion
+{
+    public float x { get; set; }
+    public float y { get; set; }
+    public float z { get; set; }
+    public float w { get; set; }
+
+    public Quaternion ToQuaternion()
+    {
+        return new Quaternion(x, y, z, w);
+    }
+}
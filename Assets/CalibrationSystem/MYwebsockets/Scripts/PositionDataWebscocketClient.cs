@@ -15,6 +15,9 @@ public class PositionDataWebSocketClient : WebSocketClient
     private Dictionary<int, Vector3> lastKnownPositions = new Dictionary<int, Vector3>();
     private int counter = 0;
 
+    // Last stream seq applied; sent as since_seq so the server only returns what changed (-1 = need full snapshot)
+    private long lastSeq = -1;
+
     // Define an array for allowed marker IDs
     [SerializeField]
     private int[] allowedMarkerIds = { 1, 2, 3, 4, 5 }; // Example IDs, adjust these based on your requirement
@@ -36,12 +39,21 @@ public class PositionDataWebSocketClient : WebSocketClient
         {
             if (websocket != null && websocket.State == WebSocketState.Open)
             {
-                var message = new Dictionary<string, string>
+                var message = new Dictionary<string, object>
                 {
                     { "command", "request_stream_data" },
                     { "client_id", clientId },
                     { "stream_name", streamName }
                 };
+                if (lastSeq >= 0)
+                {
+                    message["since_seq"] = lastSeq;
+                }
+                if (allowedMarkerIds.Length > 0)
+                {
+                    // Let the server drop the other markers before sending
+                    message["marker_ids"] = allowedMarkerIds;
+                }
                 yield return SendWebSocketMessage(JsonConvert.SerializeObject(message));
             }
             yield return new WaitForSeconds(requestInterval);
@@ -68,27 +80,37 @@ public class PositionDataWebSocketClient : WebSocketClient
 
             var streamDataMessage = JsonConvert.DeserializeObject<StreamDataMessage>(message);
 
-            if (streamDataMessage != null && streamDataMessage.command == "stream_data" && streamDataMessage.data != null)
+            if (streamDataMessage != null && streamDataMessage.command == "stream_data" && streamDataMessage.encoding == "delta")
             {
-                foreach (var marker in streamDataMessage.data)
+                if (streamDataMessage.seq == lastSeq)
                 {
-                    int markerId = marker.marker_id;
+                    // Answer to an earlier request that we are already past
+                    return;
+                }
+                if (streamDataMessage.base_seq != lastSeq)
+                {
+                    // Delta does not follow what we have; ask for a full snapshot next time
+                    lastSeq = -1;
+                    return;
+                }
 
-                    // Check if the marker ID is in the allowed list
-                    if (System.Array.Exists(allowedMarkerIds, id => id == markerId))
+                // Removed markers keep their last known position
+                if (streamDataMessage.upserts != null)
+                {
+                    foreach (var marker in streamDataMessage.upserts)
                     {
-                        Vector3 markerPosition = new Vector3(marker.x, marker.y, marker.z);
-
-                        // Log each marker's data
-                        Debug.Log($"Allowed Marker ID: {markerId} - Position: X={markerPosition.x}, Y={markerPosition.y}, Z={markerPosition.z} - Counter: {counter}");
-                        StreamLog($"Allowed Marker ID: {markerId} - Position: X={markerPosition.x}, Y={markerPosition.y}, Z={markerPosition.z} - Counter: {counter}");
-
-                        // Update the dictionary with the new position data
-                        lastKnownPositions[markerId] = markerPosition;
-                        counter++;
+                        UpdateMarker(marker);
                     }
-                   
                 }
+                lastSeq = streamDataMessage.seq ?? -1;
+            }
+            else if (streamDataMessage != null && streamDataMessage.command == "stream_data" && streamDataMessage.data != null)
+            {
+                foreach (var marker in streamDataMessage.data)
+                {
+                    UpdateMarker(marker);
+                }
+                lastSeq = streamDataMessage.seq ?? -1;
             }
             else
             {
@@ -102,6 +124,25 @@ public class PositionDataWebSocketClient : WebSocketClient
         }
     }
 
+    private void UpdateMarker(MarkerData marker)
+    {
+        int markerId = marker.marker_id;
+
+        // Check if the marker ID is in the allowed list
+        if (System.Array.Exists(allowedMarkerIds, id => id == markerId))
+        {
+            Vector3 markerPosition = new Vector3(marker.x, marker.y, marker.z);
+
+            // Log each marker's data
+            Debug.Log($"Allowed Marker ID: {markerId} - Position: X={markerPosition.x}, Y={markerPosition.y}, Z={markerPosition.z} - Counter: {counter}");
+            StreamLog($"Allowed Marker ID: {markerId} - Position: X={markerPosition.x}, Y={markerPosition.y}, Z={markerPosition.z} - Counter: {counter}");
+
+            // Update the dictionary with the new position data
+            lastKnownPositions[markerId] = markerPosition;
+            counter++;
+        }
+    }
+
     public Dictionary<int, Vector3> GetMarkerPositions()
     {
         Debug.Log("GetMarkerPositions called with data: " + lastKnownPositions);
@@ -127,6 +168,13 @@ public class StreamDataMessage
     public string command { get; set; }
     public string stream_name { get; set; }
     public List<MarkerData> data { get; set; }
+
+    // Present on delta-encoded streams
+    public string encoding { get; set; }
+    public long? seq { get; set; }
+    public long? base_seq { get; set; }
+    public List<MarkerData> upserts { get; set; }
+    public List<int> removed { get; set; }
 }
 
 public class MarkerData
@@ -4,6 +4,7 @@ using System.Net.Sockets;
 using System.Text;
 using System;
 using System.Collections.Generic;
+using System.IO;
 using Newtonsoft.Json;  // Add this line
 
 public class ArUcoServer : MonoBehaviour
@@ -25,6 +26,7 @@ public class ArUcoServer : MonoBehaviour
     {
         public Vector3 position;
         public float rotation;
+        public Quaternion orientation = Quaternion.identity;  // Full camera-frame orientation from the tracker
         public double lastUpdateTime;
         public List<(Vector3 position, float rotation)> currentFrameData = new List<(Vector3, float)>();
 
@@ -52,6 +54,7 @@ public class ArUcoServer : MonoBehaviour
     [System.Serializable]
     public class MessageData
     {
+        public long seq = -1;
         public double timestamp;
         public Dictionary<string, MarkerData> markers;
     }
@@ -61,8 +64,30 @@ public class ArUcoServer : MonoBehaviour
     {
         public Position position;
         public float rotation;
+        public Orientation quaternion;  // Optional, sent by newer trackers
     }
 
+    [System.Serializable]
+    public class Orientation
+    {
+        public float x;
+        public float y;
+        public float z;
+        public float w = 1f;
+
+        public Quaternion ToQuaternion()
+        {
+            return new Quaternion(x, y, z, w);
+        }
+    }
+
+    // Binary packet layout (little-endian), must match py_Server/marker_packet.py:
+    // header: 'A' 'R', version u8, flags u8, seq u32, timestamp f64, count u16, reserved u16
+    // record: id i32, position 3 x f32, quaternion 4 x f32, rotation f32
+    private const int BINARY_HEADER_SIZE = 20;
+    private const int BINARY_RECORD_SIZE = 36;
+    private const byte BINARY_VERSION = 1;
+
     [System.Serializable]
     public class Position    // Change to public
     {
@@ -127,6 +152,20 @@ public class ArUcoServer : MonoBehaviour
         }
     }
 
+    public bool TryGetMarkerPose(int markerId, out Vector3 position, out Quaternion orientation)
+    {
+        if (trackedMarkers.TryGetValue(markerId, out TrackedMarker marker))
+        {
+            position = marker.position;
+            orientation = marker.orientation;
+            return true;
+        }
+
+        position = Vector3.zero;
+        orientation = Quaternion.identity;
+        return false;
+    }
+
     // Get all tracked markers
     public Dictionary<int, (Vector3 position, float rotation)> GetAllMarkerData()
     {
@@ -149,7 +188,8 @@ public class ArUcoServer : MonoBehaviour
         trackedMarkers[id].currentFrameData.Add((position, rotation));
     }
 
-    private void ProcessMessage(string jsonString)
+    // Returns the packet's sequence number (-1 if missing) so it can be acknowledged
+    private long ProcessMessage(string jsonString)
     {   
         //Debug.Log("Raw received JSON: " + jsonString);  // Print exact received JSON
         try
@@ -176,6 +216,10 @@ public class ArUcoServer : MonoBehaviour
                     float rotation = marker.Value.rotation;
 
                     RegisterOrUpdateMarker(id, position, rotation);
+                    if (marker.Value.quaternion != null)
+                    {
+                        trackedMarkers[id].orientation = marker.Value.quaternion.ToQuaternion();
+                    }
                 }
 
                 // Update all markers with their average positions
@@ -193,10 +237,69 @@ public class ArUcoServer : MonoBehaviour
                             $"Rotation: {marker.Value.rotation:F3}");
                 }*/
             }
+            return message.seq;
         }
         catch (Exception e)
         {
             Debug.LogError($"Processing Error: {e.Message}\nJSON: {jsonString}");
+            return -1;
+        }
+    }
+
+    private static bool IsBinaryPacket(byte[] buffer)
+    {
+        return buffer.Length >= BINARY_HEADER_SIZE && buffer[0] == (byte)'A' && buffer[1] == (byte)'R';
+    }
+
+    // Decodes a binary marker packet; returns its sequence number (-1 on error)
+    private long ProcessBinaryMessage(byte[] buffer)
+    {
+        try
+        {
+            using (var reader = new BinaryReader(new MemoryStream(buffer)))
+            {
+                reader.ReadBytes(2);  // magic
+                byte version = reader.ReadByte();
+                reader.ReadByte();    // flags
+                uint seq = reader.ReadUInt32();
+                reader.ReadDouble();  // timestamp
+                int count = reader.ReadUInt16();
+                reader.ReadUInt16();  // reserved
+
+                if (version != BINARY_VERSION || buffer.Length < BINARY_HEADER_SIZE + count * BINARY_RECORD_SIZE)
+                {
+                    Debug.LogError($"Invalid binary marker packet (version {version}, {buffer.Length} bytes)");
+                    return -1;
+                }
+
+                foreach (var marker in trackedMarkers.Values)
+                {
+                    marker.currentFrameData.Clear();
+                }
+
+                for (int i = 0; i < count; i++)
+                {
+                    int id = reader.ReadInt32();
+                    Vector3 position = new Vector3(reader.ReadSingle(), reader.ReadSingle(), reader.ReadSingle());
+                    Quaternion orientation = new Quaternion(reader.ReadSingle(), reader.ReadSingle(), reader.ReadSingle(), reader.ReadSingle());
+                    float rotation = reader.ReadSingle();
+
+                    RegisterOrUpdateMarker(id, position, rotation);
+                    trackedMarkers[id].orientation = orientation;
+                }
+
+                foreach (var marker in trackedMarkers.Values)
+                {
+                    marker.UpdateData();
+                }
+
+                return seq;
+            }
+        }
+        catch (Exception e)
+        {
+            Debug.LogError($"Binary processing Error: {e.Message}");
+            return -1;
         }
     }
 
@@ -232,10 +335,13 @@ public class ArUcoServer : MonoBehaviour
                     Debug.Log($"Connection active. Total messages: {messagesReceived}");
                 }
 
-                string jsonString = Encoding.UTF8.GetString(result.Buffer);
-                ProcessMessage(jsonString);
+                // Binary marker packets by default, JSON in the tracker's debug mode and for heartbeats
+                long seq = IsBinaryPacket(result.Buffer)
+                    ? ProcessBinaryMessage(result.Buffer)
+                    : ProcessMessage(Encoding.UTF8.GetString(result.Buffer));
 
-                byte[] ackData = Encoding.UTF8.GetBytes("ACK");
+                // Echo the sequence number so the sender can measure loss and RTT
+                byte[] ackData = Encoding.UTF8.GetBytes(seq >= 0 ? $"ACK {seq}" : "ACK");
                 await server.SendAsync(ackData, ackData.Length, result.RemoteEndPoint);
             }
             catch (Exception e)
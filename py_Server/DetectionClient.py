@@ -2,9 +2,12 @@ import time
 import json
 import numpy as np
 import cv2
-import socket
 from ArUcoDetector import ArUcoDetector
 from Camera import Camera
+from marker_pose import MarkerPoseEstimator
+from marker_filter import MarkerFilter
+from udp_sender import UnitySender
+from marker_packet import encode_marker_packet, MAX_MARKERS_PER_PACKET
 import pyrealsense2 as rs
 
 class ArUcoTracker:
@@ -19,17 +22,36 @@ class ArUcoTracker:
         self.target_ids = config.get('target_ids', list(range(1, 11)))
         self.arucoDetector = ArUcoDetector(self.dict_to_use)
         self.camera = Camera()
+
+        # Full 6-DoF pose estimation (marker side length in meters)
+        self.pose_estimator = MarkerPoseEstimator(
+            marker_length=config.get('marker_length', 0.05),
+            depth_weight=config.get('depth_weight', 0.5))
+
+        # Per-marker smoothing and latency-compensating prediction
+        self.marker_filter = MarkerFilter(
+            min_cutoff=config.get('filter_min_cutoff', 1.0),
+            beta=config.get('filter_beta', 5.0))
+        self.prediction_horizon = config.get('prediction_horizon', 0.03)  # seconds
+        # The filter keeps state for ids below max_markers only; track nothing it cannot filter
+        unfiltered = [i for i in self.target_ids if not 0 <= i < self.marker_filter.max_markers]
+        if unfiltered:
+            print(f"Ignoring target IDs outside [0, {self.marker_filter.max_markers}): {unfiltered}")
+            self.target_ids = [i for i in self.target_ids if 0 <= i < self.marker_filter.max_markers]
         
-        # Initialize UDP client
-        self.udp_client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Initialize UDP client (never blocks; acks and heartbeats are handled in the background)
         self.unity_address = ('127.0.0.1', 12345)
-        self.udp_client.settimeout(0.1)
+        self.sender = UnitySender(self.unity_address,
+                                  heartbeat_interval=config.get('heartbeat_interval', 1.0))
+        # 'binary' packs markers straight from NumPy; 'json' is the human-readable debug mode
+        self.packet_format = config.get('packet_format', 'binary')
+        self.stats_interval = 5.0
+        self.last_stats_time = time.time()
+        self.ignored_ids = set()  # Detected but not in target_ids since the last stats line
+        # Per-packet output ("Sending JSON", "Sent data for markers") floods the console at frame rate
+        self.verbose = config.get('verbose', False)
         
         print(f"Started tracking IDs: {self.target_ids}")
-        
-        self.is_connected = False
-        self.connection_attempts = 0
-        self.last_successful_send = 0
 
     def format_point3d(self, point):
         return {
@@ -37,44 +59,38 @@ class ArUcoTracker:
             'y': float(f"{point[1]:.3f}"),
             'z': float(f"{point[2]:.3f}")
         }
-    def send_heartbeat(self):
-        heartbeat_packet = {
-            'timestamp': float(f"{time.time():.3f}"),
-            'markers': {}  # Empty markers dict
-        }
-        return self.send_to_unity(heartbeat_packet)
-
     def send_to_unity(self, data):
-        try:
-            message = json.dumps(data)
+        seq = self.sender.next_seq()
+        data['seq'] = seq
+        message = json.dumps(data)
+        if self.verbose:
             print("Sending JSON:", message)  # Print exact JSON being sent
-            self.udp_client.sendto(message.encode(), self.unity_address)
-            
-            # Wait for acknowledgment
-            try:
-                ack_data, _ = self.udp_client.recvfrom(1024)
-                if ack_data.decode() == "ACK":
-                    if not self.is_connected:
-                        print("Successfully connected to Unity server!")
-                        self.is_connected = True
-                    self.last_successful_send = time.time()
-                    return True
-            except socket.timeout:
-                self.connection_attempts += 1
-                if self.connection_attempts % 10 == 0:  # Log every 10 attempts
-                    print(f"No response from server. Attempt {self.connection_attempts}")
-                return False
-
-        except Exception as e:
-            print(f"Error sending to Unity: {e}")
-            self.is_connected = False
-            return False
-
-    def format_point3d(self, point):
+        return self.sender.send_bytes(message.encode(), seq)
+
+    def send_binary_to_unity(self, ids, positions, quaternions, rotations):
+        """Send marker arrays as fixed-layout binary packets (split if they exceed one MTU)."""
+        sent = True
+        timestamp = time.time()
+        for start in range(0, len(ids), MAX_MARKERS_PER_PACKET):
+            end = start + MAX_MARKERS_PER_PACKET
+            seq = self.sender.next_seq()
+            packet = encode_marker_packet(seq, timestamp, ids[start:end], positions[start:end],
+                                          quaternions[start:end], rotations[start:end])
+            sent = self.sender.send_bytes(packet, seq) and sent
+        return sent
+
+    def print_connection_stats(self):
+        stats = self.sender.stats()
+        rtt = f"{stats['rtt_ms']:.1f} ms" if stats['rtt_ms'] is not None else "n/a"
+        print(f"Unity link: connected={stats['connected']} sent={stats['sent']} "
+              f"acked={stats['acked']} loss={stats['loss'] * 100:.1f}% rtt={rtt}")
+
+    def format_quaternion(self, quaternion):
         return {
-            'x': float(f"{point[0]:.3f}"),
-            'y': float(f"{point[1]:.3f}"),
-            'z': float(f"{point[2]:.3f}")
+            'x': float(f"{quaternion[0]:.4f}"),
+            'y': float(f"{quaternion[1]:.4f}"),
+            'z': float(f"{quaternion[2]:.4f}"),
+            'w': float(f"{quaternion[3]:.4f}")
         }
     def start(self):
         self.camera.startStreaming()
@@ -87,9 +103,12 @@ class ArUcoTracker:
                 frame = self.camera.getNextFrame()
                 if frame is None:
                     continue
+                capture_time = time.time()
+                self.marker_filter.expire(capture_time)  # Markers out of view for a while start over
 
                 depth_frame = frame.get_depth_frame()
                 depth_intrinsics = depth_frame.profile.as_video_stream_profile().intrinsics
+                color_intrinsics = frame.get_color_frame().profile.as_video_stream_profile().intrinsics
                 _, color_image = self.camera.extractImagesFromFrame(frame)
 
                 result = self.arucoDetector.detect(color_image)
@@ -99,6 +118,8 @@ class ArUcoTracker:
                 detected_ids = []  # For logging
                 if ids is not None:
                     ids = np.array(ids) if isinstance(ids, list) else ids
+                    tracked_indices = []
+                    depth_points = []
                     for i, marker_id in enumerate(ids.flatten()):
                         marker_id = int(marker_id)
                         detected_ids.append(marker_id)
@@ -111,15 +132,41 @@ class ArUcoTracker:
                         center_x = int(np.mean(corner[:, 0]))
                         center_y = int(np.mean(corner[:, 1]))
 
-                        depth = float(f"{depth_frame.get_distance(center_x, center_y):.3f}")
+                        depth = depth_frame.get_distance(center_x, center_y)
                         if depth > 0:
-                            point_3d = rs.rs2_deproject_pixel_to_point(
-                                depth_intrinsics, [center_x, center_y], depth)
-                            
-                            marker_data[int(marker_id)] = {
-                                'position': self.format_point3d(point_3d),
-                                'rotation': float(f"{self.calculate_rotation(corner):.3f}")
-                            }
+                            depth_points.append(rs.rs2_deproject_pixel_to_point(
+                                depth_intrinsics, [center_x, center_y], depth))
+                        else:
+                            depth_points.append([0.0, 0.0, 0.0])
+                        tracked_indices.append(i)
+
+                    # Reported with the link stats, whichever packet format is in use
+                    self.ignored_ids.update(set(detected_ids) - set(self.target_ids))
+
+                    if tracked_indices:
+                        # Estimate every tracked marker's pose in one batched pass
+                        self.pose_estimator.update_intrinsics(color_intrinsics)
+                        positions, quaternions = self.pose_estimator.estimate(
+                            [corners[i] for i in tracked_indices], np.array(depth_points))
+
+                        # Smooth per marker, then extrapolate to the expected display time
+                        tracked_ids = ids.flatten()[tracked_indices]
+                        self.marker_filter.update(tracked_ids, positions, quaternions, capture_time)
+                        positions, quaternions = self.marker_filter.predict(
+                            tracked_ids, capture_time + self.prediction_horizon)
+
+                        if self.packet_format == 'json':
+                            for n, i in enumerate(tracked_indices):
+                                corner = corners[i][0]
+                                marker_data[int(ids.flatten()[i])] = {
+                                    'position': self.format_point3d(positions[n]),
+                                    'rotation': float(f"{self.calculate_rotation(corner):.3f}"),
+                                    'quaternion': self.format_quaternion(quaternions[n])
+                                }
+                        else:
+                            tracked_corners = np.array([corners[i][0] for i in tracked_indices])
+                            self.send_binary_to_unity(tracked_ids, positions, quaternions,
+                                                      self.calculate_rotations(tracked_corners))
 
                 if marker_data:
                     data_packet = {
@@ -127,19 +174,16 @@ class ArUcoTracker:
                         'markers': marker_data
                     }
                     sent = self.send_to_unity(data_packet)
-                    if sent:
+                    if sent and self.verbose:
                         print(f"Sent data for markers: {list(marker_data.keys())}")
-                        # Print detected vs tracked markers
-                        all_detected = set(detected_ids)
-                        tracked = set(marker_data.keys())
-                        ignored = all_detected - tracked
-                        if ignored:
-                            print(f"Ignored markers (not in target list): {ignored}")
-                else:
-                    # Send heartbeat when no markers detected
-                    sent = self.send_heartbeat()
-                    if sent and time.time() % 5 < 0.1:  # Print every ~5 seconds
-                        print("Connection active (heartbeat sent)")
+                # Heartbeats are sent by the sender's timer while no marker data flows
+
+                if time.time() - self.last_stats_time >= self.stats_interval:
+                    self.print_connection_stats()
+                    if self.ignored_ids:
+                        print(f"Ignored markers (not in target list): {sorted(self.ignored_ids)}")
+                        self.ignored_ids.clear()
+                    self.last_stats_time = time.time()
 
                 # Draw markers on image
                 color_image = ArUcoDetector.getImageWithMarkers(
@@ -153,7 +197,7 @@ class ArUcoTracker:
             print("Shutting down tracker...")
             self.camera.stopStreaming()
             cv2.destroyAllWindows()
-            self.udp_client.close()
+            self.sender.close()
 
     def calculate_rotation(self, corners):
         dx = corners[1][0] - corners[0][0]
@@ -161,6 +205,11 @@ class ArUcoTracker:
         angle = np.arctan2(dy, dx)
         return float(angle)
 
+    def calculate_rotations(self, corners):
+        """Vectorized calculate_rotation for an (N, 4, 2) corner array."""
+        delta = corners[:, 1] - corners[:, 0]
+        return np.arctan2(delta[:, 1], delta[:, 0])
+
 def main():
     tracker = ArUcoTracker()
     tracker.start()
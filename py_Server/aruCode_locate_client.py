@@ -9,7 +9,7 @@ import threading
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
 from PIL import Image, ImageTk
-from websocket_client import WebsocketClient
+from webSocket_client import WebsocketClient
 
 class LocationSendingWebSocketClient(WebsocketClient):
     def __init__(self):
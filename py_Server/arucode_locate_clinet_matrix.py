@@ -2,7 +2,6 @@ import asyncio
 import json
 import time
 import threading
-import pyrealsense2 as rs
 import numpy as np
 import cv2
 from cv2 import aruco
@@ -10,12 +9,21 @@ from tkinter import Tk, scrolledtext
 import tkinter as tk  # Import tkinter with alias for widgets
 from PIL import Image, ImageTk
 from webSocket_client import WebsocketClient
+from marker_pose import CameraIntrinsics
+from detection_pool import DetectionPool
+from depth_filter import DepthFilter
+from realsense_capture import RealSenseCapture
+from marker_filter import MarkerFilter
+from pose_tracker import PoseTracker
+from marker_publisher import MarkerPublisher
+from delta_stream import DeltaEncoder
 import logging
 
 class LocationSendingWebSocketClient_Matrix(WebsocketClient):
     def __init__(self):
         super().__init__()  # Initialize WebSocketClient_test
-        self.marker_data = {}  # Dictionary to store marker position data
+        # Double-buffered marker snapshots handed from the detection thread to the sender
+        self.marker_publisher = MarkerPublisher(capacity=250, deadband=0.005, keepalive=1.0, stale_after=0.5)
         self.detecting = True
 
         # Initialize Tkinter elements
@@ -24,16 +32,29 @@ class LocationSendingWebSocketClient_Matrix(WebsocketClient):
         self.frame_label = tk.Label(self.window)  # Corrected to use tk.Label
         self.frame_label.grid(row=5, column=0, columnspan=2)
 
-        # Initialize RealSense pipeline
-        self.pipeline = rs.pipeline()
-        self.config = rs.config()
-        self.config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-        self.config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
-        self.align = rs.align(rs.stream.color)
+        # RealSense capture via the SDK callback; processing always takes the newest frameset
+        self.capture = RealSenseCapture(width=640, height=480, fps=30)
 
-        # ArUco Dictionary and Parameters
-        self.aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_6X6_250)
-        self.aruco_params = aruco.DetectorParameters()
+        # ArUco detection with batched 6-DoF pose estimation (5 cm markers), fused with aligned depth.
+        # Runs in a pool of worker processes; None picks one worker per spare CPU core.
+        self.detector_options = {"dictionary": aruco.DICT_6X6_250, "marker_length": 0.05, "depth_weight": 0.5}
+        self.detection_workers = None
+        self.detection_pool = None
+        self.last_detection = None  # Latest (ids, centers, positions) for the preview overlay
+
+        # Outlier rejection, temporal smoothing and hole filling on the aligned depth, once per frame
+        self.depth_filter = DepthFilter(decimation=1)
+
+        # Per-marker smoothing; poses are extrapolated by the expected display latency when sent
+        self.marker_filter = MarkerFilter(max_markers=250)
+        self.prediction_horizon = 0.03  # seconds
+
+        # Send aruco_position_stream as keyframes plus deltas of the markers that changed
+        self.use_delta_stream = True
+        self.delta_encoder = DeltaEncoder(threshold=0.005, keyframe_interval=1.0)
+
+        # Rigid objects from PoseData, recorded in the camera frame (hence mirrored to y-up)
+        self.pose_tracker = PoseTracker(mirror_y=True)
 
     def start_connection(self):
         super().start_connection()  # Start WebSocket connection in a separate thread
@@ -42,95 +63,171 @@ class LocationSendingWebSocketClient_Matrix(WebsocketClient):
         threading.Thread(target=self.batch_send_marker_positions, daemon=True).start()
 
     def detect_aruco_markers(self):
-        """Detect ArUco markers and store their positions."""
+        """Capture frames, hand them to the detection pool and process results in frame order."""
         try:
-            self.pipeline.start(self.config)
+            self.capture.start()
             logging.info("RealSense pipeline started successfully.")
         except Exception as e:
             logging.error(f"Error starting RealSense pipeline: {e}")
             return  # Stop if the camera couldn't start
 
+        self.detection_pool = DetectionPool(640, 480, workers=self.detection_workers,
+                                            detector_options=self.detector_options)
+        logging.info(f"Detection pool started with {self.detection_pool.workers} worker(s).")
+        intrinsics = None
+
         while self.detecting:
             try:
-                frames = self.pipeline.wait_for_frames()
-                if not frames:
+                frame = self.capture.get(timeout=1.0)
+                if frame is None:
                     logging.warning("No frames received from RealSense.")
-                    time.sleep(0.1)
-                    continue
-
-                aligned_frames = self.align.process(frames)
-                color_frame = aligned_frames.get_color_frame()
-                depth_frame = aligned_frames.get_depth_frame()
-
-                if not color_frame or not depth_frame:
-                    logging.warning("Color or depth frame not available.")
                     self.update_log("Frames not available. Trying again...")
-                    time.sleep(0.1)
                     continue
+                # Arrival time of the frameset, not of this loop iteration, so slow processing
+                # doesn't age the poses; frame numbers come from the sensor
+                capture_time = frame.arrival_time
+                color_frame, depth_frame = frame.color, frame.depth
 
                 logging.debug("Frames received from RealSense camera.")
                 color_image = np.asanyarray(color_frame.get_data())
+                if intrinsics is None:
+                    intrinsics = CameraIntrinsics.from_realsense(
+                        color_frame.profile.as_video_stream_profile().intrinsics)
 
-                # Detect ArUco markers
-                corners, ids, _ = aruco.detectMarkers(color_image, self.aruco_dict, parameters=self.aruco_params)
-                log_message = "Frame processed.\n"
-
-                # Update marker_data with latest positions
-                if ids is not None:
-                    for i, corner in enumerate(corners):
-                        cx, cy = np.mean(corner[0], axis=0).astype(int)
-                        depth = depth_frame.get_distance(cx, cy)
-                        depth_intrinsics = depth_frame.profile.as_video_stream_profile().intrinsics
-                        x, y, z = rs.rs2_deproject_pixel_to_point(depth_intrinsics, [cx, cy], depth)
-                        y = -y
-
-                        # Store the latest position for each marker ID
-                        self.marker_data[int(ids[i][0])] = {
-                            "x": round(x, 2),
-                            "y": round(y, 2),
-                            "z": round(z, 2)
-                        }
-
-                        log_message += f"Marker ID: {ids[i][0]} - Position: X={x:.2f}, Y={y:.2f}, Z={z:.2f}\n"
+                # Detect ArUco markers and estimate their poses in the worker processes
+                frame_number = frame.frame_number
+                depth_image = self.depth_filter.process(np.asanyarray(depth_frame.get_data()))
+                self.detection_pool.submit(frame_number, capture_time, color_image,
+                                           depth_image, depth_frame.get_units(), intrinsics)
+                log_message = None
+                for _, timestamp, detection in self.detection_pool.poll():
+                    log_message = self.process_detection(timestamp, *detection)
+
+                # Overlay the latest detection on the live preview
+                if self.last_detection is not None:
+                    ids, centers, positions = self.last_detection
+                    for i, (cx, cy) in enumerate(centers):
+                        x, y, z = positions[i]
                         cv2.circle(color_image, (cx, cy), 5, (0, 255, 0), -1)
-                        cv2.putText(color_image, f"ID: {ids[i][0]} ({x:.2f}, {y:.2f}, {z:.2f})",
+                        cv2.putText(color_image, f"ID: {ids[i]} ({x:.2f}, {y:.2f}, {z:.2f})",
                                     (cx, cy - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-                else:
-                    log_message += "No ArUco markers detected in this frame.\n"
-                    logging.info("No ArUco markers detected.")
 
-                self.update_log(log_message)
+                if log_message is not None:
+                    self.update_log(log_message)
                 self.update_frame_in_gui(color_image)
 
             except Exception as e:
                 logging.error(f"Error during ArUco detection: {e}")
                 break
 
-        self.pipeline.stop()
+        self.detection_pool.close()
+        self.capture.stop()
+        self.capture.log_stats()
         logging.info("RealSense pipeline stopped.")
 
-    async def send_marker_data(self):
-        """Send all current marker data as a batch to the server."""
+    def process_detection(self, capture_time, ids, centers, positions, quaternions):
+        """Filter, publish and solve objects for one frame's detections; returns the log text."""
+        log_message = "Frame processed.\n"
+
+        # Filter and publish the latest marker poses (ids the filter has no room for are dropped)
+        keep = self.marker_filter.in_range(ids)
+        ids, centers, positions, quaternions = ids[keep], centers[keep], positions[keep], quaternions[keep]
+        self.marker_filter.expire(capture_time)
+        if len(ids):
+            positions, quaternions = self.marker_filter.update(ids, positions, quaternions, capture_time)
+            self.marker_publisher.update(ids, positions, quaternions, capture_time)
+
+            # Solve every object's rigid pose from its visible markers on this frame
+            object_poses, matched_pose = self.pose_tracker.solve(ids, positions)
+            if object_poses and self.websocket and not self.websocket.closed:
+                asyncio.run_coroutine_threadsafe(
+                    self.send_object_poses(object_poses, matched_pose), self.loop)
+
+            for i in range(len(ids)):
+                x, y, z = positions[i]
+                log_message += f"Marker ID: {ids[i]} - Position: X={x:.2f}, Y={y:.2f}, Z={z:.2f}\n"
+        else:
+            log_message += "No ArUco markers detected in this frame.\n"
+            logging.info("No ArUco markers detected.")
+            # Still publish so markers that left the view expire
+            self.marker_publisher.update([], np.zeros((0, 3)), np.zeros((0, 4)), capture_time)
+
+        self.last_detection = (ids, centers, positions)
+        return log_message
+
+    async def send_marker_data(self, marker_ids, positions, quaternions):
+        """Send the given marker poses as a batch to the server."""
         if self.websocket and not self.websocket.closed:
             marker_matrix = [
-                {"marker_id": marker_id, **position}
-                for marker_id, position in self.marker_data.items()
+                {
+                    "marker_id": int(marker_id),
+                    "x": round(x, 2), "y": round(y, 2), "z": round(z, 2),
+                    "qx": round(qx, 3), "qy": round(qy, 3), "qz": round(qz, 3), "qw": round(qw, 3)
+                }
+                for marker_id, (x, y, z), (qx, qy, qz, qw) in zip(marker_ids, positions, quaternions)
             ]
             message = {
                 "command": "stream_data",
-                "stream_name": "aruco_position_stream",
-                "data": marker_matrix
+                "stream_name": "aruco_position_stream"
             }
+            if self.use_delta_stream:
+                message.update(self.delta_encoder.encode(marker_matrix))
+            else:
+                message["data"] = marker_matrix
             await self.websocket.send(json.dumps(message))
-            print(f"Sent marker data: {marker_matrix}")
+            logging.debug(f"Sent marker data: {marker_matrix}")  # Every publish; too chatty for the console
+
+    async def handle_server_message(self, data):
+        if data.get("command") == "request_keyframe" and data.get("stream_name") == "aruco_position_stream":
+            # The server missed a delta; the next send carries the full marker set
+            self.delta_encoder.request_keyframe()
+
+    async def send_object_poses(self, object_poses, matched_pose):
+        """Send the solved object poses and the matched pose name on their own stream."""
+        message = {
+            "command": "stream_data",
+            "stream_name": "object_pose_stream",
+            "data": {
+                "matched_pose": matched_pose,
+                "objects": [
+                    {
+                        "pose_name": pose["pose_name"],
+                        "x": round(pose["position"][0], 3),
+                        "y": round(pose["position"][1], 3),
+                        "z": round(pose["position"][2], 3),
+                        "qx": round(pose["quaternion"][0], 3),
+                        "qy": round(pose["quaternion"][1], 3),
+                        "qz": round(pose["quaternion"][2], 3),
+                        "qw": round(pose["quaternion"][3], 3),
+                        "rms": round(pose["rms"], 4),
+                        "markers": pose["markers"],
+                        "matched": pose["matched"]
+                    }
+                    for pose in object_poses
+                ]
+            }
+        }
+        await self.websocket.send(json.dumps(message))
 
     def batch_send_marker_positions(self):
-        """Send marker data every 0.05 seconds."""
+        """Check for marker changes every 0.05 seconds and send only when something moved."""
         while self.detecting:
             try:
-                # Run send_marker_data asynchronously on WebSocket loop
-                asyncio.run_coroutine_threadsafe(self.send_marker_data(), self.loop)
-                time.sleep(0.05)  # Batch send every 0.05 seconds
+                now = time.time()
+                marker_ids, _, _ = self.marker_publisher.snapshot(now)
+                if len(marker_ids):
+                    # Extrapolate each marker to when this update is expected to be displayed
+                    positions, quaternions = self.marker_filter.predict(marker_ids, now + self.prediction_horizon)
+                else:
+                    positions, quaternions = np.zeros((0, 3)), np.zeros((0, 4))
+
+                if (self.websocket and not self.websocket.closed
+                        and self.marker_publisher.has_changed(marker_ids, positions, quaternions, now)):
+                    self.marker_publisher.mark_sent(marker_ids, positions, quaternions, now)
+                    # Run send_marker_data asynchronously on WebSocket loop
+                    asyncio.run_coroutine_threadsafe(
+                        self.send_marker_data(marker_ids, positions, quaternions), self.loop)
+                time.sleep(0.05)  # Check every 0.05 seconds
             except Exception as e:  
                 print(f"Error sending marker positions: {e}")
                 break
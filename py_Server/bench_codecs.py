@@ -0,0 +1,109 @@
+"""
+Compare the message codecs on aruco_position_stream payloads: encoded size and
+encode/decode time per message.
+
+    python bench_codecs.py                        # Synthetic frames through the producer's encoder
+    python bench_codecs.py --server 127.0.0.1:8080 --count 300
+                                                  # Messages pushed by a running server
+    python bench_codecs.py --capture messages.jsonl
+                                                  # One recorded stream_data message per line
+"""
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+
+import message_codec
+from delta_stream import DeltaEncoder
+from stream_client import StreamClient, markers_to_list
+
+
+def synthetic_messages(count=300, markers=12, seed=0):
+    """Marker frames as the camera clients publish them: keyframes and deltas of jittering markers."""
+    rng = np.random.default_rng(seed)
+    ids = np.arange(markers)
+    positions = rng.uniform(-1.5, 1.5, (markers, 3))
+    quaternions = rng.normal(size=(markers, 4))
+    quaternions /= np.linalg.norm(quaternions, axis=1, keepdims=True)
+    encoder = DeltaEncoder()
+    messages = []
+    for i in range(count):
+        positions += rng.normal(0, 0.002, positions.shape)
+        visible = rng.random(markers) > 0.1  # Some markers drop in and out
+        timestamp = time.time()
+        message = {"command": "stream_data", "stream_name": "aruco_position_stream", "timestamp": timestamp}
+        message.update(encoder.encode(markers_to_list(ids[visible], positions[visible], quaternions[visible]), timestamp))
+        messages.append(message)
+    # What the server pushes to subscribers that start from a snapshot
+    messages.append({"command": "stream_data", "stream_name": "aruco_position_stream",
+                     "data": markers_to_list(ids, positions, quaternions)})
+    return messages
+
+
+def captured_messages(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def live_messages(host, port, count, stream_name="aruco_position_stream"):
+    """Messages as a running server pushes them to a subscriber."""
+    messages = []
+    async with StreamClient(host, port, client_id="bench_codecs") as client:
+        client.on("stream_data", lambda message: messages.append(message)
+                  if message.get("stream_name") == stream_name else None)
+        client.subscribe(stream_name)
+        while len(messages) < count:
+            await asyncio.sleep(0.1)
+    return messages[:count]
+
+
+def bench(codec, messages, repeat=5):
+    encoded = [codec.encode(m) for m in messages]
+    size = sum(len(p) for p in encoded) / len(encoded)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for m in messages:
+            codec.encode(m)
+    encode_us = (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for p in encoded:
+            message_codec.decode(p, codec)
+    decode_us = (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+    return size, encode_us, decode_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--capture", help="JSON lines file of recorded stream_data messages")
+    parser.add_argument("--server", help="host:port of a running server to subscribe to")
+    parser.add_argument("--count", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.capture:
+        messages = captured_messages(args.capture)
+    elif args.server:
+        host, port = args.server.rsplit(":", 1)
+        messages = asyncio.run(live_messages(host, int(port), args.count))
+    else:
+        messages = synthetic_messages(args.count)
+
+    print(f"{len(messages)} aruco_position_stream messages")
+    print(f"{'codec':<10}{'bytes/msg':>12}{'encode us':>12}{'decode us':>12}")
+    for name in message_codec.available_codecs():
+        size, encode_us, decode_us = bench(message_codec.get_codec(name), messages, args.repeat)
+        print(f"{name:<10}{size:>12.0f}{encode_us:>12.1f}{decode_us:>12.1f}")
+    # Baseline: what every message cost before codecs were negotiable
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for m in messages:
+            json.loads(json.dumps(m))
+    print(f"(stdlib json encode+decode: {(time.perf_counter() - start) / (args.repeat * len(messages)) * 1e6:.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import asyncio
+import time
+import logging
+import numpy as np
+
+from marker_pose import rotation_matrices_to_quaternions
+from pose_tracker import fit_rigid_transform
+from message_codec import FanoutMessage
+
+
+def batched_rigid_transforms(model, observed):
+    """Kabsch for a batch of point sets: (B, K, 3) -> rotations (B, 3, 3), translations (B, 3)."""
+    model_center = model.mean(axis=1, keepdims=True)
+    observed_center = observed.mean(axis=1, keepdims=True)
+    covariance = np.swapaxes(model - model_center, 1, 2) @ (observed - observed_center)
+    U, _, Vt = np.linalg.svd(covariance)
+    V = np.swapaxes(Vt, 1, 2)
+    Ut = np.swapaxes(U, 1, 2)
+    d = np.sign(np.linalg.det(V @ Ut))
+    D = np.tile(np.eye(3), (len(model), 1, 1))
+    D[:, 2, 2] = d
+    R = V @ D @ Ut
+    t = observed_center[:, 0, :] - np.einsum('bij,bj->bi', R, model_center[:, 0, :])
+    return R, t
+
+
+def solve_rigid_ransac(source, target, iterations=256, threshold=0.03, score_samples=2000, rng=None):
+    """
+    Robustly fit target ~= R @ source + t.
+
+    All RANSAC hypotheses are drawn from 3-point minimal sets and scored in
+    one vectorized pass (on a random subset of at most `score_samples`
+    points); the best consensus set is then refined with a least-squares fit
+    over all samples. Returns (R, t, inlier mask, rms over inliers) or None.
+    """
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    count = len(source)
+    if count < 3:
+        return None
+
+    rng = rng or np.random.default_rng()
+    samples = np.stack([rng.choice(count, 3, replace=False) for _ in range(iterations)])
+    R, t = batched_rigid_transforms(source[samples], target[samples])
+
+    # Score every hypothesis against the scoring subset at once: (iterations, subset)
+    subset = rng.choice(count, min(count, score_samples), replace=False)
+    predicted = np.einsum('bij,nj->bni', R, source[subset]) + t[:, None, :]
+    errors = np.linalg.norm(predicted - target[subset][None], axis=2)
+    best = int(np.argmax((errors < threshold).sum(axis=1)))
+    inliers = np.linalg.norm(source @ R[best].T + t[best] - target, axis=1) < threshold
+    if inliers.sum() < 3:
+        return None
+
+    # Least-squares refinement, then re-evaluate the consensus once
+    for _ in range(2):
+        R_best, t_best, _ = fit_rigid_transform(source[inliers], target[inliers])
+        residuals = np.linalg.norm(source @ R_best.T + t_best - target, axis=1)
+        refined = residuals < threshold
+        if refined.sum() < 3:
+            break
+        inliers = refined
+
+    rms = float(np.sqrt(np.mean(residuals[inliers] ** 2)))
+    return R_best, t_best, inliers, rms
+
+
+class CalibrationService:
+    """
+    Solves the camera-to-VR extrinsic transform on the server.
+
+    Camera observations come from `aruco_position_stream`; the VR side sends
+    `calibration_sample` messages with the world positions of the same marker
+    ids (e.g. anchors placed on the markers, see CalibrationWebSocketClient in
+    Unity). Samples are paired by marker id and time, accumulated in a ring
+    buffer, and the transform is re-solved in the background whenever new
+    samples arrive. Results are pushed to every client and kept in the
+    `calibration_result` stream; `request_calibration` answers only the asker.
+    """
+
+    def __init__(self, server, capacity=20000, max_skew=0.1, solve_interval=1.0, threshold=0.03,
+                 still_tolerance=0.005, max_age=1.5):
+        self.server = server
+        self.capacity = capacity
+        self.max_skew = max_skew  # Max seconds between a VR sample and the camera observation it pairs with
+        self.solve_interval = solve_interval
+        self.threshold = threshold  # RANSAC inlier distance (meters)
+        # Marker streams are only sent when something moves (plus a keepalive), so a marker that has
+        # not moved more than `still_tolerance` is taken to be where it was last reported until
+        # `max_age` seconds pass without any update
+        self.still_tolerance = still_tolerance
+        self.max_age = max_age
+
+        self.camera_points = np.zeros((capacity, 3), dtype=np.float64)
+        self.vr_points = np.zeros((capacity, 3), dtype=np.float64)
+        self.count = 0
+        self.write_index = 0
+        self.samples_since_solve = 0
+
+        self.latest_observations = {}  # marker_id -> (unchanged since, last reported, xyz)
+        self.result = None
+
+    def add_camera_observations(self, markers, timestamp=None):
+        """
+        Remember the latest camera-frame position of every marker in an aruco stream update
+        (the stream carries the full marker set, so markers missing from it are forgotten).
+        """
+        timestamp = timestamp or time.time()
+        if not isinstance(markers, list):
+            return
+        observations = {}
+        for marker in markers:
+            try:
+                marker_id = int(marker["marker_id"])
+                position = (float(marker["x"]), float(marker["y"]), float(marker["z"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            previous = self.latest_observations.get(marker_id)
+            if previous is not None and np.linalg.norm(np.subtract(position, previous[2])) <= self.still_tolerance:
+                observations[marker_id] = (previous[0], timestamp, position)  # Still there since then
+            else:
+                observations[marker_id] = (timestamp, timestamp, position)
+        self.latest_observations = observations
+
+    def add_vr_samples(self, markers, timestamp=None):
+        """Pair VR-side marker positions with recent camera observations. Returns the number paired."""
+        timestamp = timestamp or time.time()
+        paired = 0
+        for marker in markers or []:
+            try:
+                marker_id = int(marker["marker_id"])
+                vr_point = (float(marker["x"]), float(marker["y"]), float(marker["z"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            observation = self.latest_observations.get(marker_id)
+            if observation is None:
+                continue
+            since, reported, position = observation
+            # The marker must have been at that position when the VR sample was taken: not moved
+            # into it after the sample, and still reported recently enough to be there now
+            if timestamp < since - self.max_skew or timestamp - reported > self.max_age:
+                continue
+
+            self.camera_points[self.write_index] = position
+            self.vr_points[self.write_index] = vr_point
+            self.write_index = (self.write_index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            paired += 1
+
+        self.samples_since_solve += paired
+        return paired
+
+    def reset(self):
+        self.count = 0
+        self.write_index = 0
+        self.samples_since_solve = 0
+        self.result = None
+
+    def solve(self, camera_points, vr_points):
+        """Run the robust fit over a snapshot of the samples (blocking; call from an executor)."""
+        solution = solve_rigid_ransac(camera_points, vr_points, threshold=self.threshold)
+        if solution is None:
+            return None
+
+        R, t, inliers, rms = solution
+        matrix = np.eye(4)
+        matrix[:3, :3] = R
+        matrix[:3, 3] = t
+        quaternion = rotation_matrices_to_quaternions(R[None])[0]
+        return {
+            "position": {"x": float(t[0]), "y": float(t[1]), "z": float(t[2])},
+            "rotation": {"x": float(quaternion[0]), "y": float(quaternion[1]),
+                         "z": float(quaternion[2]), "w": float(quaternion[3])},
+            "matrix": matrix.tolist(),
+            "rms": rms,
+            "inliers": int(inliers.sum()),
+            "samples": len(camera_points),
+            "timestamp": time.time()
+        }
+
+    async def run(self):
+        """Background refinement loop; re-solves whenever new samples were collected."""
+        loop = asyncio.get_running_loop()
+        while not self.server.should_stop:
+            await asyncio.sleep(self.solve_interval)
+            if self.samples_since_solve == 0 or self.count < 3:
+                continue
+            self.samples_since_solve = 0
+            # Snapshot on the event loop thread so new samples can keep arriving while solving
+            camera_points = self.camera_points[:self.count].copy()
+            vr_points = self.vr_points[:self.count].copy()
+            try:
+                result = await loop.run_in_executor(None, self.solve, camera_points, vr_points)
+            except Exception as e:
+                logging.error(f"Calibration solve failed: {e}")
+                continue
+            if result is None:
+                continue
+
+            self.result = result
+            await self.publish()
+
+    async def publish(self, client_id=None):
+        """
+        Store the current result as a stream and push it to everyone, or only to `client_id`
+        when it asked (an error reply if nothing is solved yet, nothing if it disconnected).
+        """
+        if client_id is not None and client_id not in self.server.clients:
+            return
+        if self.result is None:
+            if client_id is not None:
+                await self.server.send_error(client_id, "request_calibration",
+                                             f"No calibration solved yet ({self.count} sample(s))")
+            return
+        if "calibration_result" not in self.server.streams:
+            self.server.streams["calibration_result"] = self.result
+            self.server.app.refresh_stream_dropdown()
+        self.server.streams["calibration_result"] = self.result
+        self.server.subscriptions.notify("calibration_result")
+
+        message = FanoutMessage({"command": "calibration_result", "data": self.result})
+        targets = list(self.server.clients) if client_id is None else [client_id]
+        for target_id in targets:
+            try:
+                await self.server.send_message(target_id, message)
+            except Exception as e:
+                logging.warning(f"Could not push calibration result: {e}")
+
+        if client_id is None:
+            log_message = (f"Calibration updated: rms {self.result['rms']:.4f} m, "
+                           f"{self.result['inliers']}/{self.result['samples']} inliers")
+            logging.info(log_message)
+            self.server.app.log_message(log_message)
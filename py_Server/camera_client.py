@@ -10,6 +10,7 @@ import cv2
 from PIL import Image, ImageTk
 import base64
 import time  
+from shm_transport import FrameRingWriter, ring_name
 
 class CameraClient:
     def __init__(self):
@@ -52,7 +53,23 @@ class CameraClient:
         self.depth_image = None
 
         # Start the RealSense stream
-        self.pipeline.start(self.config)
+        profile = self.pipeline.start(self.config)
+
+        # Depth is aligned to the color stream, so both share the color camera's pixel grid and
+        # the server can color point clouds straight from stream_rgb
+        self.align = rs.align(rs.stream.color)
+        depth_intrinsics = profile.get_stream(rs.stream.color).as_video_stream_profile().get_intrinsics()
+
+        # Intrinsics, scale and the matching color stream travel with every depth frame
+        self.depth_info = {
+            "color_stream": "stream_rgb",
+            "intrinsics": {
+                "width": depth_intrinsics.width, "height": depth_intrinsics.height,
+                "fx": depth_intrinsics.fx, "fy": depth_intrinsics.fy,
+                "ppx": depth_intrinsics.ppx, "ppy": depth_intrinsics.ppy
+            },
+            "depth_units": profile.get_device().first_depth_sensor().get_depth_scale()
+        }
         self.running = True
         threading.Thread(target=self.update_frames, daemon=True).start()
 
@@ -60,6 +77,10 @@ class CameraClient:
         self.last_frame_time = time.time()  # Track the last frame sent time
         self.frame_interval = 0.05  # Limit to 10 frames per second (0.1 sec interval)
 
+        # Same-host servers get frames through shared memory instead of JPEG/base64 over the socket
+        self.use_local_transport = False
+        self.frame_rings = {}  # stream name -> FrameRingWriter
+
     def start_connection(self):
         host = self.host_entry.get()
         port = self.port_entry.get()
@@ -69,6 +90,8 @@ class CameraClient:
             messagebox.showerror("Input Error", "Please provide host, port, and client ID.")
             return
 
+        self.use_local_transport = host in ("127.0.0.1", "localhost")
+
         # Start the connection in a new thread to avoid blocking the GUI
         threading.Thread(target=self.run_client_thread, args=(host, port, client_id), daemon=True).start()
 
@@ -97,6 +120,7 @@ class CameraClient:
             async with websockets.connect(uri) as websocket:
                 self.websocket = websocket
                 print(f"Connected to server at {uri}")
+                await self.send_id(websocket, client_id)  # Unprompted, saves the REQUEST_ID round trip
                 await self.listen_to_server(websocket)
         except Exception as e:
             messagebox.showerror("Connection Error", f"Could not connect to server: {e}")
@@ -121,12 +145,38 @@ class CameraClient:
             "frame_type": frame_type,
             "data": base64_frame
         }
+        if frame_type == "depth":
+            message.update(self.depth_info)
         await websocket.send(json.dumps(message))
         print(f"Sent {frame_type} frame to server")
 
+    def write_local_frame(self, frame, frame_type, stream_name):
+        """Write the frame into this stream's shared-memory ring and announce the slot to the server."""
+        ring = self.frame_rings.get(stream_name)
+        if ring is not None and frame.nbytes > ring.slot_size:
+            ring.close()  # Resolution went up; readers reopen the new block by its generation
+            ring = None
+        if ring is None:
+            ring = self.frame_rings[stream_name] = FrameRingWriter(ring_name(stream_name), frame.nbytes)
+        timestamp = time.time()
+        slot, seq = ring.write(frame, timestamp)
+        message = {
+            "command": "stream_frame_local",
+            "stream_name": stream_name,
+            "frame_type": frame_type,
+            "shm_name": ring.name,
+            "generation": ring.generation,
+            "slot": slot,
+            "seq": seq,
+            "timestamp": timestamp
+        }
+        if frame_type == "depth":
+            message.update(self.depth_info)
+        asyncio.run_coroutine_threadsafe(self.websocket.send(json.dumps(message)), self.loop)
+
     def update_frames(self):
         while self.running:
-            frames = self.pipeline.wait_for_frames()
+            frames = self.align.process(self.pipeline.wait_for_frames())
             color_frame = frames.get_color_frame()
             depth_frame = frames.get_depth_frame()
 
@@ -145,6 +195,12 @@ class CameraClient:
             self.depth_image = ImageTk.PhotoImage(Image.fromarray(depth_display))
             self.depth_label.configure(image=self.depth_image)
 
+            # Local consumers read straight from shared memory, so no throttling is needed
+            if self.use_local_transport and self.websocket and self.websocket.open:
+                self.write_local_frame(color_image, "rgb", "stream_rgb")
+                self.write_local_frame(depth_image, "depth", "stream_depth")
+                continue
+
             # Throttle frame sending to 10 FPS (0.1 sec interval)
             current_time = time.time()
             if current_time - self.last_frame_time >= self.frame_interval:
@@ -164,6 +220,8 @@ class CameraClient:
     def on_close(self):
         self.running = False
         self.pipeline.stop()
+        for ring in self.frame_rings.values():
+            ring.close()
         if self.websocket and not self.websocket.closed:
             self.loop.run_until_complete(self.websocket.close())
         self.window.destroy()
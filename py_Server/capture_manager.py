@@ -0,0 +1,206 @@
+import asyncio
+import argparse
+import time
+import logging
+import multiprocessing
+import pyrealsense2 as rs
+
+from marker_detection import ArucoPoseDetector
+from marker_filter import MarkerFilter
+from marker_publisher import MarkerPublisher
+from depth_filter import DepthFilter
+from realsense_capture import RealSenseCapture
+from stream_client import StreamClient
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+DEFAULT_OPTIONS = {
+    "width": 640,
+    "height": 480,
+    "fps": 30,
+    "marker_length": 0.05,
+    "depth_weight": 0.5,
+    "reconnect_interval": 2.0
+}
+
+
+def list_devices():
+    """Serial numbers and names of every connected RealSense device."""
+    devices = []
+    for device in rs.context().query_devices():
+        devices.append((device.get_info(rs.camera_info.serial_number), device.get_info(rs.camera_info.name)))
+    return devices
+
+
+def stream_name_for(serial, kind="aruco"):
+    return f"cam/{serial}/{kind}"
+
+
+class CameraWorker:
+    """
+    Capture and marker detection for one RealSense device, run inside its own process.
+
+    The worker owns its pipeline and its own server connection (client id
+    `cam-<serial>`) and publishes delta-encoded marker poses on
+    `cam/<serial>/aruco`, with the capture timestamp of the frame.
+    """
+
+    def __init__(self, serial, host, port, stop_event, options=None):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.client_id = f"cam-{serial}"
+        self.stream_name = stream_name_for(serial)
+        self.stop_event = stop_event
+        self.options = dict(DEFAULT_OPTIONS, **(options or {}))
+
+        # Callback-driven capture: the sensor runs at full rate and detection takes the newest frameset
+        self.capture = RealSenseCapture(serial=serial, width=self.options["width"],
+                                        height=self.options["height"], fps=self.options["fps"])
+
+        self.detector = ArucoPoseDetector(marker_length=self.options["marker_length"],
+                                          depth_weight=self.options["depth_weight"])
+        self.depth_filter = DepthFilter(decimation=1)  # Full resolution: depth is sampled at color pixels
+        self.marker_filter = MarkerFilter(max_markers=250)
+        self.marker_publisher = MarkerPublisher(capacity=250)
+        self.client = None
+
+    def run(self):
+        logging.info(f"[{self.serial}] Worker started")
+        try:
+            self.capture.start()
+        except Exception as e:
+            logging.error(f"[{self.serial}] Error starting RealSense pipeline: {e}")
+            return
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.capture.stop()
+            self.capture.log_stats(f"[{self.serial}] ")
+            logging.info(f"[{self.serial}] RealSense pipeline stopped.")
+
+    async def serve(self):
+        # The client reconnects (and restarts the delta stream with a keyframe) on its own
+        self.client = StreamClient(self.host, self.port, self.client_id,
+                                   reconnect_max=self.options["reconnect_interval"])
+        await self.client.start(wait=False)
+        try:
+            await self.capture_loop()
+        finally:
+            await self.client.close()
+
+    async def capture_loop(self):
+        loop = asyncio.get_running_loop()
+        while not self.stop_event.is_set():
+            # get() blocks (and aligns); keep the event loop free for the connection
+            frame = await loop.run_in_executor(None, self.capture.get, 1.0)
+            if frame is None or not self.client.connected.is_set():
+                continue
+            capture_time = frame.arrival_time
+
+            ids, _, positions, quaternions = self.detector.detect(frame.color, frame.depth, self.depth_filter)
+            keep = self.marker_filter.in_range(ids)
+            ids, positions, quaternions = ids[keep], positions[keep], quaternions[keep]
+            self.marker_filter.expire(capture_time)
+            if len(ids):
+                positions, quaternions = self.marker_filter.update(ids, positions, quaternions, capture_time)
+            self.marker_publisher.update(ids, positions, quaternions, capture_time)
+
+            ids, positions, quaternions = self.marker_publisher.snapshot(capture_time)
+            if not self.marker_publisher.has_changed(ids, positions, quaternions, capture_time):
+                continue
+            self.marker_publisher.mark_sent(ids, positions, quaternions, capture_time)
+            # The keepalive tells the server how long a static scene may go without an update
+            await self.client.publish_markers(ids, positions, quaternions, self.stream_name, capture_time,
+                                              serial=self.serial, keepalive=self.marker_publisher.keepalive)
+
+
+def run_camera_worker(serial, host, port, stop_event, options=None):
+    """Process entry point (module level so it can be pickled on spawn-based platforms)."""
+    CameraWorker(serial, host, port, stop_event, options).run()
+
+
+class CaptureManager:
+    """
+    Runs one worker process per RealSense device so capture and detection of
+    each camera get their own interpreter (and CPU core) instead of sharing a GIL.
+    Workers that exit unexpectedly are restarted.
+    """
+
+    def __init__(self, host, port, serials=None, options=None, restart_interval=5.0):
+        self.host = host
+        self.port = port
+        self.serials = serials
+        self.options = options or {}
+        self.restart_interval = restart_interval
+
+        self.stop_event = multiprocessing.Event()
+        self.workers = {}  # serial -> Process
+
+    def start(self):
+        available = dict(list_devices())
+        serials = self.serials or list(available)
+        if not serials:
+            logging.warning("No RealSense devices found.")
+        for serial in serials:
+            if serial not in available:
+                logging.warning(f"RealSense device {serial} not connected, skipping")
+                continue
+            logging.info(f"Starting worker for {available[serial]} ({serial}) -> {stream_name_for(serial)}")
+            self.start_worker(serial)
+
+    def start_worker(self, serial):
+        process = multiprocessing.Process(
+            target=run_camera_worker,
+            args=(serial, self.host, self.port, self.stop_event, self.options),
+            name=f"camera-{serial}",
+            daemon=True)
+        process.start()
+        self.workers[serial] = process
+
+    def supervise(self):
+        """Block until stopped, restarting any worker that died (e.g. camera unplugged and replugged)."""
+        try:
+            while not self.stop_event.is_set():
+                time.sleep(self.restart_interval)
+                available = dict(list_devices())
+                for serial, process in list(self.workers.items()):
+                    if not process.is_alive() and serial in available:
+                        logging.warning(f"Worker for {serial} exited with code {process.exitcode}, restarting")
+                        self.start_worker(serial)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+        for serial, process in self.workers.items():
+            process.join(timeout=3.0)
+            if process.is_alive():
+                logging.warning(f"Worker for {serial} did not stop, terminating")
+                process.terminate()
+        self.workers.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run marker detection on every connected RealSense camera.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--serial", action="append", dest="serials",
+                        help="Only use this device (repeatable); default is every connected device")
+    parser.add_argument("--list", action="store_true", help="List connected devices and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        for serial, name in list_devices():
+            print(f"{serial}\t{name}")
+        return
+
+    manager = CaptureManager(args.host, args.port, args.serials)
+    manager.start()
+    manager.supervise()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import math
+import time
+from collections import deque
+
+# Delta-encoded `stream_data` payloads for lists of keyed items (e.g. markers):
+#   keyframe: {"encoding": "keyframe", "seq": n, "data": [full item list]}
+#   delta:    {"encoding": "delta", "seq": n, "base_seq": m, "upserts": [changed items], "removed": [keys]}
+# A delta only applies on top of the state at `base_seq`; anything else is a gap and needs a keyframe.
+
+
+class DeltaEncoder:
+    """
+    Producer side: turns full item lists into keyframes and deltas.
+
+    A keyframe with the full list goes out every `keyframe_interval` seconds
+    (or when one is requested). In between, only items that were added,
+    moved more than `threshold` meters, rotated (any quaternion component)
+    more than `rotation_threshold`, or disappeared are sent. Changes are
+    measured against the last value sent, so slow drift still gets through.
+    """
+
+    def __init__(self, key="marker_id", threshold=0.005, rotation_threshold=0.01, keyframe_interval=1.0):
+        self.key = key
+        self.threshold = threshold
+        self.rotation_threshold = rotation_threshold
+        self.keyframe_interval = keyframe_interval
+
+        self.seq = 0
+        self.sent = {}  # key -> item as last sent
+        self.last_keyframe = 0.0
+        self.keyframe_requested = True  # Always start with a keyframe
+
+    def request_keyframe(self):
+        self.keyframe_requested = True
+
+    def encode(self, items, now=None):
+        """Return the payload fields (encoding, seq, ...) to merge into a `stream_data` message."""
+        now = now or time.time()
+        current = {item[self.key]: item for item in items}
+        self.seq += 1
+
+        if self.keyframe_requested or now - self.last_keyframe >= self.keyframe_interval:
+            self.keyframe_requested = False
+            self.last_keyframe = now
+            self.sent = current
+            return {"encoding": "keyframe", "seq": self.seq, "data": list(current.values())}
+
+        upserts = [item for k, item in current.items() if k not in self.sent or self.has_moved(self.sent[k], item)]
+        removed = [k for k in self.sent if k not in current]
+        for item in upserts:
+            self.sent[item[self.key]] = item
+        for k in removed:
+            del self.sent[k]
+        return {"encoding": "delta", "seq": self.seq, "base_seq": self.seq - 1,
+                "upserts": upserts, "removed": removed}
+
+    def has_moved(self, old, new):
+        distance = math.sqrt(sum((new.get(a, 0.0) - old.get(a, 0.0)) ** 2 for a in ("x", "y", "z")))
+        rotation = max(abs(new.get(a, 0.0) - old.get(a, 0.0)) for a in ("qx", "qy", "qz", "qw"))
+        return distance > self.threshold or rotation > self.rotation_threshold
+
+
+class DeltaStreamState:
+    """
+    Server/consumer side: the full state reconstructed from keyframes and deltas.
+
+    Recent transitions are kept (up to `history` of them) so a consumer that
+    is only a few updates behind can be answered with a merged delta instead
+    of the full snapshot.
+    """
+
+    def __init__(self, key="marker_id", history=64):
+        self.key = key
+        self.seq = None
+        self.items = {}  # key -> latest item
+        self.history = deque(maxlen=history)  # (base_seq, seq, upserts dict, removed set)
+
+    def apply(self, message):
+        """Apply a keyframe or delta payload. Returns False if a delta does not follow the current state."""
+        encoding = message.get("encoding")
+        seq = message.get("seq")
+
+        if encoding == "keyframe":
+            items = {item[self.key]: item for item in message.get("data") or []}
+            if self.seq is None or seq is None or seq <= self.seq:
+                # First keyframe, or the producer restarted its sequence
+                self.history.clear()
+            else:
+                upserts = {k: v for k, v in items.items() if self.items.get(k) != v}
+                removed = set(self.items) - set(items)
+                self.history.append((self.seq, seq, upserts, removed))
+            self.items = items
+            self.seq = seq
+            return True
+
+        if encoding == "delta":
+            if self.seq is None or message.get("base_seq") != self.seq:
+                return False
+            upserts = {item[self.key]: item for item in message.get("upserts") or []}
+            removed = set(message.get("removed") or [])
+            self.items.update(upserts)
+            for k in removed:
+                self.items.pop(k, None)
+            self.history.append((self.seq, seq, upserts, removed))
+            self.seq = seq
+            return True
+
+        return False
+
+    def delta_since(self, since_seq):
+        """Merged (upserts list, removed list) from `since_seq` to now, or None if it is too old or unknown."""
+        if self.seq is None:
+            return None
+        if since_seq == self.seq:
+            return [], []
+
+        start = None
+        for i, (base_seq, _, _, _) in enumerate(self.history):
+            if base_seq == since_seq:
+                start = i
+                break
+        if start is None:
+            return None
+
+        upserts = {}
+        removed = set()
+        for _, _, step_upserts, step_removed in list(self.history)[start:]:
+            for k in step_removed:
+                upserts.pop(k, None)
+                removed.add(k)
+            for k, item in step_upserts.items():
+                upserts[k] = item
+                removed.discard(k)
+        return list(upserts.values()), list(removed)
+
+    def snapshot(self):
+        return list(self.items.values())
@@ -0,0 +1,212 @@
+import numbers
+import threading
+import numpy as np
+
+from marker_pose import CameraIntrinsics
+
+
+def sample_depth(depth_image, pixels, depth_units, radius=2):
+    """
+    Robust depth (meters) at integer (N, 2) pixels: the median of the valid
+    (non-zero) readings in a (2 * radius + 1)^2 patch, or 0 if none are valid.
+    Works on small per-call arrays (markers x patch pixels), not on whole images.
+    """
+    pixels = np.asarray(pixels, dtype=np.int64).reshape(-1, 2)
+    if len(pixels) == 0:
+        return np.zeros(0)
+    offsets = np.arange(-radius, radius + 1)
+    du, dv = np.meshgrid(offsets, offsets)
+    u = np.clip(pixels[:, 0:1] + du.ravel(), 0, depth_image.shape[1] - 1)
+    v = np.clip(pixels[:, 1:2] + dv.ravel(), 0, depth_image.shape[0] - 1)
+    patches = depth_image[v, u].astype(np.float64)  # (N, patch pixels)
+    patches[patches == 0] = np.nan
+    with np.errstate(all='ignore'):
+        depth = np.nanmedian(patches, axis=1)  # NaN (all invalid) -> 0 below
+    return np.nan_to_num(depth, nan=0.0) * depth_units
+
+
+def check_stage_options(options):
+    """
+    Validated copy of depth filter stage settings; raises ValueError for unknown
+    stages and for values the filter cannot run with.
+    """
+    checked = {}
+    for name, value in options.items():
+        if name in ("decimation", "hole_fill"):
+            minimum = 1 if name == "decimation" else 0
+            if isinstance(value, bool) or not isinstance(value, numbers.Integral) or value < minimum:
+                raise ValueError(f"{name} must be an integer >= {minimum}, got {value!r}")
+            value = int(value)
+        elif name in ("edge_threshold", "temporal_alpha", "temporal_delta"):
+            if value is None and name != "temporal_delta":
+                checked[name] = None  # Stage disabled
+                continue
+            if isinstance(value, bool) or not isinstance(value, numbers.Real) or not value > 0:
+                raise ValueError(f"{name} must be a positive number{'' if name == 'temporal_delta' else ' or null'}, "
+                                 f"got {value!r}")
+            if name == "temporal_alpha" and value > 1:
+                raise ValueError(f"temporal_alpha must be at most 1, got {value!r}")
+            value = float(value)
+        else:
+            raise ValueError(f"unknown depth filter option {name!r}")
+        checked[name] = value
+    return checked
+
+
+class DepthFilter:
+    """
+    Per-stream depth preprocessing on raw uint16 depth images, run once per frame.
+
+    Stages (each can be switched off):
+      decimation       average the valid pixels of each k x k block (k = `decimation`)
+      outlier removal  drop "flying" pixels that disagree with all four neighbours by
+                       more than `edge_threshold` (relative); real edges agree with one side
+      temporal         exponential smoothing with `temporal_alpha`, reset where the depth
+                       jumps by more than `temporal_delta` (relative) so motion is not smeared
+      hole filling     fill zero pixels from the nearest valid 4-neighbour, `hole_fill` passes
+    The working images, history, masks and output are allocated once per input
+    shape and every stage after decimation writes into them in place; decimation
+    itself still creates two reduced-size temporaries (block sums and counts).
+    """
+
+    def __init__(self, decimation=1, edge_threshold=0.05, temporal_alpha=0.4, temporal_delta=0.05, hole_fill=1):
+        check_stage_options({"decimation": decimation, "edge_threshold": edge_threshold,
+                             "temporal_alpha": temporal_alpha, "temporal_delta": temporal_delta,
+                             "hole_fill": hole_fill})
+        self.decimation = decimation
+        self.edge_threshold = edge_threshold  # None disables outlier removal
+        self.temporal_alpha = temporal_alpha  # None disables temporal smoothing
+        self.temporal_delta = temporal_delta
+        self.hole_fill = hole_fill  # Number of fill passes, 0 disables
+
+        self.shape = None
+        self.has_history = False
+        self.pending = {}  # Settings changed since the last frame
+        self.lock = threading.Lock()  # configure runs on the event loop, process in an executor
+
+    def configure(self, **options):
+        """
+        Change stage settings at runtime (e.g. from a server command); raises ValueError for bad
+        settings, leaving the current ones in place. Takes effect from the next frame.
+        """
+        options = check_stage_options(options)
+        with self.lock:
+            self.pending.update(options)
+
+    def apply_pending(self):
+        with self.lock:
+            options, self.pending = self.pending, {}
+        if options:
+            for name, value in options.items():
+                setattr(self, name, value)
+            self.shape = None  # Reallocate for the new settings
+            self.has_history = False
+
+    def allocate(self, shape):
+        k = self.decimation
+        height, width = shape[0] // k, shape[1] // k
+        self.shape = shape
+        self.depth = np.zeros((height, width), dtype=np.float32)
+        self.previous = np.zeros((height, width), dtype=np.float32)
+        self.scratch = np.zeros((height, width), dtype=np.float32)
+        self.padded = np.zeros((height + 2, width + 2), dtype=np.float32)
+        self.limit = np.zeros((height, width), dtype=np.float32)
+        self.reject = np.zeros((height, width), dtype=bool)
+        self.mask = np.zeros((height, width), dtype=bool)
+        self.holes = np.zeros((height, width), dtype=bool)
+        self.output = np.zeros((height, width), dtype=np.uint16)
+        self.has_history = False
+
+    def output_intrinsics(self, intrinsics):
+        """Intrinsics of the filtered image (scaled by the decimation factor)."""
+        if self.decimation == 1:
+            return intrinsics
+        k = self.decimation
+        return CameraIntrinsics(intrinsics.width // k, intrinsics.height // k, intrinsics.fx / k, intrinsics.fy / k,
+                                (intrinsics.ppx + 0.5) / k - 0.5, (intrinsics.ppy + 0.5) / k - 0.5, intrinsics.coeffs)
+
+    def process(self, depth_image):
+        """Filter a raw uint16 depth image; returns a uint16 image in the same units (reused buffer)."""
+        self.apply_pending()
+        if self.shape != depth_image.shape:
+            self.allocate(depth_image.shape)
+
+        self.decimate(depth_image)
+        if self.edge_threshold is not None:
+            self.remove_outliers()
+        if self.temporal_alpha is not None:
+            self.smooth_temporal()
+        for _ in range(self.hole_fill):
+            self.fill_holes()
+
+        np.rint(self.depth, out=self.scratch)
+        self.output[...] = self.scratch
+        return self.output
+
+    def decimate(self, depth_image):
+        k = self.decimation
+        if k == 1:
+            self.depth[...] = depth_image
+            return
+        height, width = self.depth.shape
+        blocks = depth_image[:height * k, :width * k].reshape(height, k, width, k)
+        total = blocks.sum(axis=(1, 3), dtype=np.float32)
+        count = np.count_nonzero(blocks, axis=(1, 3))
+        np.divide(total, np.maximum(count, 1), out=self.depth)
+
+    def neighbours(self):
+        """Views of the up, down, left and right neighbours of every pixel (edges replicate)."""
+        p = self.padded
+        p[1:-1, 1:-1] = self.depth
+        p[0, 1:-1] = self.depth[0]
+        p[-1, 1:-1] = self.depth[-1]
+        p[1:-1, 0] = self.depth[:, 0]
+        p[1:-1, -1] = self.depth[:, -1]
+        return p[:-2, 1:-1], p[2:, 1:-1], p[1:-1, :-2], p[1:-1, 2:]
+
+    def remove_outliers(self):
+        np.multiply(self.depth, self.edge_threshold, out=self.limit)
+        np.greater(self.depth, 0, out=self.reject)
+        for neighbour in self.neighbours():
+            np.subtract(self.depth, neighbour, out=self.scratch)
+            np.abs(self.scratch, out=self.scratch)
+            np.greater(self.scratch, self.limit, out=self.mask)
+            self.reject &= self.mask
+        np.copyto(self.depth, 0.0, where=self.reject)
+
+    def smooth_temporal(self):
+        if not self.has_history:
+            self.previous[...] = self.depth
+            self.has_history = True
+            return
+        # Blend only where both frames are valid and the change is small
+        np.subtract(self.depth, self.previous, out=self.scratch)
+        np.abs(self.scratch, out=self.scratch)
+        np.multiply(self.depth, self.temporal_delta, out=self.limit)
+        blend = self.reject  # Free until the next frame's outlier pass
+        np.less(self.scratch, self.limit, out=blend)
+        np.greater(self.depth, 0, out=self.mask)
+        blend &= self.mask
+        np.greater(self.previous, 0, out=self.mask)
+        blend &= self.mask
+        alpha = self.temporal_alpha
+        np.multiply(self.depth, alpha, out=self.scratch)
+        np.multiply(self.previous, 1.0 - alpha, out=self.limit)
+        self.scratch += self.limit
+        np.copyto(self.depth, self.scratch, where=blend)
+        self.previous[...] = self.depth
+
+    def fill_holes(self):
+        np.equal(self.depth, 0, out=self.holes)
+        if not self.holes.any():
+            return
+        # Nearest valid neighbour: the smallest non-zero depth around the hole
+        self.scratch.fill(np.inf)
+        for neighbour in self.neighbours():
+            self.limit.fill(np.inf)
+            np.greater(neighbour, 0, out=self.mask)
+            np.copyto(self.limit, neighbour, where=self.mask)
+            np.minimum(self.scratch, self.limit, out=self.scratch)
+        np.isfinite(self.scratch, out=self.mask)
+        self.mask &= self.holes
+        np.copyto(self.depth, self.scratch, where=self.mask)
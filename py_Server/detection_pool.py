@@ -0,0 +1,194 @@
+import os
+import time
+import queue
+import logging
+import multiprocessing
+from collections import deque
+from multiprocessing import shared_memory
+import numpy as np
+
+from marker_detection import ArucoPoseDetector
+
+
+def slot_views(buffer, slot_count, width, height):
+    """Color (slots, H, W, 3) uint8 and depth (slots, H, W) uint16 arrays laid out in one shared buffer."""
+    color = np.ndarray((slot_count, height, width, 3), dtype=np.uint8, buffer=buffer)
+    depth = np.ndarray((slot_count, height, width), dtype=np.uint16, buffer=buffer, offset=color.nbytes)
+    return color, depth
+
+
+def detection_worker(shm_name, slot_count, width, height, tasks, results, detector_options):
+    """Worker process: detect markers in the frame slot named by each task and report back."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    color, depth = slot_views(shm.buf, slot_count, width, height)
+    detector = ArucoPoseDetector(**detector_options)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            frame_number, slot, timestamp, depth_units, intrinsics, max_latency = task
+            # Under overload, answering late is worse than not answering: skip and free the slot
+            if time.time() - timestamp > max_latency:
+                results.put((frame_number, slot, timestamp, None))
+                continue
+            try:
+                detection = detector.detect_image(color[slot], depth[slot], depth_units, intrinsics)
+            except Exception as e:
+                logging.error(f"Detection failed on frame {frame_number}: {e}")
+                detection = None
+            results.put((frame_number, slot, timestamp, detection))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        del color, depth  # Views must be released before the mapping is closed
+        shm.close()
+
+
+class DetectionPool:
+    """
+    Marker detection spread over worker processes.
+
+    The capture thread copies each aligned color/depth pair into a free
+    shared-memory slot and queues only the slot index, so frames are never
+    pickled. Results are released in frame order. When every slot is busy
+    the new frame is dropped, and workers skip frames older than
+    `max_latency` seconds, so latency stays bounded when detection cannot
+    keep up. Workers that die are restarted, and the slot of a frame that
+    timed out is reused: each slot remembers the frame it holds, so a late
+    result of that frame is discarded instead of freeing the slot twice.
+    """
+
+    def __init__(self, width, height, workers=None, slots=None, max_latency=0.1, stall_timeout=1.0,
+                 detector_options=None):
+        self.width = width
+        self.height = height
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.slot_count = slots or 2 * self.workers
+        self.max_latency = max_latency
+        self.stall_timeout = stall_timeout  # Give up on a frame whose worker never answered
+
+        frame_bytes = height * width * 3 + height * width * 2
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slot_count * frame_bytes)
+        self.color, self.depth = slot_views(self.shm.buf, self.slot_count, width, height)
+        self.free_slots = deque(range(self.slot_count))
+        self.slot_frames = [None] * self.slot_count  # Frame number each busy slot holds
+
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.detector_options = detector_options or {}
+        self.processes = [self.start_worker(i) for i in range(self.workers)]
+
+        # Reorder buffer: frames in submission order and results that arrived out of order
+        self.pending = deque()
+        self.submitted_at = {}
+        self.finished = {}
+
+        self.frames_submitted = 0
+        self.frames_dropped = 0  # No free slot at submit time
+        self.frames_skipped = 0  # Too old by the time a worker got to them
+
+    def start_worker(self, index):
+        process = multiprocessing.Process(
+            target=detection_worker,
+            args=(self.shm.name, self.slot_count, self.width, self.height, self.tasks, self.results,
+                  self.detector_options),
+            name=f"detection-{index}",
+            daemon=True)
+        process.start()
+        return process
+
+    def restart_dead_workers(self):
+        """Replace workers that exited (e.g. crashed in native detection code); their frames time out."""
+        for i, process in enumerate(self.processes):
+            if not process.is_alive():
+                logging.warning(f"Detection worker {process.name} exited with code {process.exitcode}; restarting")
+                process.join(timeout=0)
+                self.processes[i] = self.start_worker(i)
+
+    def release(self, slot, frame_number):
+        """Return a slot to the free list if it still holds `frame_number`."""
+        if self.slot_frames[slot] == frame_number:
+            self.slot_frames[slot] = None
+            self.free_slots.append(slot)
+
+    def submit(self, frame_number, timestamp, color_image, depth_image, depth_units, intrinsics):
+        """Queue a frame for detection. Returns False if it was dropped because all slots are busy."""
+        self.collect()
+        if not self.free_slots:
+            self.frames_dropped += 1
+            return False
+
+        slot = self.free_slots.popleft()
+        self.slot_frames[slot] = frame_number
+        np.copyto(self.color[slot], color_image)
+        np.copyto(self.depth[slot], depth_image)
+        self.tasks.put((frame_number, slot, timestamp, depth_units, intrinsics, self.max_latency))
+        self.pending.append(frame_number)
+        self.submitted_at[frame_number] = time.time()
+        self.frames_submitted += 1
+        return True
+
+    def collect(self, timeout=0.0):
+        """Move worker results into the reorder buffer and return their slots to the free list."""
+        block = timeout > 0
+        while True:
+            try:
+                frame_number, slot, timestamp, detection = self.results.get(block, timeout) if block \
+                    else self.results.get_nowait()
+            except queue.Empty:
+                break
+            block = False
+            self.release(slot, frame_number)
+            if frame_number in self.submitted_at:
+                self.finished[frame_number] = (timestamp, detection)
+
+    def poll(self, timeout=0.0):
+        """
+        Return finished detections as (frame_number, timestamp, (ids, centers, positions, quaternions)),
+        strictly in frame order. Skipped frames are left out.
+        """
+        self.collect(timeout)
+        self.restart_dead_workers()
+        now = time.time()
+        ready = []
+        while self.pending:
+            head = self.pending[0]
+            if head in self.finished:
+                timestamp, detection = self.finished.pop(head)
+            elif now - self.submitted_at[head] > self.stall_timeout:
+                logging.warning(f"Detection of frame {head} timed out")
+                detection = None
+                # Its worker died or is hopelessly late: reuse the slot (a late result is ignored)
+                if head in self.slot_frames:
+                    self.release(self.slot_frames.index(head), head)
+            else:
+                break  # Later frames wait so results stay ordered
+
+            self.pending.popleft()
+            del self.submitted_at[head]
+            if detection is None:
+                self.frames_skipped += 1
+                continue
+            ready.append((head, timestamp, detection))
+        return ready
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "submitted": self.frames_submitted,
+            "dropped": self.frames_dropped,
+            "skipped": self.frames_skipped,
+            "in_flight": len(self.pending)
+        }
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        del self.color, self.depth
+        self.shm.close()
+        self.shm.unlink()
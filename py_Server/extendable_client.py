@@ -73,6 +73,7 @@ class WebSocketClient:
             async with websockets.connect(uri) as websocket:
                 self.websocket = websocket
                 print(f"Connected to server at {uri}")
+                await self.send_id(websocket, client_id)  # Unprompted, saves the REQUEST_ID round trip
                 await self.listen_to_server(websocket)
         except Exception as e:
             messagebox.showerror("Connection Error", f"Could not connect to server: {e}")
@@ -0,0 +1,57 @@
+import numpy as np
+from cv2 import aruco
+
+from marker_pose import CameraIntrinsics, MarkerPoseEstimator, flip_y
+from depth_filter import sample_depth
+
+
+def deproject_pixels(intrinsics, pixels, depth_image, depth_units, radius=2):
+    """Pinhole deprojection of integer (N, 2) pixels using an aligned depth image -> (N, 3) meters."""
+    # Median of a small patch instead of one pixel, so holes and flying pixels don't spike the depth
+    z = sample_depth(depth_image, pixels, depth_units, radius)
+    x = (pixels[:, 0] - intrinsics.ppx) / intrinsics.fx * z
+    y = (pixels[:, 1] - intrinsics.ppy) / intrinsics.fy * z
+    return np.stack([x, y, z], axis=1)
+
+
+class ArucoPoseDetector:
+    """
+    ArUco detection plus batched pose estimation on an aligned color/depth pair.
+
+    Poses are returned in the y-up convention the clients publish. Shared by
+    the single-camera matrix client, the per-device capture workers and the
+    detection pool processes.
+    """
+
+    def __init__(self, dictionary=aruco.DICT_6X6_250, marker_length=0.05, depth_weight=0.5):
+        self.aruco_dict = aruco.getPredefinedDictionary(dictionary)
+        self.aruco_params = aruco.DetectorParameters()
+        self.pose_estimator = MarkerPoseEstimator(marker_length=marker_length, depth_weight=depth_weight)
+
+    def detect(self, color_frame, depth_frame, depth_filter=None):
+        """Run `detect_image` on RealSense frames (depth must be aligned to color, so no decimation)."""
+        intrinsics = color_frame.profile.as_video_stream_profile().intrinsics
+        depth_image = np.asanyarray(depth_frame.get_data())
+        if depth_filter is not None:
+            depth_image = depth_filter.process(depth_image)
+        return self.detect_image(np.asanyarray(color_frame.get_data()), depth_image,
+                                 depth_frame.get_units(), intrinsics)
+
+    def detect_image(self, color_image, depth_image, depth_units, intrinsics):
+        """
+        Returns (ids, centers, positions, quaternions); all empty when no marker is visible.
+        `centers` are integer pixel coordinates, handy for drawing overlays.
+        """
+        corners, ids, _ = aruco.detectMarkers(color_image, self.aruco_dict, parameters=self.aruco_params)
+        if ids is None:
+            return (np.zeros(0, dtype=np.int64), np.zeros((0, 2), dtype=int),
+                    np.zeros((0, 3)), np.zeros((0, 4)))
+
+        centers = np.array([np.mean(corner[0], axis=0) for corner in corners]).astype(int)
+        depth_points = deproject_pixels(intrinsics, centers, depth_image, depth_units)
+
+        # Estimate all marker poses in one pass, then mirror into the y-up convention
+        self.pose_estimator.update_intrinsics(intrinsics)
+        positions, quaternions = self.pose_estimator.estimate(corners, depth_points)
+        positions, quaternions = flip_y(positions, quaternions)
+        return ids.flatten(), centers, positions, quaternions
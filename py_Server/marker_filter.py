@@ -0,0 +1,181 @@
+import threading
+import numpy as np
+
+
+def quaternion_multiply(a, b):
+    """Hamilton product of (N, 4) quaternions ordered x, y, z, w."""
+    ax, ay, az, aw = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    bx, by, bz, bw = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    return np.stack([
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+        aw * bw - ax * bx - ay * by - az * bz
+    ], axis=1)
+
+
+def quaternion_conjugate(q):
+    return q * np.array([-1.0, -1.0, -1.0, 1.0])
+
+
+def quaternion_to_rotation_vector(q):
+    """Log map: (N, 4) unit quaternions to (N, 3) axis * angle vectors."""
+    q = q * np.where(q[:, 3:4] < 0, -1.0, 1.0)
+    sin_half = np.linalg.norm(q[:, :3], axis=1)
+    angle = 2.0 * np.arctan2(sin_half, q[:, 3])
+    scale = np.where(sin_half > 1e-9, angle / np.maximum(sin_half, 1e-9), 2.0)
+    return q[:, :3] * scale[:, None]
+
+
+def rotation_vector_to_quaternion(v):
+    """Exp map: (N, 3) axis * angle vectors to (N, 4) unit quaternions."""
+    angle = np.linalg.norm(v, axis=1)
+    half = angle / 2.0
+    scale = np.where(angle > 1e-9, np.sin(half) / np.maximum(angle, 1e-9), 0.5)
+    return np.concatenate([v * scale[:, None], np.cos(half)[:, None]], axis=1)
+
+
+def smoothing_factor(cutoff, dt):
+    """One-Euro smoothing factor for a cutoff frequency (Hz) and time step (s)."""
+    tau = 1.0 / (2.0 * np.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class MarkerFilter:
+    """
+    Per-marker One-Euro filter with constant-velocity prediction.
+
+    State lives in preallocated arrays indexed directly by marker id, so a
+    frame of N markers is filtered with a handful of vectorized operations.
+    Positions and orientations are smoothed adaptively (little lag when
+    moving fast, strong smoothing when still) and can be extrapolated to the
+    expected render time to hide the capture-to-display latency.
+    """
+
+    def __init__(self, max_markers=256, min_cutoff=1.0, beta=5.0, d_cutoff=1.0,
+                 rotation_min_cutoff=1.0, rotation_beta=0.5, stale_after=0.5):
+        self.max_markers = max_markers
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.rotation_min_cutoff = rotation_min_cutoff
+        self.rotation_beta = rotation_beta
+        self.stale_after = stale_after  # Seconds without a sample before a marker restarts
+
+        self.timestamps = np.zeros(max_markers, dtype=np.float64)
+        self.active = np.zeros(max_markers, dtype=bool)
+        self.positions = np.zeros((max_markers, 3), dtype=np.float64)
+        self.raw_positions = np.zeros((max_markers, 3), dtype=np.float64)
+        self.velocities = np.zeros((max_markers, 3), dtype=np.float64)
+        self.quaternions = np.tile(np.array([0.0, 0.0, 0.0, 1.0]), (max_markers, 1))
+        self.raw_quaternions = self.quaternions.copy()
+        self.angular_velocities = np.zeros((max_markers, 3), dtype=np.float64)
+
+        self.lock = threading.Lock()  # Detection and sending run on different threads
+
+    def in_range(self, ids):
+        """Mask of the ids the filter can hold state for; callers drop the others before update."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        return (ids >= 0) & (ids < self.max_markers)
+
+    def check_ids(self, ids):
+        """Ids as an int array; raises ValueError for ids the state arrays cannot hold."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        bad = ~self.in_range(ids)
+        if np.any(bad):
+            raise ValueError(f"Marker ids {ids[bad].tolist()} outside [0, {self.max_markers})")
+        return ids
+
+    def update(self, ids, positions, quaternions, timestamp):
+        """
+        Feed one frame of measurements captured at `timestamp` (seconds).
+
+        Returns the filtered (positions, quaternions) in the order of `ids`.
+        Ids must lie in [0, max_markers); a marker not seen for `stale_after`
+        seconds starts over from its measurement.
+        """
+        idx = self.check_ids(ids)
+        x = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        q = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+        if len(idx) == 0:
+            return x.copy(), q.copy()
+
+        with self.lock:
+            dt = timestamp - self.timestamps[idx]
+            fresh = ~self.active[idx] | (dt <= 0) | (dt > self.stale_after)
+            tracked = ~fresh
+
+            if np.any(fresh):
+                fi = idx[fresh]
+                self.positions[fi] = x[fresh]
+                self.raw_positions[fi] = x[fresh]
+                self.velocities[fi] = 0.0
+                self.quaternions[fi] = q[fresh]
+                self.raw_quaternions[fi] = q[fresh]
+                self.angular_velocities[fi] = 0.0
+                self.timestamps[fi] = timestamp
+                self.active[fi] = True
+
+            if np.any(tracked):
+                ti = idx[tracked]
+                tdt = dt[tracked][:, None]
+
+                # Position: filter the derivative of the raw samples, then adapt the cutoff to the speed
+                prev_x = self.positions[ti]
+                raw_velocity = (x[tracked] - self.raw_positions[ti]) / tdt
+                a_d = smoothing_factor(self.d_cutoff, tdt)
+                velocity = a_d * raw_velocity + (1.0 - a_d) * self.velocities[ti]
+                cutoff = self.min_cutoff + self.beta * np.linalg.norm(velocity, axis=1, keepdims=True)
+                a = smoothing_factor(cutoff, tdt)
+                self.positions[ti] = a * x[tracked] + (1.0 - a) * prev_x
+                self.velocities[ti] = velocity
+                self.raw_positions[ti] = x[tracked]
+
+                # Orientation: same scheme on the rotation delta between frames
+                prev_q = self.quaternions[ti]
+                meas_q = q[tracked]
+                raw_delta = quaternion_to_rotation_vector(
+                    quaternion_multiply(meas_q, quaternion_conjugate(self.raw_quaternions[ti])))
+                delta = quaternion_to_rotation_vector(quaternion_multiply(meas_q, quaternion_conjugate(prev_q)))
+                raw_omega = raw_delta / tdt
+                omega = a_d * raw_omega + (1.0 - a_d) * self.angular_velocities[ti]
+                r_cutoff = self.rotation_min_cutoff + self.rotation_beta * np.linalg.norm(omega, axis=1, keepdims=True)
+                a_r = smoothing_factor(r_cutoff, tdt)
+                step = rotation_vector_to_quaternion(delta * a_r)
+                filtered_q = quaternion_multiply(step, prev_q)
+                self.quaternions[ti] = filtered_q / np.linalg.norm(filtered_q, axis=1, keepdims=True)
+                self.angular_velocities[ti] = omega
+                self.raw_quaternions[ti] = meas_q
+
+                self.timestamps[ti] = timestamp
+
+            return self.positions[idx], self.quaternions[idx]
+
+    def predict(self, ids, target_time, max_horizon=0.1):
+        """
+        Extrapolate the filtered poses of `ids` to `target_time` (seconds).
+
+        The horizon is clamped to `max_horizon` so a marker that stopped being
+        detected does not drift away. Ids must lie in [0, max_markers).
+        Returns (positions, quaternions).
+        """
+        idx = self.check_ids(ids)
+
+        with self.lock:
+            horizon = np.clip(target_time - self.timestamps[idx], 0.0, max_horizon)[:, None]
+            positions = self.positions[idx] + self.velocities[idx] * horizon
+            step = rotation_vector_to_quaternion(self.angular_velocities[idx] * horizon)
+            quaternions = quaternion_multiply(step, self.quaternions[idx])
+
+        return positions, quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True)
+
+    def expire(self, now):
+        """Return the ids of active markers not seen for `stale_after` seconds and deactivate them."""
+        with self.lock:
+            stale = self.active & (now - self.timestamps > self.stale_after)
+            self.active[stale] = False
+        return np.flatnonzero(stale)
+
+    def reset(self):
+        with self.lock:
+            self.active[:] = False
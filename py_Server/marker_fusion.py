@@ -0,0 +1,272 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+import numpy as np
+
+from marker_pose import rotation_matrices_to_quaternions
+from marker_filter import quaternion_multiply
+from delta_stream import DeltaEncoder, DeltaStreamState
+
+DEFAULT_EXTRINSICS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "camera_extrinsics.json")
+CAMERA_STREAM_PATTERN = re.compile(r"^cam/(?P<serial>[^/]+)/aruco$")
+
+
+def marker_normals(quaternions):
+    """Marker z-axes (the direction the marker faces) for (N, 4) x, y, z, w quaternions."""
+    x, y, z, w = quaternions[:, 0], quaternions[:, 1], quaternions[:, 2], quaternions[:, 3]
+    return np.stack([
+        2.0 * (x * z + w * y),
+        2.0 * (y * z - w * x),
+        1.0 - 2.0 * (x * x + y * y)
+    ], axis=1)
+
+
+def observation_weights(positions, quaternions, min_distance=0.2, min_cos=0.1):
+    """
+    Inverse-variance style weights for camera-frame observations.
+
+    Depth noise grows roughly with the square of the distance, and corner
+    localization degrades as the marker turns away from the camera, so the
+    weight is cos(view angle) / distance^2.
+    """
+    distance = np.linalg.norm(positions, axis=1)
+    rays = positions / np.maximum(distance, 1e-9)[:, None]
+    cos_view = np.abs(np.sum(marker_normals(quaternions) * rays, axis=1))
+    return np.maximum(cos_view, min_cos) / np.maximum(distance, min_distance) ** 2
+
+
+class CameraTrack:
+    """
+    Latest two observations of every marker seen by one camera, in that camera's frame.
+
+    Observation times are the producer's capture times; `clock_offset` maps them
+    to the server clock (the smallest arrival - capture difference seen recently,
+    i.e. the producer's clock offset plus the shortest transfer delay).
+    """
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.markers = {}  # marker_id -> (t_prev, p_prev, t_last, p_last, q_last), producer clock
+        self.last_update = 0.0  # Server time of the last message
+        self.keepalive = None  # Longest the producer stays silent while nothing changes
+        self.offsets = deque(maxlen=64)
+        self.clock_offset = 0.0
+
+    def update(self, markers, timestamp, arrival=None, keepalive=None):
+        arrival = time.time() if arrival is None else arrival
+        self.offsets.append(arrival - timestamp)
+        self.clock_offset = min(self.offsets)
+        if keepalive is not None:
+            self.keepalive = float(keepalive)
+        observed = {}
+        for marker in markers:
+            try:
+                marker_id = int(marker["marker_id"])
+                position = np.array([marker["x"], marker["y"], marker["z"]], dtype=np.float64)
+                quaternion = np.array([marker.get("qx", 0.0), marker.get("qy", 0.0),
+                                       marker.get("qz", 0.0), marker.get("qw", 1.0)], dtype=np.float64)
+            except (KeyError, TypeError, ValueError):
+                continue
+            previous = self.markers.get(marker_id)
+            if previous is not None and timestamp <= previous[2]:
+                observed[marker_id] = previous
+            elif previous is not None:
+                observed[marker_id] = (previous[2], previous[3], timestamp, position, quaternion)
+            else:
+                observed[marker_id] = (timestamp, position, timestamp, position, quaternion)
+        # The stream carries the camera's full marker set, so anything missing left its view
+        self.markers = observed
+        self.last_update = arrival
+
+
+class MarkerFusion:
+    """
+    Merges the `cam/<serial>/aruco` streams of several cameras into one
+    `aruco_position_stream` in a shared world frame.
+
+    Each camera's observations are moved into the world frame with its
+    extrinsics (camera -> world 4x4, settable with `set_camera_extrinsics`
+    and persisted to `camera_extrinsics.json`; cameras without one are
+    treated as already being in the world frame). At every fusion tick all
+    observations are aligned to the same instant by extrapolating each
+    marker's last motion (bounded by `max_extrapolation`), then averaged per
+    marker id with `observation_weights`.
+
+    Producers only publish when something changed, plus a keepalive; a camera
+    counts as gone once it has been silent for `stale_after` or, if it reports
+    its keepalive interval, 1.5 keepalives, whichever is longer. While any
+    camera is live the output stream belongs to the fusion: clients publishing
+    it directly are rejected (once told, then ignored) so their delta seqs
+    don't interleave with the fused ones.
+    """
+
+    def __init__(self, server, extrinsics_path=DEFAULT_EXTRINSICS_PATH, rate=30.0,
+                 stale_after=0.3, max_extrapolation=0.05, output_stream="aruco_position_stream"):
+        self.server = server
+        self.extrinsics_path = extrinsics_path
+        self.rate = rate
+        self.stale_after = stale_after
+        self.max_extrapolation = max_extrapolation
+        self.output_stream = output_stream
+
+        self.cameras = {}  # serial -> CameraTrack
+        self.extrinsics = {}  # serial -> 4x4 camera-to-world matrix
+        self.delta_encoder = DeltaEncoder()
+        self.rejected = set()  # Clients told that the output stream is fused while they published it
+        self.load_extrinsics()
+
+    def load_extrinsics(self):
+        if not os.path.exists(self.extrinsics_path):
+            return
+        try:
+            with open(self.extrinsics_path) as f:
+                data = json.load(f)
+            self.extrinsics = {serial: np.asarray(matrix, dtype=np.float64).reshape(4, 4)
+                               for serial, matrix in data.items()}
+            logging.info(f"Loaded extrinsics for {len(self.extrinsics)} camera(s)")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load camera extrinsics from {self.extrinsics_path}: {e}")
+
+    def set_extrinsics(self, serial, matrix):
+        self.extrinsics[serial] = np.asarray(matrix, dtype=np.float64).reshape(4, 4)
+        try:
+            with open(self.extrinsics_path, "w") as f:
+                json.dump({s: m.tolist() for s, m in self.extrinsics.items()}, f, indent=2)
+        except OSError as e:
+            logging.warning(f"Could not save camera extrinsics: {e}")
+
+    def camera_serial(self, stream_name):
+        """Serial number if `stream_name` is a per-camera marker stream, else None."""
+        match = CAMERA_STREAM_PATTERN.match(stream_name or "")
+        return match.group("serial") if match else None
+
+    def add_observations(self, serial, markers, timestamp=None, keepalive=None):
+        if not isinstance(markers, list):
+            return
+        track = self.cameras.setdefault(serial, CameraTrack(serial))
+        arrival = time.time()
+        track.update(markers, timestamp or arrival, arrival, keepalive)
+
+    def stale_limit(self, track):
+        if track.keepalive is None:
+            return self.stale_after
+        return max(self.stale_after, 1.5 * track.keepalive)
+
+    def active(self, now):
+        """Whether any camera is live, i.e. the fusion owns the output stream."""
+        live = any(now - track.last_update <= self.stale_limit(track)
+                   for track in self.cameras.values())
+        if not live:
+            self.rejected.clear()
+        return live
+
+    def reject_producer(self, client_id):
+        """Record a direct producer of the output stream; True the first time, when it should be told."""
+        if client_id in self.rejected:
+            return False
+        self.rejected.add(client_id)
+        return True
+
+    def fuse(self, now):
+        """Return the fused marker list (world frame) for time `now`."""
+        ids, positions, quaternions, weights = [], [], [], []
+        for serial, track in self.cameras.items():
+            if not track.markers or now - track.last_update > self.stale_limit(track):
+                continue
+            marker_ids = np.fromiter(track.markers.keys(), dtype=np.int64, count=len(track.markers))
+            states = list(track.markers.values())
+            t_prev = np.array([s[0] for s in states])
+            p_prev = np.array([s[1] for s in states])
+            t_last = np.array([s[2] for s in states])
+            p_last = np.array([s[3] for s in states])
+            q_last = np.array([s[4] for s in states])
+
+            # Align to `now` by extrapolating along the last observed velocity
+            dt = t_last - t_prev
+            velocity = np.where(dt[:, None] > 1e-6, (p_last - p_prev) / np.maximum(dt, 1e-6)[:, None], 0.0)
+            lead = np.clip(now - (t_last + track.clock_offset), 0.0, self.max_extrapolation)
+            p_cam = p_last + velocity * lead[:, None]
+
+            w = observation_weights(p_cam, q_last)
+
+            matrix = self.extrinsics.get(serial)
+            if matrix is not None:
+                R = matrix[:3, :3]
+                p_world = p_cam @ R.T + matrix[:3, 3]
+                q_extrinsic = rotation_matrices_to_quaternions(R[None])
+                q_world = quaternion_multiply(np.repeat(q_extrinsic, len(q_last), axis=0), q_last)
+            else:
+                p_world, q_world = p_cam, q_last
+
+            ids.append(marker_ids)
+            positions.append(p_world)
+            quaternions.append(q_world)
+            weights.append(w)
+
+        if not ids:
+            return []
+
+        ids = np.concatenate(ids)
+        positions = np.concatenate(positions)
+        quaternions = np.concatenate(quaternions)
+        weights = np.concatenate(weights)
+
+        unique_ids, groups = np.unique(ids, return_inverse=True)
+        total = np.zeros(len(unique_ids))
+        np.add.at(total, groups, weights)
+        counts = np.bincount(groups, minlength=len(unique_ids))
+
+        fused_positions = np.zeros((len(unique_ids), 3))
+        np.add.at(fused_positions, groups, positions * weights[:, None])
+        fused_positions /= total[:, None]
+
+        # Average quaternions in the hemisphere of the first observation of each marker
+        first = np.zeros(len(unique_ids), dtype=np.int64)
+        first[groups[::-1]] = np.arange(len(groups))[::-1]
+        signs = np.where(np.sum(quaternions * quaternions[first][groups], axis=1) < 0, -1.0, 1.0)
+        fused_quaternions = np.zeros((len(unique_ids), 4))
+        np.add.at(fused_quaternions, groups, quaternions * (signs * weights)[:, None])
+        fused_quaternions /= np.linalg.norm(fused_quaternions, axis=1, keepdims=True)
+
+        # Confidence in [0, 1): total / (total + 1) of the summed observation weights (cos(view angle) / distance^2)
+        confidences = total / (total + 1.0)
+
+        return [
+            {
+                "marker_id": int(marker_id),
+                "x": round(x, 3), "y": round(y, 3), "z": round(z, 3),
+                "qx": round(qx, 3), "qy": round(qy, 3), "qz": round(qz, 3), "qw": round(qw, 3),
+                "cameras": int(count),
+                "confidence": round(confidence, 2)
+            }
+            for marker_id, (x, y, z), (qx, qy, qz, qw), count, confidence in zip(
+                unique_ids.tolist(), fused_positions.tolist(), fused_quaternions.tolist(), counts.tolist(),
+                confidences.tolist())
+        ]
+
+    def publish(self, now):
+        """Fuse and store the result as the output stream (delta-tracked like producer streams)."""
+        fused = self.fuse(now)
+        state = self.server.delta_streams.setdefault(self.output_stream, DeltaStreamState())
+        state.apply(self.delta_encoder.encode(fused, now))
+        if self.output_stream not in self.server.streams:
+            self.server.streams[self.output_stream] = None
+            self.server.app.refresh_stream_dropdown()
+        self.server.streams[self.output_stream] = state.snapshot()
+        self.server.subscriptions.notify(self.output_stream)
+        self.server.calibration.add_camera_observations(fused, now)
+
+    async def run(self):
+        """Fusion loop; only active once at least one per-camera stream is publishing."""
+        while not self.server.should_stop:
+            await asyncio.sleep(1.0 / self.rate)
+            if not self.cameras:
+                continue
+            try:
+                self.publish(time.time())
+            except Exception as e:
+                logging.error(f"Marker fusion failed: {e}")
@@ -0,0 +1,47 @@
+import struct
+import numpy as np
+
+# Fixed-layout binary marker packet sent to Unity's ArUcoServer (all little-endian):
+#   header: magic "AR", version u8, flags u8, seq u32, timestamp f64, count u16, reserved u16
+#   then `count` records: id i32, position 3 x f32, quaternion (x, y, z, w) 4 x f32, rotation f32
+PACKET_MAGIC = b"AR"
+PACKET_VERSION = 1
+HEADER_FORMAT = "<2sBBIdHH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)  # 20 bytes
+
+MARKER_RECORD = np.dtype([
+    ("id", "<i4"),
+    ("position", "<f4", (3,)),
+    ("quaternion", "<f4", (4,)),
+    ("rotation", "<f4")
+])  # 36 bytes per marker
+
+# Largest marker count that still fits one Ethernet MTU (1472 bytes of UDP payload)
+MAX_MARKERS_PER_PACKET = (1472 - HEADER_SIZE) // MARKER_RECORD.itemsize
+
+
+def encode_marker_packet(seq, timestamp, ids, positions, quaternions, rotations=None):
+    """Pack marker arrays straight into a binary packet without per-value formatting."""
+    count = len(ids)
+    records = np.empty(count, dtype=MARKER_RECORD)
+    if count:
+        records["id"] = ids
+        records["position"] = positions
+        records["quaternion"] = quaternions
+        records["rotation"] = 0.0 if rotations is None else rotations
+    header = struct.pack(HEADER_FORMAT, PACKET_MAGIC, PACKET_VERSION, 0,
+                         seq & 0xFFFFFFFF, timestamp, count, 0)
+    return header + records.tobytes()
+
+
+def is_marker_packet(data):
+    return len(data) >= HEADER_SIZE and data[:2] == PACKET_MAGIC
+
+
+def decode_marker_packet(data):
+    """Inverse of `encode_marker_packet`; returns (seq, timestamp, records array)."""
+    magic, version, _, seq, timestamp, count, _ = struct.unpack_from(HEADER_FORMAT, data)
+    if magic != PACKET_MAGIC or version != PACKET_VERSION:
+        raise ValueError(f"Not a marker packet (magic {magic!r}, version {version})")
+    records = np.frombuffer(data, dtype=MARKER_RECORD, count=count, offset=HEADER_SIZE)
+    return seq, timestamp, records
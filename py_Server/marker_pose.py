@@ -0,0 +1,192 @@
+import numpy as np
+import cv2
+
+
+class CameraIntrinsics:
+    """Plain (picklable) copy of RealSense stream intrinsics, for use outside the capture process."""
+
+    def __init__(self, width, height, fx, fy, ppx, ppy, coeffs=(0.0, 0.0, 0.0, 0.0, 0.0)):
+        self.width = width
+        self.height = height
+        self.fx = fx
+        self.fy = fy
+        self.ppx = ppx
+        self.ppy = ppy
+        self.coeffs = list(coeffs)
+
+    @classmethod
+    def from_realsense(cls, intrinsics):
+        return cls(intrinsics.width, intrinsics.height, intrinsics.fx, intrinsics.fy,
+                   intrinsics.ppx, intrinsics.ppy, intrinsics.coeffs)
+
+
+def intrinsics_to_camera_matrix(intrinsics):
+    """Convert RealSense intrinsics into an OpenCV camera matrix and distortion vector."""
+    camera_matrix = np.array([
+        [intrinsics.fx, 0.0, intrinsics.ppx],
+        [0.0, intrinsics.fy, intrinsics.ppy],
+        [0.0, 0.0, 1.0]
+    ], dtype=np.float64)
+    dist_coeffs = np.asarray(intrinsics.coeffs, dtype=np.float64)
+    return camera_matrix, dist_coeffs
+
+
+def marker_object_points(marker_length):
+    """Corner positions of a square marker in its own frame (ArUco corner order)."""
+    half = marker_length / 2.0
+    return np.array([
+        [-half, half],
+        [half, half],
+        [half, -half],
+        [-half, -half]
+    ], dtype=np.float64)
+
+
+def rotation_matrices_to_quaternions(rotations):
+    """Convert (N, 3, 3) rotation matrices into (N, 4) quaternions ordered x, y, z, w."""
+    r = np.asarray(rotations, dtype=np.float64)
+    m00, m11, m22 = r[:, 0, 0], r[:, 1, 1], r[:, 2, 2]
+    trace = m00 + m11 + m22
+
+    # Pick the numerically stable branch per matrix (largest diagonal term)
+    candidates = np.stack([trace, m00, m11, m22], axis=1)
+    branch = np.argmax(candidates, axis=1)
+    s = np.sqrt(np.maximum(1.0 + 2.0 * candidates[np.arange(len(r)), branch] - trace, 1e-12)) * 2.0
+
+    q = np.empty((len(r), 4), dtype=np.float64)
+    b0, b1, b2, b3 = (branch == 0), (branch == 1), (branch == 2), (branch == 3)
+
+    q[b0, 3] = 0.25 * s[b0]
+    q[b0, 0] = (r[b0, 2, 1] - r[b0, 1, 2]) / s[b0]
+    q[b0, 1] = (r[b0, 0, 2] - r[b0, 2, 0]) / s[b0]
+    q[b0, 2] = (r[b0, 1, 0] - r[b0, 0, 1]) / s[b0]
+
+    q[b1, 3] = (r[b1, 2, 1] - r[b1, 1, 2]) / s[b1]
+    q[b1, 0] = 0.25 * s[b1]
+    q[b1, 1] = (r[b1, 0, 1] + r[b1, 1, 0]) / s[b1]
+    q[b1, 2] = (r[b1, 0, 2] + r[b1, 2, 0]) / s[b1]
+
+    q[b2, 3] = (r[b2, 0, 2] - r[b2, 2, 0]) / s[b2]
+    q[b2, 0] = (r[b2, 0, 1] + r[b2, 1, 0]) / s[b2]
+    q[b2, 1] = 0.25 * s[b2]
+    q[b2, 2] = (r[b2, 1, 2] + r[b2, 2, 1]) / s[b2]
+
+    q[b3, 3] = (r[b3, 1, 0] - r[b3, 0, 1]) / s[b3]
+    q[b3, 0] = (r[b3, 0, 2] + r[b3, 2, 0]) / s[b3]
+    q[b3, 1] = (r[b3, 1, 2] + r[b3, 2, 1]) / s[b3]
+    q[b3, 2] = 0.25 * s[b3]
+
+    # Keep w positive so consumers get a consistent hemisphere
+    q *= np.where(q[:, 3:4] < 0, -1.0, 1.0)
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def estimate_marker_poses(corners, marker_length, camera_matrix, dist_coeffs=None):
+    """
+    Estimate the 6-DoF pose of every detected marker in one batched pass.
+
+    corners: sequence of N arrays shaped (1, 4, 2) as returned by detectMarkers.
+    Returns (positions (N, 3) in meters, quaternions (N, 4) as x, y, z, w,
+    rotations (N, 3, 3)) in the camera frame.
+    """
+    if len(corners) == 0:
+        return np.zeros((0, 3)), np.zeros((0, 4)), np.zeros((0, 3, 3))
+
+    image_points = np.asarray(corners, dtype=np.float64).reshape(-1, 1, 2)
+    if dist_coeffs is None:
+        dist_coeffs = np.zeros(5)
+
+    # Undistort all corners at once into normalized image coordinates
+    normalized = cv2.undistortPoints(image_points, camera_matrix, dist_coeffs).reshape(-1, 4, 2)
+    count = normalized.shape[0]
+
+    # Build the DLT system for all markers: one (8, 9) matrix per marker
+    obj = marker_object_points(marker_length)
+    X, Y = obj[:, 0], obj[:, 1]
+    u, v = normalized[:, :, 0], normalized[:, :, 1]
+    zeros = np.zeros_like(u)
+    ones = np.ones_like(u)
+    Xb, Yb = np.broadcast_to(X, u.shape), np.broadcast_to(Y, u.shape)
+
+    rows_u = np.stack([Xb, Yb, ones, zeros, zeros, zeros, -u * Xb, -u * Yb, -u], axis=2)
+    rows_v = np.stack([zeros, zeros, zeros, Xb, Yb, ones, -v * Xb, -v * Yb, -v], axis=2)
+    A = np.concatenate([rows_u, rows_v], axis=1)
+
+    _, _, vt = np.linalg.svd(A)
+    H = vt[:, -1, :].reshape(count, 3, 3)
+
+    # H ~ [r1 r2 t]; recover the scale from the rotation columns
+    h1, h2, h3 = H[:, :, 0], H[:, :, 1], H[:, :, 2]
+    scale = 2.0 / (np.linalg.norm(h1, axis=1) + np.linalg.norm(h2, axis=1))
+    sign = np.where(h3[:, 2] * scale < 0, -1.0, 1.0)  # Marker must be in front of the camera
+    scale = (scale * sign)[:, None]
+
+    r1, r2, t = h1 * scale, h2 * scale, h3 * scale
+    r3 = np.cross(r1, r2)
+    approx = np.stack([r1, r2, r3], axis=2)
+
+    # Project onto the closest proper rotation
+    U, _, Vt = np.linalg.svd(approx)
+    det = np.linalg.det(U @ Vt)
+    D = np.tile(np.eye(3), (count, 1, 1))
+    D[:, 2, 2] = det
+    rotations = U @ D @ Vt
+
+    return t, rotation_matrices_to_quaternions(rotations), rotations
+
+
+def fuse_with_depth(positions, depth_points, depth_weight=0.5):
+    """
+    Blend pose translations with measured depth points.
+
+    The fused point stays on the ray of the pose estimate (sub-pixel accurate)
+    while its range is a weighted mix of the size-based and measured depth.
+    Markers without a valid depth reading keep their pose translation.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    depth_points = np.asarray(depth_points, dtype=np.float64).reshape(positions.shape)
+
+    pose_z = positions[:, 2]
+    measured_z = depth_points[:, 2]
+    valid = np.isfinite(measured_z) & (measured_z > 0) & (pose_z > 0)
+
+    fused_z = np.where(valid, (1.0 - depth_weight) * pose_z + depth_weight * measured_z, pose_z)
+    ratio = np.where(valid, fused_z / np.where(pose_z > 0, pose_z, 1.0), 1.0)
+    return positions * ratio[:, None]
+
+
+def flip_y(positions, quaternions):
+    """Mirror poses across the XZ plane (the y-up convention used by the locate clients)."""
+    positions = np.array(positions, dtype=np.float64, copy=True)
+    quaternions = np.array(quaternions, dtype=np.float64, copy=True)
+    positions[:, 1] *= -1.0
+    quaternions[:, 0] *= -1.0
+    quaternions[:, 2] *= -1.0
+    return positions, quaternions
+
+
+class MarkerPoseEstimator:
+    """Holds the marker size, intrinsics and fusion settings for batched pose estimation."""
+
+    def __init__(self, marker_length=0.05, depth_weight=0.5):
+        self.marker_length = marker_length
+        self.depth_weight = depth_weight
+        self.camera_matrix = None
+        self.dist_coeffs = None
+        self._intrinsics_key = None
+
+    def update_intrinsics(self, intrinsics):
+        """Refresh the camera matrix only when the stream intrinsics actually change."""
+        key = (intrinsics.width, intrinsics.height, intrinsics.fx, intrinsics.fy,
+               intrinsics.ppx, intrinsics.ppy, tuple(intrinsics.coeffs))
+        if key != self._intrinsics_key:
+            self.camera_matrix, self.dist_coeffs = intrinsics_to_camera_matrix(intrinsics)
+            self._intrinsics_key = key
+
+    def estimate(self, corners, depth_points=None):
+        """Return (positions, quaternions) for all markers, fused with depth if provided."""
+        positions, quaternions, _ = estimate_marker_poses(
+            corners, self.marker_length, self.camera_matrix, self.dist_coeffs)
+        if depth_points is not None and self.depth_weight > 0 and len(positions):
+            positions = fuse_with_depth(positions, depth_points, self.depth_weight)
+        return positions, quaternions
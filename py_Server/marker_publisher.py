@@ -0,0 +1,104 @@
+import threading
+import numpy as np
+
+
+class MarkerSnapshot:
+    """One buffer of marker state: ids, poses and the time each marker was last seen."""
+
+    def __init__(self, capacity):
+        self.count = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.positions = np.zeros((capacity, 3), dtype=np.float64)
+        self.quaternions = np.zeros((capacity, 4), dtype=np.float64)
+        self.last_seen = np.zeros(capacity, dtype=np.float64)
+
+
+class MarkerPublisher:
+    """
+    Hands marker state from the detection thread to the sending thread.
+
+    The detection thread fills the back buffer and swaps it to the front
+    under a lock, so the sender always reads a complete frame. Markers
+    that have not been seen for `stale_after` seconds are dropped.
+
+    The sender only publishes when something changed. A change means a
+    marker appeared or disappeared, moved more than `deadband` meters, or
+    turned more than `rotation_deadband` radians. A keepalive goes out
+    every `keepalive` seconds regardless.
+    """
+
+    def __init__(self, capacity=256, deadband=0.005, rotation_deadband=0.02, keepalive=1.0, stale_after=0.5):
+        self.capacity = capacity
+        self.deadband = deadband
+        self.rotation_deadband = rotation_deadband
+        self.keepalive = keepalive
+        self.stale_after = stale_after
+
+        self.buffers = [MarkerSnapshot(capacity), MarkerSnapshot(capacity)]
+        self.front = 0
+        self.lock = threading.Lock()
+
+        # Detection-thread state: latest sighting per marker id
+        self.seen = {}
+
+        # Sender-thread state: what was last sent
+        self.sent_ids = np.zeros(0, dtype=np.int64)
+        self.sent_positions = np.zeros((0, 3))
+        self.sent_quaternions = np.zeros((0, 4))
+        self.last_send_time = 0.0
+
+    def update(self, ids, positions, quaternions, timestamp):
+        """Detection thread: record this frame's markers and publish a new snapshot."""
+        for marker_id, position, quaternion in zip(np.asarray(ids).reshape(-1), positions, quaternions):
+            self.seen[int(marker_id)] = (position, quaternion, timestamp)
+        self.expire(timestamp)
+
+        back = self.buffers[1 - self.front]
+        items = sorted(self.seen.items())[:self.capacity]
+        back.count = len(items)
+        for i, (marker_id, (position, quaternion, last_seen)) in enumerate(items):
+            back.ids[i] = marker_id
+            back.positions[i] = position
+            back.quaternions[i] = quaternion
+            back.last_seen[i] = last_seen
+
+        with self.lock:
+            self.front = 1 - self.front
+
+    def expire(self, now):
+        """Detection thread: forget markers that left the view."""
+        for marker_id in [m for m, (_, _, t) in self.seen.items() if now - t > self.stale_after]:
+            del self.seen[marker_id]
+
+    def snapshot(self, now):
+        """Sender thread: copy of the current front buffer without stale markers."""
+        with self.lock:
+            front = self.buffers[self.front]
+            n = front.count
+            ids = front.ids[:n].copy()
+            positions = front.positions[:n].copy()
+            quaternions = front.quaternions[:n].copy()
+            last_seen = front.last_seen[:n].copy()
+        fresh = now - last_seen <= self.stale_after
+        return ids[fresh], positions[fresh], quaternions[fresh]
+
+    def has_changed(self, ids, positions, quaternions, now):
+        """Sender thread: whether this state differs enough from the last sent one (or keepalive is due)."""
+        if now - self.last_send_time >= self.keepalive:
+            return True
+        if not np.array_equal(ids, self.sent_ids):
+            return True
+        if len(ids) == 0:
+            return False
+
+        moved = np.linalg.norm(positions - self.sent_positions, axis=1) > self.deadband
+        # Angle between orientations: 2 * acos(|q1 . q2|)
+        dot = np.clip(np.abs(np.sum(quaternions * self.sent_quaternions, axis=1)), 0.0, 1.0)
+        turned = 2.0 * np.arccos(dot) > self.rotation_deadband
+        return bool(np.any(moved | turned))
+
+    def mark_sent(self, ids, positions, quaternions, now):
+        self.sent_ids = ids.copy()
+        self.sent_positions = positions.copy()
+        self.sent_quaternions = quaternions.copy()
+        self.last_send_time = now
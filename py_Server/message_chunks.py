@@ -0,0 +1,114 @@
+import struct
+
+# Large messages travel as a run of binary chunk frames, so that no single WebSocket message
+# is large and other messages can be sent in between. Every chunk starts with this header:
+#   magic b"CHNK", flags (1 = the message is a text frame), message id,
+#   total message length in bytes, offset of this chunk's data in the message
+# Codec messages never start with the magic: binary codecs encode a map, JSON is a text frame.
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = struct.Struct("!4sBIII")
+TEXT_FLAG = 1
+
+CHUNK_SIZE = 64 * 1024  # Data bytes per chunk
+MAX_MESSAGE_SIZE = 256 * 1024  # WebSocket message limit between peers that both chunk
+LEGACY_MAX_SIZE = 10 ** 7  # Limit for clients that send whole frames
+MAX_CHUNKED_SIZE = 8 * 1024 * 1024  # Largest message accepted in chunks
+
+
+def is_chunk(frame):
+    return isinstance(frame, (bytes, bytearray)) and frame[:4] == CHUNK_MAGIC
+
+
+def split_message(payload, message_id, chunk_size=CHUNK_SIZE):
+    """An encoded message (str or bytes) -> list of chunk frames of at most `chunk_size` data bytes."""
+    flags = 0
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+        flags = TEXT_FLAG
+    view = memoryview(payload)
+    return [
+        CHUNK_HEADER.pack(CHUNK_MAGIC, flags, message_id & 0xFFFFFFFF, len(payload), offset)
+        + view[offset:offset + chunk_size]
+        for offset in range(0, max(len(payload), 1), chunk_size)
+    ]
+
+
+def cover(ranges, start, end):
+    """
+    Merge the byte range [start, end) into `ranges`, a sorted list of disjoint (start, end)
+    pairs, in place; returns how many of its bytes were not covered yet.
+    """
+    added = end - start
+    merged = []
+    for first, last in ranges:
+        if last < start or first > end:
+            merged.append((first, last))
+            continue
+        added -= max(0, min(last, end) - max(first, start))
+        start, end = min(first, start), max(last, end)
+    merged.append((start, end))
+    merged.sort()
+    ranges[:] = merged
+    return added
+
+
+class ChunkReassembler:
+    """
+    Reassembles the chunked messages of one connection.
+
+    Every chunk is copied straight to its offset in the message's buffer: a
+    finished message's buffer when one is large enough, else a new one that
+    grows with the data received, so a chunk announcing a large total does
+    not reserve memory the sender never fills. A message is complete once
+    every byte of it was received: the byte ranges of its chunks are merged,
+    so repeated or overlapping chunks never make up for a gap. Memory per
+    connection is bounded by `max_partial` messages of at most `max_size` bytes.
+    """
+
+    def __init__(self, max_partial=4, max_size=MAX_CHUNKED_SIZE):
+        self.max_partial = max_partial
+        self.max_size = max_size
+        self.partial = {}  # message id -> [buffer, bytes received, received byte ranges]
+        self.spare = []  # Buffers of finished messages, for reuse
+
+    def add(self, frame):
+        """
+        Take one chunk frame; returns the complete message once its last chunk is in, else None.
+        Binary messages are returned as a view of a reused buffer, valid until the next call.
+        Raises ValueError for chunks that don't fit their message.
+        """
+        _, flags, message_id, total, offset = CHUNK_HEADER.unpack_from(frame)
+        data = memoryview(frame)[CHUNK_HEADER.size:]
+        entry = self.partial.get(message_id)
+        if entry is None:
+            if total > self.max_size:
+                raise ValueError(f"chunked message of {total} bytes exceeds {self.max_size}")
+            if len(self.partial) >= self.max_partial:
+                # A sender that dropped mid-message leaves its chunks behind; forget the oldest
+                self.spare.append(self.partial.pop(next(iter(self.partial)))[0])
+            entry = self.partial[message_id] = [self.take_buffer(total), 0, []]
+        buffer, _, ranges = entry
+        end = offset + len(data)
+        if end > total:
+            del self.partial[message_id]
+            raise ValueError(f"chunk at {offset} overruns its {total} byte message")
+        if end > len(buffer):
+            buffer.extend(bytes(end - len(buffer)))  # Only new buffers grow; reused ones are large enough
+        buffer[offset:end] = data
+        entry[1] += cover(ranges, offset, end)
+        if entry[1] < total:
+            return None
+
+        del self.partial[message_id]
+        self.spare.append(buffer)
+        payload = memoryview(buffer)[:total]
+        return str(payload, "utf-8") if flags & TEXT_FLAG else payload
+
+    def take_buffer(self, size):
+        # A reused buffer is never resized: the view returned for its last message may still be held
+        for i, buffer in enumerate(self.spare):
+            if len(buffer) >= size:
+                return self.spare.pop(i)
+        if len(self.spare) >= self.max_partial:
+            self.spare.pop(0)  # Too small to be reused; let it go
+        return bytearray()
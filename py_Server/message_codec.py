@@ -0,0 +1,101 @@
+import json
+
+# Optional encoders; each codec is offered only when its package is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+class JsonCodec:
+    """The default wire format: JSON text frames (orjson when available, same output schema)."""
+    name = "json"
+    binary = False
+    available = True
+
+    def encode(self, message):
+        if orjson is not None:
+            try:
+                return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+            except TypeError:
+                pass  # e.g. NumPy scalars; the standard library takes those as floats
+        return json.dumps(message)
+
+    def decode(self, payload):
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(bytes(payload) if isinstance(payload, memoryview) else payload)
+
+
+class MsgPackCodec:
+    """MessagePack binary frames with the same message schema as JSON."""
+    name = "msgpack"
+    binary = True
+    available = msgpack is not None
+
+    def encode(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, payload):
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+class CborCodec:
+    """CBOR binary frames with the same message schema as JSON."""
+    name = "cbor"
+    binary = True
+    available = cbor2 is not None
+
+    def encode(self, message):
+        return cbor2.dumps(message)
+
+    def decode(self, payload):
+        return cbor2.loads(payload)
+
+
+JSON = JsonCodec()
+
+# Installed codecs, most preferred first
+CODECS = {codec.name: codec for codec in (MsgPackCodec(), CborCodec(), JSON) if codec.available}
+
+
+def available_codecs():
+    """Names of the installed codecs, most preferred first (what a hello or welcome offers)."""
+    return list(CODECS)
+
+
+def get_codec(name):
+    """Codec by name; unknown or missing names fall back to JSON."""
+    return CODECS.get(name, JSON)
+
+
+def decode(payload, codec=JSON):
+    """
+    Decode a received frame. Text frames are always JSON, so handshake messages and clients
+    that never negotiated keep working; binary frames use the connection's codec.
+    """
+    if isinstance(payload, str) or not codec.binary:
+        return JSON.decode(payload)
+    return codec.decode(payload)
+
+
+class FanoutMessage:
+    """A message sent to several connections, encoded at most once per codec."""
+
+    def __init__(self, message):
+        self.message = message
+        self.payloads = {}  # codec name -> encoded payload
+
+    def encode(self, codec):
+        payload = self.payloads.get(codec.name)
+        if payload is None:
+            payload = self.payloads[codec.name] = codec.encode(self.message)
+        return payload
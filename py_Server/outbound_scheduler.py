@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from collections import deque
+import websockets
+
+from message_chunks import CHUNK_SIZE, split_message
+
+# Priority classes of outbound messages
+CONTROL = 0   # Handshake, commands, SERVER_CLOSING, calibration results: always first
+TRACKING = 1  # Marker and other small stream updates
+BULK = 2      # Video frames and point clouds
+
+DEFAULT_WEIGHTS = {TRACKING: 8, BULK: 1}  # Share of sends while both have something queued
+DEFAULT_CHUNK_SIZE = CHUNK_SIZE
+
+
+class TokenBucket:
+    """Bandwidth cap: `rate` bytes per second on average, bursts of up to `burst` bytes."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else self.rate / 4
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    async def take(self, size):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= size
+        if self.tokens < 0:
+            # Messages larger than the burst still go out, the wait just pays for them
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class OutboundScheduler:
+    """
+    Outbound queue of one connection with priority classes.
+
+    Control messages go out before anything else; tracking and bulk messages
+    share the socket by smooth weighted round robin, one frame at a time.
+    Messages larger than `chunk_size` are split into chunk frames (for
+    clients that can reassemble them, `chunk_size=None` otherwise), so a marker
+    update or a command waits for at most one chunk instead of a whole video
+    frame, and no WebSocket message is larger than a chunk. Only one frame is
+    handed to the socket at a time.
+
+    `put` returns a future that resolves once the message is written (or fails
+    with ConnectionClosed), so callers choose between waiting for it and not.
+    With `max_rate` (bytes per second) frames are paced by a token bucket; the
+    queue backs up and subscription pushes skip to the newest values instead.
+    """
+
+    def __init__(self, websocket, chunk_size=None, weights=None, max_rate=None):
+        self.websocket = websocket
+        self.bucket = TokenBucket(max_rate) if max_rate else None
+        self.chunk_size = chunk_size
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.queues = {CONTROL: deque(), TRACKING: deque(), BULK: deque()}  # [frames, next index, future]
+        self.current = {priority: 0 for priority in self.weights}  # Round-robin state
+        self.wakeup = asyncio.Event()
+        self.next_message_id = 0
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def configure(self, chunk_size=None, max_rate=None):
+        """Apply what the handshake agreed on; takes effect from the next queued message."""
+        self.chunk_size = chunk_size
+        self.bucket = TokenBucket(max_rate) if max_rate else None
+
+    def put(self, payload, priority=CONTROL):
+        future = asyncio.get_running_loop().create_future()
+        if self.closed:
+            future.set_exception(websockets.ConnectionClosed(None, None))
+            return future
+        if self.chunk_size and len(payload) > self.chunk_size:
+            self.next_message_id += 1
+            frames = split_message(payload, self.next_message_id, self.chunk_size)
+        else:
+            frames = [payload]
+        self.queues[priority].append([frames, 0, future])
+        self.wakeup.set()
+        return future
+
+    async def send(self, payload, priority=CONTROL):
+        """Queue a message and wait until it is written."""
+        await self.put(payload, priority)
+
+    def pending(self, priority=None):
+        """Number of queued messages, of one class or in total."""
+        if priority is not None:
+            return len(self.queues[priority])
+        return sum(len(queue) for queue in self.queues.values())
+
+    def next_queue(self):
+        if self.queues[CONTROL]:
+            return self.queues[CONTROL]
+        waiting = [priority for priority in self.weights if self.queues[priority]]
+        if not waiting:
+            return None
+        if len(waiting) == 1:
+            return self.queues[waiting[0]]
+        # Smooth weighted round robin: interleaves the classes evenly in their weight ratio
+        total = 0
+        for priority in waiting:
+            self.current[priority] += self.weights[priority]
+            total += self.weights[priority]
+        chosen = max(waiting, key=lambda priority: self.current[priority])
+        self.current[chosen] -= total
+        return self.queues[chosen]
+
+    async def run(self):
+        try:
+            while True:
+                queue = self.next_queue()
+                if queue is None:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                entry = queue[0]
+                frames, index, future = entry
+                if self.bucket is not None:
+                    await self.bucket.take(len(frames[index]))
+                await self.websocket.send(frames[index])
+                entry[1] = index + 1
+                if entry[1] == len(frames):
+                    queue.popleft()
+                    if not future.done():
+                        future.set_result(None)
+        except websockets.ConnectionClosed as e:
+            self.fail(e)
+        except Exception as e:
+            logging.warning(f"Outbound queue stopped: {e}")
+            self.fail(websockets.ConnectionClosed(None, None))
+
+    def fail(self, error):
+        self.closed = True
+        for queue in self.queues.values():
+            for _, _, future in queue:
+                if not future.done():
+                    future.set_exception(error)
+            queue.clear()
+
+    def stop(self):
+        self.task.cancel()
+        self.fail(websockets.ConnectionClosed(None, None))
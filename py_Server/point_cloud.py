@@ -0,0 +1,194 @@
+import time
+import base64
+import asyncio
+import logging
+import numpy as np
+
+from marker_pose import CameraIntrinsics
+from depth_filter import DepthFilter
+
+
+def intrinsics_from_message(data):
+    """CameraIntrinsics from the `intrinsics` dict attached to depth frame messages, or None."""
+    intrinsics = data.get("intrinsics") if isinstance(data, dict) else None
+    if not intrinsics:
+        return None
+    try:
+        return CameraIntrinsics(int(intrinsics["width"]), int(intrinsics["height"]),
+                                float(intrinsics["fx"]), float(intrinsics["fy"]),
+                                float(intrinsics["ppx"]), float(intrinsics["ppy"]),
+                                intrinsics.get("coeffs", (0.0, 0.0, 0.0, 0.0, 0.0)))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class PointCloudGenerator:
+    """
+    Depth image -> downsampled, quantized point cloud, fully vectorized.
+
+    The per-pixel ray directions are computed once per intrinsics, so a frame
+    costs one multiply by depth. Points outside [min_range, max_range] are
+    dropped, the rest are averaged per voxel. Output uses the y-up
+    convention of the marker streams.
+    """
+
+    def __init__(self, voxel_size=0.02, min_range=0.2, max_range=4.0, stride=2, quantization=0.001):
+        self.voxel_size = voxel_size
+        self.min_range = min_range
+        self.max_range = max_range
+        self.stride = stride  # Pixel subsampling before projection (2 = every other row/column)
+        self.quantization = quantization  # Meters per integer step in the packed output
+
+        self.rays = None  # (pixels, 2) x/z and y/z per sampled pixel
+        self._intrinsics_key = None
+
+    def update_intrinsics(self, intrinsics):
+        key = (intrinsics.width, intrinsics.height, intrinsics.fx, intrinsics.fy,
+               intrinsics.ppx, intrinsics.ppy, self.stride)
+        if key == self._intrinsics_key:
+            return
+        u = np.arange(0, intrinsics.width, self.stride, dtype=np.float32)
+        v = np.arange(0, intrinsics.height, self.stride, dtype=np.float32)
+        uu, vv = np.meshgrid(u, v)
+        # Negate y here once so every frame comes out y-up without an extra pass
+        self.rays = np.stack([
+            ((uu - intrinsics.ppx) / intrinsics.fx).ravel(),
+            (-(vv - intrinsics.ppy) / intrinsics.fy).ravel()
+        ], axis=1)
+        self._intrinsics_key = key
+
+    def generate(self, depth_image, depth_units, color_image=None):
+        """Return (points (N, 3) float32 meters, colors (N, 3) uint8 or None)."""
+        depth = depth_image[::self.stride, ::self.stride]
+        z = depth.ravel().astype(np.float32) * np.float32(depth_units)
+        valid = (z > self.min_range) & (z < self.max_range)
+        z = z[valid]
+        points = np.empty((len(z), 3), dtype=np.float32)
+        points[:, :2] = self.rays[valid] * z[:, None]
+        points[:, 2] = z
+
+        colors = None
+        if color_image is not None:
+            colors = color_image[::self.stride, ::self.stride].reshape(-1, 3)[valid]
+
+        if self.voxel_size > 0 and len(points):
+            points, colors = self.voxel_downsample(points, colors)
+        return points, colors
+
+    def voxel_downsample(self, points, colors=None):
+        """Average all points (and colors) that fall into the same voxel."""
+        voxels = np.floor(points / self.voxel_size).astype(np.int64)
+        voxels -= voxels.min(axis=0)
+        extent = voxels.max(axis=0) + 1
+        keys = (voxels[:, 0] * extent[1] + voxels[:, 1]) * extent[2] + voxels[:, 2]
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+
+        # bincount with weights is a much faster grouped sum than np.add.at
+        downsampled = np.stack([np.bincount(inverse, weights=points[:, i], minlength=len(counts))
+                                for i in range(3)], axis=1) / counts[:, None]
+        if colors is not None:
+            colors = np.stack([np.bincount(inverse, weights=colors[:, i], minlength=len(counts))
+                               for i in range(3)], axis=1) / counts[:, None]
+            colors = colors.astype(np.uint8)
+        return downsampled.astype(np.float32), colors
+
+    def pack(self, points, colors=None, timestamp=None):
+        """Compact stream payload: int16 positions (quantization steps) and uint8 colors, base64 encoded."""
+        quantized = np.clip(np.round(points / self.quantization), -32768, 32767).astype('<i2')
+        return {
+            "count": len(points),
+            "scale": self.quantization,
+            "points": base64.b64encode(quantized.tobytes()).decode('utf-8'),
+            "colors": base64.b64encode(colors.tobytes()).decode('utf-8') if colors is not None else None,
+            "timestamp": timestamp
+        }
+
+
+class PointCloudService:
+    """
+    Turns incoming depth frames into `point_cloud_stream` on the server.
+
+    Each depth stream gets its own `DepthFilter` (by default 2x decimation,
+    outlier removal, temporal smoothing and hole filling), configurable per
+    stream with `configure_filter`. Generation runs in an executor so the
+    event loop keeps serving clients.
+    Depth frames that arrive while a cloud is being built are skipped rather
+    than queued, and output is capped at `max_rate` clouds per second.
+    Nothing is built while no client subscribes to the output stream or has
+    polled it within `request_window` seconds. Depth streams whose messages
+    name a `color_stream` (depth aligned to that color stream) get colored points.
+    """
+
+    def __init__(self, server, output_stream="point_cloud_stream", max_rate=30.0, depth_filter_options=None,
+                 request_window=5.0, **generator_options):
+        self.server = server
+        self.output_stream = output_stream
+        self.max_rate = max_rate
+        self.request_window = request_window
+        self.last_requested = 0.0  # Last request_stream_data poll of the output stream
+        self.depth_filter_options = depth_filter_options or {"decimation": 2}
+        self.depth_filters = {}  # stream name -> DepthFilter
+        generator_options.setdefault("stride", 1)  # The depth filter already decimates
+        self.generator = PointCloudGenerator(**generator_options)
+        self.busy = False
+        self.last_run = 0.0
+        self.warned_no_intrinsics = False
+
+    def depth_filter(self, stream_name):
+        depth_filter = self.depth_filters.get(stream_name)
+        if depth_filter is None:
+            depth_filter = self.depth_filters[stream_name] = DepthFilter(**self.depth_filter_options)
+        return depth_filter
+
+    def wanted(self):
+        """Whether any client currently consumes the point cloud stream."""
+        if time.time() - self.last_requested < self.request_window:
+            return True
+        return bool(self.server.subscriptions.index.match(self.output_stream))
+
+    def configure_filter(self, stream_name, options):
+        """Switch depth filter stages for one stream (e.g. {"temporal_alpha": None} disables smoothing)."""
+        self.depth_filter(stream_name).configure(**options)
+
+    def submit(self, stream_name, depth_image, data, color_image=None):
+        """Called from the event loop with a decoded depth frame and its stream_frame message."""
+        intrinsics = intrinsics_from_message(data)
+        if intrinsics is None:
+            if not self.warned_no_intrinsics:
+                logging.warning("Depth frames carry no intrinsics; point cloud disabled until they do.")
+                self.warned_no_intrinsics = True
+            return
+        now = time.time()
+        if self.busy or now - self.last_run < 1.0 / self.max_rate:
+            return
+        self.busy = True
+        self.last_run = now
+        depth_units = float(data.get("depth_units", 0.001))
+        asyncio.get_running_loop().create_task(self.run(
+            self.depth_filter(stream_name), depth_image, depth_units, intrinsics, color_image,
+            data.get("timestamp") or now))
+
+    def build(self, depth_filter, depth_image, depth_units, intrinsics, color_image, timestamp):
+        depth_image = depth_filter.process(depth_image)
+        if color_image is not None and depth_filter.decimation > 1:
+            k = depth_filter.decimation
+            color_image = color_image[::k, ::k][:depth_image.shape[0], :depth_image.shape[1]]
+        self.generator.update_intrinsics(depth_filter.output_intrinsics(intrinsics))
+        points, colors = self.generator.generate(depth_image, depth_units, color_image)
+        return self.generator.pack(points, colors, timestamp)
+
+    async def run(self, depth_filter, depth_image, depth_units, intrinsics, color_image, timestamp):
+        try:
+            cloud = await asyncio.get_running_loop().run_in_executor(
+                None, self.build, depth_filter, depth_image, depth_units, intrinsics, color_image, timestamp)
+        except Exception as e:
+            logging.error(f"Point cloud generation failed: {e}")
+            return
+        finally:
+            self.busy = False
+
+        if self.output_stream not in self.server.streams:
+            self.server.streams[self.output_stream] = None
+            self.server.app.refresh_stream_dropdown()
+        self.server.streams[self.output_stream] = cloud
+        self.server.subscriptions.notify(self.output_stream)
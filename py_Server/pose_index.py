@@ -0,0 +1,160 @@
+import os
+import json
+import logging
+from collections import defaultdict
+import numpy as np
+
+DEFAULT_POSE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PoseData")
+
+
+class PoseDefinition:
+    """A named rigid set of markers: marker ids and their positions relative to each other."""
+
+    def __init__(self, name, marker_ids, points, source=None):
+        self.name = name
+        self.marker_ids = np.asarray(marker_ids, dtype=np.int64)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.source = source
+
+    @classmethod
+    def from_json(cls, data, source=None, mirror_y=False):
+        """Build a definition from the `PoseData/*.json` layout written by Unity."""
+        marker_ids = []
+        points = []
+        for entry in data.get("markerPositions", []):
+            position = entry["position"]
+            marker_ids.append(int(entry["markerId"]))
+            points.append([position["x"], position["y"], position["z"]])
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if mirror_y:
+            points[:, 1] *= -1.0
+        return cls(data.get("poseName", os.path.splitext(os.path.basename(source or ""))[0]), marker_ids, points, source)
+
+
+class PoseIndex:
+    """
+    Lookup index over a library of pose definitions.
+
+    Every pose is described by rotation-invariant signatures: for each pair of
+    member markers, the (id_a, id_b, quantized distance) triple. Live markers
+    produce the same triples, so candidate poses are found by dictionary
+    lookups whose cost depends on the number of visible markers, not on the
+    size of the library. Only the best few candidates need a rigid fit.
+    """
+
+    def __init__(self, directory=DEFAULT_POSE_DIR, bin_size=0.05, mirror_y=False):
+        self.directory = directory
+        self.bin_size = bin_size  # Distance quantization (meters), usually the match tolerance
+        self.mirror_y = mirror_y
+
+        self.poses = {}  # pose key -> PoseDefinition
+        self.files = {}  # path -> (mtime, [pose keys])
+        self.pair_index = defaultdict(set)  # (id_a, id_b, bin) -> pose keys
+        self.next_key = 0
+
+        self.refresh()
+
+    def refresh(self):
+        """Re-read only the pose files that were added, changed or removed since the last call."""
+        seen = set()
+        changed = False
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.is_file() and e.name.endswith(".json")]
+        except OSError as e:
+            logging.warning(f"Cannot scan pose directory {self.directory}: {e}")
+            entries = []
+
+        for entry in entries:
+            path = entry.path
+            seen.add(path)
+            mtime = entry.stat().st_mtime
+            if path in self.files and self.files[path][0] == mtime:
+                continue
+            self._remove_file(path)
+            self._load_file(path, mtime)
+            changed = True
+
+        for path in list(self.files):
+            if path not in seen:
+                self._remove_file(path)
+                changed = True
+
+        if changed:
+            logging.info(f"Pose index now holds {len(self.poses)} pose(s) from {len(self.files)} file(s)")
+        return changed
+
+    def _load_file(self, path, mtime):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Skipping pose file {path}: {e}")
+            return
+
+        keys = []
+        # A file holds either a single pose or a list of poses
+        for item in (data if isinstance(data, list) else [data]):
+            try:
+                definition = PoseDefinition.from_json(item, source=path, mirror_y=self.mirror_y)
+            except (KeyError, TypeError, ValueError) as e:
+                logging.warning(f"Skipping malformed pose in {path}: {e}")
+                continue
+            key = self.next_key
+            self.next_key += 1
+            self.poses[key] = definition
+            for signature in self._signatures(definition.marker_ids, definition.points):
+                self.pair_index[signature].add(key)
+            keys.append(key)
+        self.files[path] = (mtime, keys)
+
+    def _remove_file(self, path):
+        if path not in self.files:
+            return
+        _, keys = self.files.pop(path)
+        for key in keys:
+            definition = self.poses.pop(key)
+            for signature in self._signatures(definition.marker_ids, definition.points):
+                bucket = self.pair_index.get(signature)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self.pair_index[signature]
+
+    def _pairs(self, ids, points):
+        """Yield (id_a, id_b, distance) for every unordered pair, with id_a < id_b."""
+        ids = np.asarray(ids, dtype=np.int64)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if len(ids) < 2:
+            return
+        rows, cols = np.triu_indices(len(ids), k=1)
+        distances = np.linalg.norm(points[rows] - points[cols], axis=1)
+        first = np.minimum(ids[rows], ids[cols])
+        second = np.maximum(ids[rows], ids[cols])
+        yield from zip(first.tolist(), second.tolist(), distances.tolist())
+
+    def _signatures(self, ids, points):
+        for id_a, id_b, distance in self._pairs(ids, points):
+            yield (id_a, id_b, int(round(distance / self.bin_size)))
+
+    def candidates(self, ids, positions, max_candidates=5, min_votes=3):
+        """
+        Return the pose definitions most consistent with the visible markers.
+
+        Each observed marker pair votes for every pose with the same id pair at
+        a similar distance (one bin of slack on either side). Poses are ranked
+        by votes; at most `max_candidates` with at least `min_votes` are returned.
+        """
+        votes = defaultdict(int)
+        for id_a, id_b, distance in self._pairs(ids, positions):
+            center = int(round(distance / self.bin_size))
+            matched = set()
+            for b in (center - 1, center, center + 1):
+                matched.update(self.pair_index.get((id_a, id_b, b), ()))
+            for key in matched:
+                votes[key] += 1
+
+        ranked = sorted((v, k) for k, v in votes.items() if v >= min_votes)
+        return [self.poses[k] for _, k in reversed(ranked[-max_candidates:])]
+
+    def __len__(self):
+        return len(self.poses)
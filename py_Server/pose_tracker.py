@@ -0,0 +1,99 @@
+import time
+import logging
+import numpy as np
+
+from marker_pose import rotation_matrices_to_quaternions
+from pose_index import PoseIndex, DEFAULT_POSE_DIR
+
+
+def fit_rigid_transform(model, observed):
+    """
+    Least-squares rigid transform (Kabsch) so that observed ~= R @ model + t.
+
+    Returns (R (3, 3), t (3,), per-point residual distances).
+    """
+    model_center = model.mean(axis=0)
+    observed_center = observed.mean(axis=0)
+    covariance = (model - model_center).T @ (observed - observed_center)
+    U, _, Vt = np.linalg.svd(covariance)
+    d = np.sign(np.linalg.det(Vt.T @ U.T))
+    R = Vt.T @ np.diag([1.0, 1.0, d]) @ U.T
+    t = observed_center - R @ model_center
+    residuals = np.linalg.norm(observed - (model @ R.T + t), axis=1)
+    return R, t, residuals
+
+
+class PoseTracker:
+    """
+    Solves the rigid pose of every object defined in `PoseData` from the
+    currently visible member markers, once per camera frame.
+
+    Candidate poses come from a `PoseIndex` lookup, so only a few poses get a
+    full rigid fit however large the library grows. Changed pose files are
+    picked up every `reload_interval` seconds.
+
+    Marker positions must be in the same frame the definitions were recorded
+    in; pass `mirror_y=True` when feeding y-flipped positions (the locate
+    clients' convention) so the definitions are mirrored to match.
+    """
+
+    def __init__(self, directory=DEFAULT_POSE_DIR, tolerance=0.05, min_markers=3, mirror_y=False,
+                 max_candidates=5, reload_interval=1.0):
+        self.directory = directory
+        self.tolerance = tolerance  # Max per-marker residual (meters) for a pose to count as matched
+        self.min_markers = min_markers
+        self.max_candidates = max_candidates
+        self.reload_interval = reload_interval
+        self.index = PoseIndex(directory, bin_size=tolerance, mirror_y=mirror_y)
+        self.last_reload = time.time()
+        logging.info(f"Loaded {len(self.index)} pose definition(s) from {directory}")
+
+    def solve(self, ids, positions):
+        """
+        Fit the candidate poses that have enough visible members.
+
+        Returns (results, matched_name) where results is a list of dicts with
+        the pose name, position, quaternion (x, y, z, w), RMS residual, number
+        of markers used and whether every used marker is within tolerance.
+        `matched_name` is the best matching pose or None.
+        """
+        now = time.time()
+        if now - self.last_reload >= self.reload_interval:
+            self.index.refresh()
+            self.last_reload = now
+
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        lookup = {int(marker_id): i for i, marker_id in enumerate(ids)}
+
+        min_votes = self.min_markers * (self.min_markers - 1) // 2
+        candidates = self.index.candidates(ids, positions, self.max_candidates, min_votes)
+
+        results = []
+        best = None
+        for definition in candidates:
+            members = [(j, lookup[int(m)]) for j, m in enumerate(definition.marker_ids) if int(m) in lookup]
+            if len(members) < self.min_markers:
+                continue
+
+            model_rows, observed_rows = zip(*members)
+            R, t, residuals = fit_rigid_transform(
+                definition.points[list(model_rows)], positions[list(observed_rows)])
+            rms = float(np.sqrt(np.mean(residuals ** 2)))
+            matched = bool(np.all(residuals <= self.tolerance))
+
+            result = {
+                "pose_name": definition.name,
+                "position": t,
+                "quaternion": rotation_matrices_to_quaternions(R[None])[0],
+                "rms": rms,
+                "markers": len(members),
+                "matched": matched
+            }
+            results.append(result)
+
+            # Prefer poses explained by more markers, then by a tighter fit
+            if matched and (best is None or (result["markers"], -rms) > (best["markers"], -best["rms"])):
+                best = result
+
+        return results, (best["pose_name"] if best else None)
@@ -0,0 +1,117 @@
+import time
+import logging
+import threading
+import pyrealsense2 as rs
+
+
+class CapturedFrame:
+    """One aligned color/depth pair plus its timing information."""
+
+    def __init__(self, color, depth, frame_number, hardware_timestamp, timestamp_domain, arrival_time):
+        self.color = color
+        self.depth = depth
+        self.frame_number = frame_number
+        self.hardware_timestamp = hardware_timestamp  # Milliseconds, in `timestamp_domain`
+        self.timestamp_domain = timestamp_domain
+        self.arrival_time = arrival_time  # time.time() when the SDK delivered the frameset
+
+
+class RealSenseCapture:
+    """
+    Callback-driven RealSense capture with a keep-latest handoff.
+
+    The SDK delivers framesets on its own thread; the callback only stores
+    the newest one (releasing the previous one if nobody took it), so the
+    sensor keeps running at full rate however long processing takes.
+    Consumers call `get()`, which aligns depth to color on the consumer's
+    thread. Frames replaced before they were taken and gaps in the hardware
+    frame counter are both counted.
+    """
+
+    def __init__(self, serial=None, width=640, height=480, fps=30, align_to_color=True):
+        self.serial = serial
+        self.pipeline = rs.pipeline()
+        self.config = rs.config()
+        if serial:
+            self.config.enable_device(serial)
+        self.config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, fps)
+        self.config.enable_stream(rs.stream.depth, width, height, rs.format.z16, fps)
+        self.align = rs.align(rs.stream.color) if align_to_color else None
+        self.profile = None
+
+        self.condition = threading.Condition()
+        self.latest = None  # (frameset, arrival_time) not yet taken by a consumer
+        self.running = False
+
+        self.frames_received = 0
+        self.frames_delivered = 0
+        self.frames_replaced = 0  # Overwritten before processing got to them
+        self.frames_missed = 0  # Gaps in the sensor frame counter (dropped inside the SDK/USB)
+        self.last_frame_number = None
+
+    def start(self):
+        self.running = True
+        self.profile = self.pipeline.start(self.config, self.on_frameset)
+        return self.profile
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.latest = None
+            self.condition.notify_all()
+        self.pipeline.stop()
+
+    def depth_units(self):
+        return self.profile.get_device().first_depth_sensor().get_depth_scale()
+
+    def on_frameset(self, frame):
+        """SDK thread: keep only the newest frameset. Must return quickly."""
+        arrival_time = time.time()
+        frameset = frame.as_frameset()
+        if not frameset:
+            return
+        frame_number = frameset.get_frame_number()
+        with self.condition:
+            self.frames_received += 1
+            if self.last_frame_number is not None and frame_number > self.last_frame_number + 1:
+                self.frames_missed += frame_number - self.last_frame_number - 1
+            self.last_frame_number = frame_number
+            if self.latest is not None:
+                self.frames_replaced += 1
+            # Dropping the old reference here returns its buffers to the SDK pool
+            self.latest = (frameset, arrival_time)
+            self.condition.notify()
+
+    def get(self, timeout=1.0):
+        """Block until a new frameset is available; returns a CapturedFrame or None on timeout/stop."""
+        with self.condition:
+            if self.latest is None:
+                self.condition.wait(timeout)
+            if self.latest is None:
+                return None
+            frameset, arrival_time = self.latest
+            self.latest = None
+            self.frames_delivered += 1
+
+        if self.align is not None:
+            frameset = self.align.process(frameset)
+        color = frameset.get_color_frame()
+        depth = frameset.get_depth_frame()
+        if not color or not depth:
+            return None
+        return CapturedFrame(color, depth, frameset.get_frame_number(), frameset.get_timestamp(),
+                             str(frameset.get_frame_timestamp_domain()), arrival_time)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "received": self.frames_received,
+                "delivered": self.frames_delivered,
+                "replaced": self.frames_replaced,
+                "missed": self.frames_missed
+            }
+
+    def log_stats(self, label=""):
+        stats = self.stats()
+        logging.info(f"{label}Capture: {stats['received']} received, {stats['delivered']} processed, "
+                     f"{stats['replaced']} skipped by processing, {stats['missed']} missed by the sensor")
@@ -1,13 +1,9 @@
-import asyncio
-import websockets
-import json
 import tkinter as tk
 from tkinter import messagebox
-import threading
-import base64
 import numpy as np
 import cv2
 from PIL import Image, ImageTk
+from stream_client import SyncStreamClient
 
 class StreamRequestClient:
     def __init__(self):
@@ -38,9 +34,10 @@ class StreamRequestClient:
         self.frame_label.grid(row=5, column=0, columnspan=2)
 
         self.window.protocol("WM_DELETE_WINDOW", self.on_close)
-        self.websocket = None
-        self.loop = asyncio.get_event_loop()
-        self.running = True
+        # The SDK client connects, reconnects and reads same-host frames from shared memory
+        self.client = None
+        self.stream_name = None
+        self.shown_frame = None
 
     def start_connection(self):
         host = self.host_entry.get()
@@ -51,79 +48,30 @@ class StreamRequestClient:
         if not host or not port or not client_id or not stream_name:
             messagebox.showerror("Input Error", "Please provide host, port, client ID, and stream name.")
             return
+        if self.client is not None:
+            self.client.close()
+
+        # The client runs on its own thread; the GUI polls the newest frame
+        self.client = SyncStreamClient(host, int(port), client_id)
+        self.client.start(wait=False)
+        self.stream_name = stream_name
+        self.client.subscribe(stream_name, kind="frames")
+        print(f"Subscribed to {stream_name} at ws://{host}:{port}")
+        self.poll_frames()
+
+    def poll_frames(self):
+        if self.client is None:
+            return
+        frame = self.client.latest(self.stream_name, kind="frames")
+        if frame is not None and frame is not self.shown_frame:
+            self.shown_frame = frame
+            self.display_frame(frame)
+        self.window.after(30, self.poll_frames)
 
-        # Start the connection in a new thread to avoid blocking the GUI
-        threading.Thread(target=self.run_client_thread, args=(host, port, client_id, stream_name), daemon=True).start()
-
-    def run_client_thread(self, host, port, client_id, stream_name):
-        self.loop.run_until_complete(self.run_client(host, port, client_id, stream_name))
-
-    async def run_client(self, host, port, client_id, stream_name):
-        uri = f"ws://{host}:{port}"
-        while self.running:
-            try:
-                async with websockets.connect(uri) as websocket:
-                    self.websocket = websocket
-                    print(f"Connected to server at {uri}")
-
-                    # Send initial client ID
-                    await self.send_id(client_id)
-
-                    # Create tasks for requesting frames and listening for frames
-                    request_task = asyncio.create_task(self.request_stream_data(stream_name))
-                    listen_task = asyncio.create_task(self.listen_for_frames())
-
-                    # Wait for both tasks to complete
-                    await asyncio.gather(request_task, listen_task)
-            except Exception as e:
-                print(f"Connection Error: {e}. Reconnecting in 2 seconds...")
-                await asyncio.sleep(2)
-
-    async def send_id(self, client_id):
-        message = {"client_id": client_id}
-        await self.websocket.send(json.dumps(message))
-        print(f"Sent client_id: {client_id} to server")
-
-    async def request_stream_data(self, stream_name):
-        while self.running:
-            try:
-                if self.websocket and self.websocket.open:
-                    message = {"command": "request_stream_data", "stream_name": stream_name}
-                    await self.websocket.send(json.dumps(message))
-                    print(f"Requested stream: {stream_name}")
-                
-                # Wait a short time before sending the next request
-                await asyncio.sleep(0.1)  # Adjust the interval as needed
-            except Exception as e:
-                print(f"Error requesting stream data: {e}")
-                break
-
-    async def listen_for_frames(self):
-        try:
-            async for message in self.websocket:
-                data = json.loads(message)
-                if data.get("command") == "stream_data":
-                    frame_type = data.get("frame_type", "rgb")
-                    base64_frame = data.get("data")
-                    self.display_frame(base64_frame, frame_type)
-        except websockets.ConnectionClosed:
-            print("Connection to server closed.")
-        except Exception as e:
-            print(f"Error while receiving frames: {e}")
-
-    def display_frame(self, base64_frame, frame_type):
+    def display_frame(self, frame):
         try:
-            # Decode the base64 frame
-            frame_bytes = base64.b64decode(base64_frame)
-            if frame_type == "rgb":
-                # Decode RGB frame from JPEG bytes
-                np_arr = np.frombuffer(frame_bytes, np.uint8)
-                frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)  # Reads in BGR format
-            
-            elif frame_type == "depth":
-                # Decode depth frame from raw bytes (adjust shape as necessary)
-                frame = np.frombuffer(frame_bytes, dtype=np.uint16).reshape((480, 640))
-                frame = cv2.convertScaleAbs(frame, alpha=0.03)  # Adjust scaling as needed
+            if frame.dtype == np.uint16:
+                frame = cv2.convertScaleAbs(frame, alpha=0.03)  # Depth; adjust scaling as needed
 
             # Convert the frame to an ImageTk format and display it
             image = ImageTk.PhotoImage(Image.fromarray(frame))
@@ -132,11 +80,10 @@ class StreamRequestClient:
         except Exception as e:
             print(f"Error displaying frame: {e}")
 
-
     def on_close(self):
-        self.running = False
-        if self.websocket and not self.websocket.closed:
-            self.loop.run_until_complete(self.websocket.close())
+        if self.client is not None:
+            self.client.close()
+            self.client = None
         self.window.destroy()
 
     def run(self):
@@ -0,0 +1,176 @@
+import os
+import re
+import hashlib
+import secrets
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+# Shared-memory frame ring for processes on the same host. Layout:
+#   ring header: magic "FRNG", version u16, reserved u16, slot count u32, slot payload capacity u32,
+#     generation u32 (differs whenever a writer (re)creates the block under the same name)
+#   then `slot count` slots, each a 64-byte header followed by the payload:
+#     seq_begin u64, timestamp f64, width u32, height u32, channels u16, dtype u8, pad, nbytes u32, seq_end u64
+# Writers bump seq_begin, write the payload, then set seq_end (a seqlock): a reader that sees
+# seq_begin == seq_end == the announced seq after copying knows the slot was not overwritten meanwhile.
+# Notifications carry the generation, so readers holding a block that was since unlinked reopen the name.
+RING_MAGIC = b"FRNG"
+RING_VERSION = 2
+RING_HEADER_FORMAT = "<4sHHIII"
+RING_HEADER_SIZE = 64
+SLOT_HEADER_FORMAT = "<QdIIHBxIQ"
+SLOT_HEADER_SIZE = 64
+SEQ_END_OFFSET = struct.calcsize(SLOT_HEADER_FORMAT) - 8
+
+DTYPES = [np.uint8, np.uint16, np.float32]
+DTYPE_CODES = {np.dtype(d): i for i, d in enumerate(DTYPES)}
+
+
+def ring_name(stream_name):
+    """
+    Shared memory block name for a stream: short and filesystem-safe for POSIX (macOS allows
+    31 characters) and Windows, readable prefix plus a hash of the full name so it is unique.
+    """
+    digest = hashlib.sha1(stream_name.encode("utf-8")).hexdigest()[:12]
+    return "frm_" + re.sub(r"[^A-Za-z0-9_]", "_", stream_name)[:10] + "_" + digest
+
+
+class FrameRingWriter:
+    """Producer side: owns the shared memory block and writes frames round-robin into its slots."""
+
+    def __init__(self, name, slot_size, slot_count=4):
+        self.name = name
+        self.slot_size = slot_size
+        self.slot_count = slot_count
+        self.stride = SLOT_HEADER_SIZE + slot_size
+        self.generation = secrets.randbits(32)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=RING_HEADER_SIZE + slot_count * self.stride)
+        except FileExistsError:
+            # Left behind by a producer that crashed; take it over
+            stale = shared_memory.SharedMemory(name=name)
+            if len(stale.buf) >= RING_HEADER_SIZE:
+                header = struct.unpack_from(RING_HEADER_FORMAT, stale.buf, 0)
+                if header[0] == RING_MAGIC and header[1] == RING_VERSION:
+                    self.generation = (header[5] + 1) & 0xFFFFFFFF
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=RING_HEADER_SIZE + slot_count * self.stride)
+        struct.pack_into(RING_HEADER_FORMAT, self.shm.buf, 0, RING_MAGIC, RING_VERSION, 0, slot_count, slot_size,
+                         self.generation)
+        self.seq = 0
+
+    def write(self, frame, timestamp=None):
+        """Copy `frame` into the next slot; returns (slot, seq) to announce to consumers."""
+        frame = np.ascontiguousarray(frame)
+        if frame.nbytes > self.slot_size:
+            raise ValueError(f"Frame of {frame.nbytes} bytes does not fit slots of {self.slot_size} bytes")
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+
+        self.seq += 1
+        slot = self.seq % self.slot_count
+        offset = RING_HEADER_SIZE + slot * self.stride
+        struct.pack_into("<Q", self.shm.buf, offset, self.seq)
+        self.shm.buf[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + frame.nbytes] = frame.reshape(-1).view(np.uint8)
+        struct.pack_into(SLOT_HEADER_FORMAT, self.shm.buf, offset, self.seq, timestamp or time.time(),
+                         width, height, channels, DTYPE_CODES[frame.dtype], frame.nbytes, self.seq)
+        return slot, self.seq
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class FrameRingReader:
+    """Consumer side: attaches to a writer's ring by name and reads announced slots."""
+
+    def __init__(self, name):
+        self.name = name
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+        except TypeError:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if os.name == "posix":
+                # Attaching registers the block with this process's resource tracker, which would
+                # unlink it when we exit; only the writer owns it
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        magic, version, _, self.slot_count, self.slot_size, self.generation = struct.unpack_from(
+            RING_HEADER_FORMAT, self.shm.buf, 0)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            self.shm.close()
+            raise ValueError(f"{name} is not a frame ring (magic {magic!r}, version {version})")
+        self.stride = SLOT_HEADER_SIZE + self.slot_size
+
+    def view(self, slot):
+        """(seq, timestamp, array view) of a slot without copying; check `is_current` after using it."""
+        offset = RING_HEADER_SIZE + slot * self.stride
+        seq, timestamp, width, height, channels, dtype, nbytes, _ = struct.unpack_from(
+            SLOT_HEADER_FORMAT, self.shm.buf, offset)
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        frame = np.ndarray(shape, dtype=DTYPES[dtype], buffer=self.shm.buf, offset=offset + SLOT_HEADER_SIZE)
+        return seq, timestamp, frame
+
+    def is_current(self, slot, seq):
+        offset = RING_HEADER_SIZE + slot * self.stride
+        seq_begin = struct.unpack_from("<Q", self.shm.buf, offset)[0]
+        seq_end = struct.unpack_from("<Q", self.shm.buf, offset + SEQ_END_OFFSET)[0]
+        return seq_begin == seq_end == seq
+
+    def read(self, slot, seq):
+        """Copy of the frame announced as (slot, seq), or None if the writer has already reused the slot."""
+        if not self.is_current(slot, seq):
+            return None
+        _, timestamp, frame = self.view(slot)
+        frame = frame.copy()
+        if not self.is_current(slot, seq):
+            return None
+        return frame, timestamp
+
+    def close(self):
+        self.shm.close()
+
+
+class FrameRingCache:
+    """
+    Readers for the rings named in stream_frame_local notifications, kept open between frames.
+
+    A producer that restarts (or changes resolution) unlinks its block and creates a new one
+    under the same name; a reader still mapping the old block would keep returning its last
+    frames. The notification's generation tells the two apart and the reader is reopened.
+    """
+
+    def __init__(self):
+        self.readers = {}  # shm name -> FrameRingReader
+
+    def read(self, notification):
+        """
+        Copy of the announced frame, or None if it was overwritten meanwhile (or belongs to an
+        older generation of the ring). Raises OSError / ValueError if the ring cannot be read.
+        """
+        name = notification["shm_name"]
+        generation = notification.get("generation")
+        reader = self.readers.get(name)
+        if reader is not None and generation is not None and reader.generation != generation:
+            self.drop(name)
+            reader = None
+        if reader is None:
+            reader = self.readers[name] = FrameRingReader(name)
+        if generation is not None and reader.generation != generation:
+            return None  # The notification is older than the block now under that name
+        try:
+            result = reader.read(notification["slot"], notification["seq"])
+        except (OSError, ValueError, struct.error):
+            self.drop(name)
+            raise
+        return result[0] if result is not None else None
+
+    def drop(self, name):
+        reader = self.readers.pop(name, None)
+        if reader is not None:
+            reader.close()
+
+    def close(self):
+        for name in list(self.readers):
+            self.drop(name)
@@ -0,0 +1,559 @@
+import asyncio
+import base64
+import json
+import logging
+import random
+import threading
+import numpy as np
+import cv2
+import websockets
+
+import message_codec
+from delta_stream import DeltaEncoder, DeltaStreamState
+from message_chunks import ChunkReassembler, is_chunk, split_message, CHUNK_SIZE, MAX_MESSAGE_SIZE, LEGACY_MAX_SIZE
+from shm_transport import FrameRingCache
+from topic_index import ONE_LEVEL, topic_matches
+
+
+def markers_to_list(ids, positions, quaternions):
+    """Marker arrays -> the list of marker dicts used on aruco streams."""
+    return [
+        {
+            "marker_id": int(marker_id),
+            "x": round(x, 3), "y": round(y, 3), "z": round(z, 3),
+            "qx": round(qx, 3), "qy": round(qy, 3), "qz": round(qz, 3), "qw": round(qw, 3)
+        }
+        for marker_id, (x, y, z), (qx, qy, qz, qw) in zip(
+            ids, np.asarray(positions).tolist(), np.asarray(quaternions).tolist())
+    ]
+
+
+class MarkerArray:
+    """Decoded marker stream value: ids (N,), positions (N, 3) and quaternions (N, 4, x y z w)."""
+
+    def __init__(self, ids, positions, quaternions, timestamp=None):
+        self.ids = ids
+        self.positions = positions
+        self.quaternions = quaternions
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_list(cls, markers, timestamp=None):
+        markers = [m for m in markers or [] if isinstance(m, dict) and "marker_id" in m]
+        ids = np.array([m["marker_id"] for m in markers], dtype=np.int64)
+        positions = np.array([[m.get("x", 0.0), m.get("y", 0.0), m.get("z", 0.0)] for m in markers],
+                             dtype=np.float64).reshape(-1, 3)
+        quaternions = np.array([[m.get("qx", 0.0), m.get("qy", 0.0), m.get("qz", 0.0), m.get("qw", 1.0)]
+                                for m in markers], dtype=np.float64).reshape(-1, 4)
+        return cls(ids, positions, quaternions, timestamp)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def encode_frame(image, frame_type="rgb", jpeg_quality=80):
+    """Image -> base64 payload of a stream_frame message (JPEG for color, raw uint16 for depth)."""
+    if frame_type == "rgb":
+        _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    else:
+        buffer = np.ascontiguousarray(image, dtype=np.uint16).tobytes()
+    return base64.b64encode(buffer).decode('utf-8')
+
+
+def decode_frame(payload, frame_type="rgb", width=640, height=480):
+    """Base64 stream_frame payload -> NumPy image (BGR uint8 or uint16 depth), or None."""
+    frame_bytes = base64.b64decode(payload)
+    if frame_type == "rgb":
+        return cv2.imdecode(np.frombuffer(frame_bytes, np.uint8), cv2.IMREAD_COLOR)
+    return np.frombuffer(frame_bytes, dtype=np.uint16).reshape((height, width))
+
+
+class Subscription:
+    """
+    Async iterator over the decoded values of a subscribed stream or wildcard pattern.
+
+    Keeps only the newest undelivered value per stream: a consumer that falls
+    behind skips to the latest one instead of working through a backlog.
+    Wildcard subscriptions ("cam/*/aruco") yield (stream_name, value) pairs.
+    """
+
+    def __init__(self, client, stream_name, decode):
+        self.client = client
+        self.stream_name = stream_name
+        self.decode = decode
+        self.wildcard = ONE_LEVEL in stream_name
+        self.pending = {}  # stream name -> newest undelivered value, oldest stream first
+        self.available = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, stream_name, value):
+        if self.pending.pop(stream_name, None) is not None:
+            self.dropped += 1
+        self.pending[stream_name] = value
+        self.available.set()
+
+    async def get(self):
+        while not self.pending:
+            self.available.clear()
+            await self.available.wait()
+        stream_name = next(iter(self.pending))
+        value = self.pending.pop(stream_name)
+        return (stream_name, value) if self.wildcard else value
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    async def close(self):
+        await self.client.unsubscribe(self)
+
+
+class StreamClient:
+    """
+    Headless asyncio client for the WebSocket server, for producers and consumers alike.
+
+    Opens every connection with a single hello (ID, capabilities and
+    subscriptions) and reconnects with exponential backoff. Messages use the
+    codec agreed in the welcome (MessagePack or CBOR when both sides have it,
+    else JSON).
+    Reconnects present the session token so the server resumes the session
+    and only pushes what was missed; when the session has expired, the
+    subscriptions are restored and delta-encoded streams restart with a keyframe. Producers use the `publish_*`
+    helpers; consumers iterate over `subscribe`, `frames` or `markers`.
+    Other server commands can be handled with `on(command, handler)`.
+    Use `SyncStreamClient` from threaded or non-async code.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, client_id="stream_client",
+                 reconnect_min=0.1, reconnect_max=5.0, local=None, node_id=None):
+        self.uri = f"ws://{host}:{port}"
+        self.client_id = client_id
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        # Same-host clients read frame streams straight from the producer's shared-memory ring
+        self.local = host in ("127.0.0.1", "localhost") if local is None else local
+        self.node_id = node_id  # Set when the client is a relay of another server (see StreamRelay)
+
+        self.websocket = None
+        self.session_token = None  # Lets the server resume our subscriptions after a short drop
+        self.capabilities = {"codecs": message_codec.available_codecs(), "binary_frames": False,
+                             "chunked": True}  # Offered in the hello
+        self.server_capabilities = {}  # What the server agreed to in its welcome
+        self.server_node_id = None  # Node id the server reports in its welcome
+        self.codec = message_codec.JSON  # Codec of the current connection, from the welcome
+        self.chunks = ChunkReassembler()  # Large server messages arrive in chunks
+        self.next_message_id = 0  # Of our own chunked messages
+        self.connected = asyncio.Event()
+        self.running = False
+        self.task = None
+
+        self.subscriptions = {}  # stream name or pattern -> list of Subscription
+        self.routes = {}  # stream name -> subscribed patterns matching it (cache)
+        self.filters = {}  # stream name or pattern -> server-side filter (marker_ids, bbox, min_confidence)
+        self.received_state = {}  # stream name -> DeltaStreamState of delta-encoded subscriptions
+        self.encoders = {}  # stream name -> DeltaEncoder of published marker streams
+        self.handlers = {}  # command -> list of async or plain callables taking the message
+        self.frame_rings = FrameRingCache()  # Readers of same-host producers' shared-memory rings
+
+    # Connection
+
+    async def start(self, wait=True):
+        """Connect in the background; with `wait`, returns once the first connection is up."""
+        self.running = True
+        self.task = asyncio.get_running_loop().create_task(self.run())
+        if wait:
+            await self.connected.wait()
+
+    async def close(self):
+        self.running = False
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self.task is not None:
+            self.task.cancel()
+        self.frame_rings.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def run(self):
+        """Connection loop: connect, serve, and reconnect with jittered exponential backoff."""
+        delay = self.reconnect_min
+        while self.running:
+            try:
+                async with websockets.connect(self.uri, max_size=LEGACY_MAX_SIZE) as websocket:
+                    resumed, server_streams = await self.handshake(websocket)
+                    self.websocket = websocket
+                    delay = self.reconnect_min
+                    await self.restore(websocket, resumed, server_streams)
+                    self.connected.set()
+                    logging.info(f"Connected to {self.uri} as {self.client_id}")
+                    await self.listen(websocket)
+            except (OSError, asyncio.TimeoutError, websockets.ConnectionClosed) as e:
+                logging.warning(f"Connection to {self.uri} lost: {e}")
+            except Exception:
+                # A bug on our side must not end the client; start over on a fresh connection
+                logging.exception(f"Connection to {self.uri} failed")
+            finally:
+                self.connected.clear()
+                self.websocket = None
+            if self.running:
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.reconnect_max)
+
+    async def handshake(self, websocket, timeout=2.0):
+        """
+        Send our hello without waiting to be asked: ID, capabilities, subscriptions and, when
+        reconnecting, the session token with the seq we applied per delta stream. The server
+        confirms with one welcome message. Returns (resumed, server-side subscriptions).
+        """
+        hello = {
+            "command": "hello",
+            "client_id": self.client_id,
+            "capabilities": self.capabilities,
+            "subscriptions": [self.subscription_entry(name) for name in self.subscriptions]
+        }
+        if self.node_id:
+            hello["node_id"] = self.node_id
+        if self.session_token:
+            hello["session"] = self.session_token
+            hello["seqs"] = {name: state.seq for name, state in self.received_state.items() if state.seq is not None}
+        self.codec = message_codec.JSON  # Until the server agrees on another one
+        self.server_capabilities = {}
+        self.chunks = ChunkReassembler()
+        await websocket.send(json.dumps(hello))
+
+        # The server asks with REQUEST_ID first (our hello already answered it); an older one sends no welcome
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                message = message_codec.decode(await asyncio.wait_for(websocket.recv(), deadline - loop.time()))
+            except asyncio.TimeoutError:
+                return False, []
+            if message.get("command") == "welcome":
+                break
+        self.session_token = message.get("token")
+        self.server_capabilities = message.get("capabilities") or {}
+        self.server_node_id = message.get("node_id")
+        self.codec = message_codec.get_codec(self.server_capabilities.get("codec"))
+        if self.server_capabilities.get("chunked"):
+            websocket.max_size = MAX_MESSAGE_SIZE  # Anything larger comes in chunks
+        return bool(message.get("resumed")), message.get("streams") or []
+
+    async def restore(self, websocket, resumed=False, server_streams=()):
+        """Bring the server's subscriptions in line with ours and restart delta streams after (re)connecting."""
+        if not resumed:
+            self.received_state.clear()  # Fresh subscriptions start with keyframes
+        for stream_name in self.subscriptions:
+            if stream_name not in server_streams:
+                # Only needed for servers that ignore the hello's subscriptions
+                await websocket.send(self.codec.encode(dict(self.subscription_entry(stream_name), command="subscribe")))
+        for stream_name in server_streams:
+            if stream_name not in self.subscriptions:
+                await websocket.send(self.codec.encode({"command": "unsubscribe", "stream_name": stream_name}))
+        if not resumed:
+            for encoder in self.encoders.values():
+                encoder.request_keyframe()
+
+    async def listen(self, websocket):
+        """
+        Handle server messages until the connection closes. A message that cannot be
+        reassembled or decoded, or a handler that raises, is logged and skipped; only
+        transport errors end the connection.
+        """
+        async for message in websocket:
+            try:
+                if is_chunk(message):
+                    message = self.chunks.add(message)
+                    if message is None:
+                        continue  # More chunks to come
+                data = message_codec.decode(message, self.codec)
+                if not isinstance(data, dict):
+                    raise ValueError(f"expected a message object, got {type(data).__name__}")
+            except Exception as e:
+                logging.warning(f"Dropped a malformed message from {self.uri}: {e}")
+                continue
+            await self.handle(data)
+
+    async def handle(self, data):
+        command = data.get("command")
+        try:
+            if command == "stream_data" and self.route(data.get("stream_name")):
+                await self.dispatch_stream_data(data)
+            elif command == "request_keyframe" and data.get("stream_name") in self.encoders:
+                self.encoders[data["stream_name"]].request_keyframe()
+            elif command == "error":
+                logging.warning(f"Server rejected '{data.get('request')}' from {self.client_id}: {data.get('message')}")
+        except websockets.ConnectionClosed:
+            raise
+        except Exception:
+            logging.exception(f"Error handling '{command}' from {self.uri}")
+        for handler in list(self.handlers.get(command, ())):
+            try:
+                result = handler(data)
+                if asyncio.iscoroutine(result):
+                    await result
+            except websockets.ConnectionClosed:
+                raise
+            except Exception:
+                logging.exception(f"Handler for '{command}' failed")
+
+    def on(self, command, handler):
+        """Call `handler(message)` (plain or async) for every server message with this command."""
+        self.handlers.setdefault(command, []).append(handler)
+
+    async def send(self, message):
+        """
+        Send a message dict; returns False (and drops it) while disconnected. Large messages go
+        in chunks when the server takes them, so other sends can go out in between.
+        """
+        websocket = self.websocket
+        if websocket is None:
+            return False
+        payload = self.codec.encode(message)
+        try:
+            if len(payload) > CHUNK_SIZE and self.server_capabilities.get("chunked"):
+                self.next_message_id += 1
+                for chunk in split_message(payload, self.next_message_id):
+                    await websocket.send(chunk)
+            else:
+                await websocket.send(payload)
+        except websockets.ConnectionClosed:
+            return False
+        return True
+
+    # Producers
+
+    async def publish(self, stream_name, data, **fields):
+        """Publish a stream value as-is (stream_data)."""
+        message = {"command": "stream_data", "stream_name": stream_name, "data": data}
+        message.update(fields)
+        return await self.send(message)
+
+    async def publish_markers(self, ids, positions, quaternions, stream_name="aruco_position_stream",
+                              timestamp=None, **fields):
+        """Publish marker arrays as a delta-encoded stream (keyframes on connect and on request)."""
+        encoder = self.encoders.get(stream_name)
+        if encoder is None:
+            encoder = self.encoders[stream_name] = DeltaEncoder()
+        message = {"command": "stream_data", "stream_name": stream_name, "timestamp": timestamp}
+        message.update(fields)
+        message.update(encoder.encode(markers_to_list(ids, positions, quaternions), timestamp))
+        return await self.send(message)
+
+    async def publish_frame(self, stream_name, image, frame_type="rgb", **fields):
+        """Publish an image as a stream_frame (extra fields, e.g. intrinsics, go along with it)."""
+        message = {"command": "stream_frame", "stream_name": stream_name, "frame_type": frame_type,
+                   "data": encode_frame(image, frame_type)}
+        message.update(fields)
+        return await self.send(message)
+
+    # Consumers
+
+    def subscribe(self, stream_name, decode=None, filter=None):
+        """
+        Subscription yielding the values of a stream, or of every stream matching a wildcard
+        pattern, passed through `decode(message)` if given. `filter` ({"marker_ids": [...],
+        "bbox": {"min": [x, y, z], "max": [x, y, z]}, "min_confidence": c}) is applied by the
+        server; there is one filter per stream name or pattern, the latest one given wins.
+        """
+        subscription = Subscription(self, stream_name, decode or (lambda message: message.get("data")))
+        changed = stream_name not in self.subscriptions or (filter is not None and filter != self.filters.get(stream_name))
+        self.subscriptions.setdefault(stream_name, []).append(subscription)
+        if filter is not None:
+            self.filters[stream_name] = filter
+            self.received_state.pop(stream_name, None)  # The server restarts it with a filtered keyframe
+        self.routes.clear()
+        if changed and self.websocket is not None:
+            asyncio.get_running_loop().create_task(
+                self.send(dict(self.subscription_entry(stream_name), command="subscribe")))
+        return subscription
+
+    def subscription_entry(self, stream_name):
+        entry = {"stream_name": stream_name, "local": self.local}
+        if stream_name in self.filters:
+            entry["filter"] = self.filters[stream_name]
+        return entry
+
+    def frames(self, stream_name):
+        """Subscription yielding decoded NumPy frames of a frame stream."""
+        return self.subscribe(stream_name, self.decode_frame_message)
+
+    def markers(self, stream_name="aruco_position_stream", marker_ids=None, bbox=None, min_confidence=None):
+        """
+        Subscription yielding MarkerArray values of a marker stream, optionally only the given ids,
+        the markers inside `bbox` ((min x, y, z), (max x, y, z)) or those with enough confidence.
+        """
+        content_filter = {}
+        if marker_ids is not None:
+            content_filter["marker_ids"] = [int(i) for i in marker_ids]
+        if bbox is not None:
+            content_filter["bbox"] = {"min": list(bbox[0]), "max": list(bbox[1])}
+        if min_confidence is not None:
+            content_filter["min_confidence"] = min_confidence
+        return self.subscribe(stream_name, lambda message: MarkerArray.from_list(
+            message.get("data"), message.get("timestamp")), content_filter or None)
+
+    async def unsubscribe(self, subscription):
+        subscriptions = self.subscriptions.get(subscription.stream_name, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+        if not subscriptions:
+            self.subscriptions.pop(subscription.stream_name, None)
+            self.filters.pop(subscription.stream_name, None)
+            self.routes.clear()
+            for stream_name in list(self.received_state):
+                if not self.route(stream_name):
+                    del self.received_state[stream_name]
+            await self.send({"command": "unsubscribe", "stream_name": subscription.stream_name})
+
+    async def request(self, stream_name, timeout=2.0):
+        """One-off read of a stream's current value without subscribing (raw stream_data message)."""
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+
+        def on_stream_data(message):
+            # Requests never get deltas; those are subscription pushes of the same stream
+            if message.get("stream_name") == stream_name and message.get("encoding") != "delta" and not reply.done():
+                reply.set_result(message)
+
+        self.on("stream_data", on_stream_data)
+        try:
+            await self.send({"command": "request_stream_data", "stream_name": stream_name, "local": self.local})
+            return await asyncio.wait_for(reply, timeout)
+        finally:
+            self.handlers["stream_data"].remove(on_stream_data)
+
+    async def dispatch_stream_data(self, message):
+        stream_name = message["stream_name"]
+        if message.get("encoding") in ("keyframe", "delta"):
+            state = self.received_state.setdefault(stream_name, DeltaStreamState())
+            if not state.apply(message):
+                # Missed a delta; the server starts this stream over with a keyframe
+                self.received_state.pop(stream_name, None)
+                await self.send({"command": "resync", "stream_name": stream_name})
+                return
+            message = dict(message, data=state.snapshot())
+        for pattern in self.route(stream_name):
+            for subscription in self.subscriptions.get(pattern, ()):
+                try:
+                    value = subscription.decode(message)
+                except Exception as e:
+                    logging.warning(f"Could not decode '{stream_name}': {e}")
+                    continue
+                if value is not None:
+                    subscription.put(stream_name, value)
+
+    def route(self, stream_name):
+        """Subscribed names and patterns that match a stream name."""
+        if stream_name is None:
+            return []
+        patterns = self.routes.get(stream_name)
+        if patterns is None:
+            patterns = self.routes[stream_name] = [pattern for pattern in self.subscriptions
+                                                   if topic_matches(pattern, stream_name)]
+        return patterns
+
+    def decode_frame_message(self, message):
+        data = message.get("data")
+        if isinstance(data, dict) and data.get("transport") == "shm":
+            return self.read_local_frame(data)
+        if not isinstance(data, str):
+            return None
+        return decode_frame(data, message.get("frame_type", "rgb"), message.get("width", 640), message.get("height", 480))
+
+    def read_local_frame(self, notification):
+        try:
+            return self.frame_rings.read(notification)  # None: overwritten already; a newer one is coming
+        except (OSError, ValueError) as e:
+            logging.warning(f"Cannot read frame ring {notification['shm_name']}: {e}")
+            return None
+
+
+class SyncStreamClient:
+    """
+    Thread-safe blocking facade over `StreamClient`, for GUI and capture threads.
+
+    Runs the client on its own event loop thread. Publishing blocks until the
+    message is handed to the socket; `latest(stream_name)` returns the newest
+    decoded value of a stream (subscribing on first use) without blocking.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, client_id="stream_client", **options):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = self.call(self.create_client(host, port, client_id, options))
+        self.latest_values = {}  # stream name -> newest decoded value
+        self.consumers = []  # Tasks feeding latest_values and callbacks
+
+    async def create_client(self, host, port, client_id, options):
+        # Created on the loop thread so its asyncio primitives belong to that loop
+        return StreamClient(host, port, client_id, **options)
+
+    def call(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def start(self, timeout=10.0, wait=True):
+        """Start connecting; with `wait=False`, returns without waiting for the first connection."""
+        self.call(self.client.start(wait=wait), timeout)
+
+    async def shutdown(self):
+        for task in self.consumers:
+            task.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        await self.client.close()
+
+    def close(self):
+        try:
+            self.call(self.shutdown(), timeout=5.0)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5.0)
+
+    def send(self, message, timeout=5.0):
+        return self.call(self.client.send(message), timeout)
+
+    def publish(self, stream_name, data, timeout=5.0, **fields):
+        return self.call(self.client.publish(stream_name, data, **fields), timeout)
+
+    def publish_markers(self, ids, positions, quaternions, stream_name="aruco_position_stream",
+                        timestamp=None, timeout=5.0, **fields):
+        return self.call(self.client.publish_markers(ids, positions, quaternions, stream_name, timestamp, **fields),
+                         timeout)
+
+    def publish_frame(self, stream_name, image, frame_type="rgb", timeout=5.0, **fields):
+        return self.call(self.client.publish_frame(stream_name, image, frame_type, **fields), timeout)
+
+    def on(self, command, handler):
+        """`handler(message)` runs on the client's loop thread."""
+        self.loop.call_soon_threadsafe(self.client.on, command, handler)
+
+    def subscribe(self, stream_name, callback=None, kind="data"):
+        """
+        Track a stream's newest value for `latest`; `callback(value)` also runs (on the loop thread)
+        for every value. `kind` is "data", "frames" or "markers". With a wildcard pattern, every
+        matching stream is tracked under its own name and the callback gets (stream_name, value).
+        """
+        async def consume():
+            self.consumers.append(asyncio.current_task())
+            subscription = getattr(self.client, "subscribe" if kind == "data" else kind)(stream_name)
+            async for item in subscription:
+                name, value = item if subscription.wildcard else (stream_name, item)
+                self.latest_values[name] = value
+                if callback is not None:
+                    callback(item)
+
+        self.latest_values.setdefault(stream_name, None)
+        asyncio.run_coroutine_threadsafe(consume(), self.loop)
+
+    def latest(self, stream_name, kind="data"):
+        if stream_name not in self.latest_values:
+            self.subscribe(stream_name, kind=kind)
+        return self.latest_values.get(stream_name)
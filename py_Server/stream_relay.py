@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+
+from stream_client import StreamClient
+
+# Upstream links, e.g. [{"host": "10.0.0.5", "port": 8080, "topics": ["cam/*/aruco"], "max_rate": 2000000}]
+DEFAULT_RELAYS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "relays.json")
+
+
+def load_relay_config(path=DEFAULT_RELAYS_PATH):
+    """Relay links configured in relays.json, or none."""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path) as f:
+            links = json.load(f)
+        return [{"host": link["host"], "port": int(link.get("port", 8080)), "topics": list(link["topics"]),
+                 "max_rate": link.get("max_rate")} for link in links]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Could not load relay links from {path}: {e}")
+        return []
+
+
+class StreamRelay:
+    """
+    Link from this server to an upstream one: subscribes there to `topics` (stream names or
+    wildcard patterns) and republishes every value here as if it was produced locally.
+
+    Each stream crosses the link once, as the single subscription of this relay; local
+    consumers subscribe to this server as usual. Delta streams stay delta-encoded on the link.
+    Every relayed value carries the nodes it came through ("via"), and a server never pushes a
+    stream to a relay of a node on its path, so links in both directions or in a ring don't loop.
+    `max_rate` (bytes per second) caps the link; the upstream paces its pushes to it and skips
+    to the newest values when it can't keep up.
+    """
+
+    def __init__(self, server, host, port, topics, max_rate=None):
+        self.server = server
+        self.topics = list(topics)
+        self.client = StreamClient(host, port, client_id=f"relay-{server.node_id}", local=False,
+                                   node_id=server.node_id)
+        if max_rate:
+            self.client.capabilities["max_rate"] = max_rate
+        self.client.on("stream_data", self.on_stream_data)
+        for topic in self.topics:
+            self.client.subscribe(topic, decode=lambda message: None)  # Values are taken raw in on_stream_data
+        self.relayed = 0
+        self.looped = 0  # Values dropped because they had already passed through this server
+
+    async def start(self):
+        log_message = f"Relaying {', '.join(self.topics)} from {self.client.uri}"
+        logging.info(log_message)
+        self.server.app.log_message(log_message)
+        await self.client.start(wait=False)
+
+    async def stop(self):
+        await self.client.close()
+
+    async def on_stream_data(self, message):
+        stream_name = message.get("stream_name")
+        if not self.client.route(stream_name):
+            return
+        if message.get("encoding") == "delta" and stream_name not in self.client.received_state:
+            return  # The client found a gap and already asked for a keyframe
+        via = message.get("via") or []
+        if self.server.node_id in via:
+            self.looped += 1
+            return
+        upstream = self.client.server_node_id or self.client.uri
+        if not self.server.republish(message, via + [upstream]):
+            await self.client.send({"command": "resync", "stream_name": stream_name})
+            return
+        self.relayed += 1
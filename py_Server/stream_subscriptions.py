@@ -0,0 +1,350 @@
+import asyncio
+import logging
+import secrets
+
+import message_codec
+from message_codec import FanoutMessage
+from topic_index import TopicTrie, topic_matches
+
+FILTER_FIELDS = ("marker_ids", "bbox", "min_confidence")
+
+
+class ContentFilter:
+    """
+    Server-side filter for keyed item streams such as marker lists, attached when subscribing:
+      marker_ids      only these ids
+      bbox            {"min": [x, y, z], "max": [x, y, z]} (inclusive, in the stream's frame)
+      min_confidence  drop items whose "confidence" is lower (items without one pass)
+    Lookups are prepared once (a frozenset of ids, float bounds), so checking an item is cheap.
+    Payloads that are not item lists (frames, calibration results) pass unchanged.
+    """
+
+    def __init__(self, marker_ids=None, bbox=None, min_confidence=None, key="marker_id"):
+        self.key = key
+        self.marker_ids = frozenset(int(i) for i in marker_ids) if marker_ids is not None else None
+        self.bbox = None
+        if bbox is not None:
+            low = tuple(float(v) for v in bbox["min"])
+            high = tuple(float(v) for v in bbox["max"])
+            if len(low) != 3 or len(high) != 3:
+                raise ValueError("bbox min and max need three coordinates")
+            self.bbox = low + high
+        self.min_confidence = float(min_confidence) if min_confidence is not None else None
+
+    @classmethod
+    def from_message(cls, data):
+        """Filter from a subscribe/request message ("filter": {...} or top-level fields), or None."""
+        spec = data.get("filter") or {field: data[field] for field in FILTER_FIELDS if field in data}
+        if not spec:
+            return None
+        return cls(spec.get("marker_ids"), spec.get("bbox"), spec.get("min_confidence"))
+
+    def accepts(self, item):
+        if not isinstance(item, dict):
+            return False
+        if self.marker_ids is not None and item.get(self.key) not in self.marker_ids:
+            return False
+        if self.bbox is not None:
+            # Older producers nest the coordinates under "position"
+            position = item["position"] if isinstance(item.get("position"), dict) else item
+            x, y, z = position.get("x"), position.get("y"), position.get("z")
+            if x is None or y is None or z is None:
+                return False
+            x0, y0, z0, x1, y1, z1 = self.bbox
+            if not (x0 <= x <= x1 and y0 <= y <= y1 and z0 <= z <= z1):
+                return False
+        if self.min_confidence is not None and item.get("confidence", 1.0) < self.min_confidence:
+            return False
+        return True
+
+    def apply(self, response, held=None):
+        """
+        Filter a stream_data message. An item that leaves the filter (e.g. moves out of the box)
+        is reported as removed. `held`, the set of keys the receiver currently has (updated in
+        place), keeps removals to items it actually has; without it every rejected upsert is listed.
+        """
+        if response.get("encoding") == "delta":
+            upserts, rejected = [], []
+            for item in response["upserts"]:
+                (upserts if self.accepts(item) else rejected).append(item)
+            removed = list(response["removed"]) + [item.get(self.key) for item in rejected]
+            if held is not None:
+                removed = [k for k in removed if k in held]
+                held.difference_update(removed)
+                held.update(item[self.key] for item in upserts)
+            return dict(response, upserts=upserts, removed=removed)
+
+        data = response.get("data")
+        if not isinstance(data, list):
+            return response
+        data = [item for item in data if self.accepts(item)]
+        if held is not None:
+            held.clear()
+            held.update(item.get(self.key) for item in data)
+        return dict(response, data=data)
+
+
+class Subscriber:
+    """Session of one client: its subscriptions, what it was last sent and what is waiting to be pushed."""
+
+    def __init__(self, client_id, websocket, token):
+        self.client_id = client_id
+        self.websocket = websocket  # None while disconnected within the grace period
+        self.token = token
+        self.node_id = None  # Set for relays of other servers; streams that came from there aren't sent back
+        self.expiry = None  # Timer that ends the session after a disconnect
+        self.streams = {}  # stream name or wildcard pattern -> subscribe options
+        self.matches = {}  # stream name -> options of the first pattern matching it, or None (cache)
+        self.held = {}  # stream name -> item keys a filtered subscriber currently has
+        self.delivered_seq = {}  # stream name -> seq of the delta-stream state last pushed
+        self.pending = set()  # Streams updated since the last push
+        self.in_flight = {}  # stream name -> future of its push still in the outbound queue
+        self.deferred = set()  # Streams updated while their previous push was still queued
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+
+class SubscriptionManager:
+    """
+    Server-side push fan-out for `subscribe`d streams.
+
+    Whatever stores a new stream value calls `notify(stream_name)`. Every
+    subscriber has one sender task that builds the message from the stream's
+    current value when it gets to it, so a slow consumer skips intermediate
+    values instead of queueing them, and never holds up the producer or other
+    consumers. Delta-tracked streams are pushed as deltas against what that
+    subscriber last received. Pushes go through the connection's outbound
+    queue without waiting for each other, so a frame still being written
+    doesn't hold up a marker update; each stream has at most one push queued.
+
+    Every connection gets a session token. A client that drops keeps its
+    session for `grace_period` seconds; reconnecting with the token restores
+    its subscriptions and pushes only what it missed (a delta from the seq it
+    last applied where the history allows, else the current value).
+
+    Subscriptions may be wildcard patterns over "/"-separated stream names
+    ("cam/*/aruco", "cam/**"); they are resolved through a `TopicTrie`, with
+    matches cached per stream name and per subscriber.
+
+    Each stream value is built into a message and encoded once per variant
+    (local or not, delta base, codec) and shared by every subscriber that needs
+    that variant; only filtered subscriptions are encoded per subscriber.
+    """
+
+    def __init__(self, server, grace_period=10.0):
+        self.server = server
+        self.grace_period = grace_period
+        self.subscribers = {}  # client id -> Subscriber of connected clients
+        self.sessions = {}  # token -> Subscriber, connected or within the grace period
+        self.index = TopicTrie()  # Patterns of connected subscribers -> client ids
+        self.versions = {}  # stream name -> number of notified updates
+        self.fanout = {}  # stream name -> (version, {(local, since_seq): FanoutMessage or None})
+
+    def attach(self, client_id, websocket, token=None, seqs=None):
+        """Bind a new connection to its previous session if `token` is still valid; returns (subscriber, resumed)."""
+        self.detach(client_id)  # A stale connection of the same client id, if any
+        subscriber = self.sessions.get(token) if token else None
+        resumed = subscriber is not None
+        if resumed:
+            self.detach(subscriber.client_id)  # Resumed before the old connection was noticed as dead
+            if subscriber.expiry is not None:
+                subscriber.expiry.cancel()
+                subscriber.expiry = None
+            # Pushes after the seqs the client reports applying were lost with the old connection
+            seqs = seqs or {}
+            subscriber.delivered_seq = {}
+            for name, seq in seqs.items():
+                options = self.options_for(subscriber, name)
+                # Filtered streams restart with a keyframe: what the client holds of them is not known exactly
+                if options is not None and options.get("filter") is None:
+                    subscriber.delivered_seq[name] = seq
+            subscriber.client_id = client_id
+        else:
+            subscriber = Subscriber(client_id, websocket, secrets.token_hex(16))
+            self.sessions[subscriber.token] = subscriber
+
+        subscriber.websocket = websocket
+        subscriber.pending = set()
+        subscriber.in_flight = {}
+        subscriber.deferred = set()
+        subscriber.wakeup.clear()
+        subscriber.task = asyncio.get_running_loop().create_task(self.run_sender(subscriber))
+        self.subscribers[client_id] = subscriber
+        for pattern in subscriber.streams:
+            self.index.add(pattern, client_id)
+            self.queue_current(subscriber, pattern)
+        return subscriber, resumed
+
+    def detach(self, client_id, websocket=None):
+        """
+        A connection ended: stop pushing to it and keep its session for the grace period
+        (only if `websocket` is still the one attached, when given).
+        """
+        subscriber = self.subscribers.get(client_id)
+        if subscriber is None or (websocket is not None and subscriber.websocket is not websocket):
+            return
+        del self.subscribers[client_id]
+        for pattern in subscriber.streams:
+            self.index.remove(pattern, client_id)
+        if subscriber.task is not None:
+            subscriber.task.cancel()
+            subscriber.task = None
+        subscriber.websocket = None
+        subscriber.expiry = asyncio.get_running_loop().call_later(self.grace_period, self.expire, subscriber.token)
+
+    def expire(self, token):
+        subscriber = self.sessions.pop(token, None)
+        if subscriber is not None:
+            logging.info(f"Session of {subscriber.client_id} expired")
+
+    def subscribe(self, client_id, pattern, options=None):
+        """
+        Subscribe to a stream name or wildcard pattern; matching streams with a value are pushed right away.
+        Raises ValueError for a missing or empty pattern.
+        """
+        if not isinstance(pattern, str) or not pattern:
+            raise ValueError(f"stream_name must be a non-empty string, got {pattern!r}")
+        subscriber = self.subscribers[client_id]
+        subscriber.streams[pattern] = options or {}
+        subscriber.matches.clear()
+        for stream_name in list(subscriber.delivered_seq):
+            if topic_matches(pattern, stream_name):
+                del subscriber.delivered_seq[stream_name]  # (Re)subscribing always starts with a keyframe
+        self.index.add(pattern, client_id)
+        self.queue_current(subscriber, pattern)
+
+    def unsubscribe(self, client_id, pattern):
+        subscriber = self.subscribers.get(client_id)
+        if subscriber is None or pattern not in subscriber.streams:
+            return
+        del subscriber.streams[pattern]
+        subscriber.matches.clear()
+        for stream_name in list(subscriber.delivered_seq):
+            if self.options_for(subscriber, stream_name) is None:
+                del subscriber.delivered_seq[stream_name]
+        self.index.remove(pattern, client_id)
+
+    def resync(self, client_id, stream_name):
+        """The client lost track of a delta stream; push it a keyframe."""
+        subscriber = self.subscribers.get(client_id)
+        if not isinstance(stream_name, str):
+            return
+        if subscriber is not None and self.options_for(subscriber, stream_name) is not None:
+            subscriber.delivered_seq.pop(stream_name, None)
+            self.queue(subscriber, stream_name)
+
+    def options_for(self, subscriber, stream_name):
+        """Options of the subscription covering `stream_name` for this subscriber, or None."""
+        if stream_name not in subscriber.matches:
+            options = subscriber.streams.get(stream_name)
+            if options is None:
+                options = next((options for pattern, options in subscriber.streams.items()
+                                if topic_matches(pattern, stream_name)), None)
+            subscriber.matches[stream_name] = options
+        return subscriber.matches[stream_name]
+
+    def notify(self, stream_name):
+        """A stream has a new value; schedule a push to its subscribers. Call from the event loop."""
+        self.versions[stream_name] = self.versions.get(stream_name, 0) + 1
+        for client_id in self.index.match(stream_name):
+            self.queue(self.subscribers[client_id], stream_name)
+
+    def close_stream(self, stream_name):
+        """A stream was closed: forget its cached messages and what each subscriber was sent of it."""
+        self.versions.pop(stream_name, None)
+        self.fanout.pop(stream_name, None)
+        for subscriber in self.sessions.values():
+            subscriber.delivered_seq.pop(stream_name, None)  # A reopened stream starts with a keyframe
+            subscriber.held.pop(stream_name, None)
+            subscriber.matches.pop(stream_name, None)
+            subscriber.pending.discard(stream_name)
+            subscriber.deferred.discard(stream_name)
+
+    def queue_current(self, subscriber, pattern):
+        for stream_name, value in list(self.server.streams.items()):
+            if value is not None and topic_matches(pattern, stream_name):
+                self.queue(subscriber, stream_name)
+
+    def shared_response(self, stream_name, local, since_seq):
+        """The stream's current message for this variant, built once per update; None if there is none."""
+        version = self.versions.get(stream_name, 0)
+        cached = self.fanout.get(stream_name)
+        if cached is None or cached[0] != version:
+            cached = self.fanout[stream_name] = (version, {})
+        key = (local, since_seq)
+        if key not in cached[1]:
+            response = self.server.build_stream_response(stream_name, local, since_seq)
+            cached[1][key] = FanoutMessage(response) if response is not None else None
+        return cached[1][key]
+
+    def queue(self, subscriber, stream_name):
+        subscriber.pending.add(stream_name)
+        subscriber.wakeup.set()
+
+    def sent(self, subscriber, stream_name, future):
+        """A push left the outbound queue; a newer value that came in meanwhile goes next."""
+        if subscriber.in_flight.get(stream_name) is future:
+            del subscriber.in_flight[stream_name]
+        if future.cancelled() or future.exception() is not None:
+            return  # Connection closed; a resumed session catches up from the seqs the client reports
+        if stream_name in subscriber.deferred:
+            subscriber.deferred.discard(stream_name)
+            self.queue(subscriber, stream_name)
+
+    async def run_sender(self, subscriber):
+        """
+        Push task of one subscriber. A stream whose push fails is logged and skipped; if the
+        task itself fails, the subscriber is detached and its connection closed, so the client
+        reconnects and resumes its session instead of silently receiving nothing.
+        """
+        try:
+            while True:
+                await subscriber.wakeup.wait()
+                subscriber.wakeup.clear()
+                pending, subscriber.pending = subscriber.pending, set()
+                outbound = self.server.outbound.get(subscriber.client_id)
+                if outbound is None:
+                    continue  # Connection is going away; detach cancels this task
+                for stream_name in pending:
+                    try:
+                        self.push(subscriber, outbound, stream_name)
+                    except Exception:
+                        logging.exception(f"Push of '{stream_name}' to {subscriber.client_id} failed")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception(f"Sender of {subscriber.client_id} stopped")
+            websocket = subscriber.websocket
+            subscriber.task = None  # Running now; nothing to cancel
+            self.detach(subscriber.client_id, websocket)
+            if websocket is not None:
+                asyncio.get_running_loop().create_task(websocket.close())
+
+    def push(self, subscriber, outbound, stream_name):
+        """Queue the stream's current value for the subscriber (or note it for after the queued one)."""
+        options = self.options_for(subscriber, stream_name)
+        if options is None:
+            return  # Unsubscribed meanwhile
+        if stream_name in subscriber.in_flight:
+            subscriber.deferred.add(stream_name)  # Keep only the newest until the queued one is written
+            return
+        since_seq = subscriber.delivered_seq.get(stream_name)
+        shared = self.shared_response(stream_name, options.get("local", False), since_seq)
+        if shared is None:
+            return
+        response = shared.message
+        if subscriber.node_id is not None and subscriber.node_id in response.get("via", ()):
+            return  # Relayed from that node (directly or through others): sending it back would loop
+        codec = self.server.client_codecs.get(subscriber.client_id, message_codec.JSON)
+        content_filter = options.get("filter")
+        if content_filter is not None:
+            response = content_filter.apply(response, subscriber.held.setdefault(stream_name, set()))
+        if response.get("encoding") == "delta" and not response["upserts"] and not response["removed"]:
+            subscriber.delivered_seq[stream_name] = response["seq"]
+            return  # Nothing changed for this subscriber
+        payload = codec.encode(response) if content_filter is not None else shared.encode(codec)
+        future = outbound.put(payload, self.server.priority_of(response))
+        subscriber.in_flight[stream_name] = future
+        future.add_done_callback(lambda future: self.sent(subscriber, stream_name, future))
+        if "seq" in response:
+            subscriber.delivered_seq[stream_name] = response["seq"]
@@ -0,0 +1,94 @@
+# Stream names are topics: levels separated by "/", e.g. "cam/<serial>/aruco".
+# Subscription patterns may use "*" for exactly one level ("cam/*/aruco") and, as the
+# last level only, "**" for any number of remaining levels, including none ("cam/**").
+SEPARATOR = "/"
+ONE_LEVEL = "*"
+ANY_LEVELS = "**"
+
+
+def topic_matches(pattern, topic):
+    """Whether a subscription pattern matches a concrete topic."""
+    pattern_levels = pattern.split(SEPARATOR)
+    topic_levels = topic.split(SEPARATOR)
+    for i, level in enumerate(pattern_levels):
+        if level == ANY_LEVELS and i == len(pattern_levels) - 1:
+            return True
+        if i >= len(topic_levels) or (level != ONE_LEVEL and level != topic_levels[i]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+
+class TopicNode:
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children = {}  # level -> TopicNode
+        self.subscribers = set()  # Subscribers whose pattern ends here
+
+
+class TopicTrie:
+    """
+    Prefix trie of subscription patterns, one node per topic level.
+
+    `match(topic)` walks the exact, "*" and "**" branches once per level, so
+    its cost depends on the depth of the topic, not on the number of
+    patterns. Results are cached per topic; adding or removing a pattern
+    only drops the cached topics that pattern matches.
+    """
+
+    def __init__(self, cache_size=4096):
+        self.root = TopicNode()
+        self.cache = {}  # topic -> frozenset of subscribers
+        self.cache_size = cache_size
+
+    def add(self, pattern, subscriber):
+        node = self.root
+        for level in pattern.split(SEPARATOR):
+            node = node.children.setdefault(level, TopicNode())
+        node.subscribers.add(subscriber)
+        self.invalidate(pattern)
+
+    def remove(self, pattern, subscriber):
+        path = [self.root]
+        for level in pattern.split(SEPARATOR):
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].subscribers.discard(subscriber)
+        # Prune branches that no longer lead to any pattern
+        for parent, level, node in zip(reversed(path[:-1]), reversed(pattern.split(SEPARATOR)), reversed(path[1:])):
+            if node.subscribers or node.children:
+                break
+            del parent.children[level]
+        self.invalidate(pattern)
+
+    def invalidate(self, pattern):
+        for topic in [topic for topic in self.cache if topic_matches(pattern, topic)]:
+            del self.cache[topic]
+
+    def match(self, topic):
+        """All subscribers with a pattern matching `topic`."""
+        subscribers = self.cache.get(topic)
+        if subscribers is None:
+            found = set()
+            self.collect(self.root, topic.split(SEPARATOR), 0, found)
+            subscribers = frozenset(found)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[topic] = subscribers
+        return subscribers
+
+    def collect(self, node, levels, i, found):
+        any_levels = node.children.get(ANY_LEVELS)
+        if any_levels is not None:
+            found.update(any_levels.subscribers)
+        if i == len(levels):
+            found.update(node.subscribers)
+            return
+        child = node.children.get(levels[i])
+        if child is not None:
+            self.collect(child, levels, i + 1, found)
+        one_level = node.children.get(ONE_LEVEL)
+        if one_level is not None:
+            self.collect(one_level, levels, i + 1, found)
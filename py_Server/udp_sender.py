@@ -0,0 +1,156 @@
+import json
+import time
+import socket
+import selectors
+import threading
+
+
+class UnitySender:
+    """
+    Non-blocking UDP sender for the Unity `ArUcoServer`.
+
+    Every packet gets a sequence number. Sending never waits: acknowledgements
+    ("ACK <seq>") are collected by a background receiver thread using a
+    selector, and round-trip time and loss are derived from them. A timer
+    thread sends heartbeats only while no marker data is flowing.
+    """
+
+    def __init__(self, address=('127.0.0.1', 12345), heartbeat_interval=1.0, connection_timeout=2.0,
+                 history=1024):
+        self.address = address
+        self.heartbeat_interval = heartbeat_interval
+        self.connection_timeout = connection_timeout  # Seconds without an ack before we count as disconnected
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        # Bound before anything waits on it: select() on an unbound UDP socket fails on Windows (WinError 10022)
+        self.sock.bind(('', 0))
+
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.history = history
+        self.send_times = [0.0] * history  # Indexed by seq % history
+        self.sent_seqs = [-1] * history
+        self.last_send_time = 0.0
+
+        # Statistics derived from acks
+        self.packets_sent = 0
+        self.acks_received = 0
+        self.rtt = None  # Smoothed round-trip time in seconds
+        self.last_ack_time = 0.0
+        self.is_connected = False
+
+        self.running = True
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.receiver_thread = threading.Thread(target=self.receive_acks, daemon=True)
+        self.receiver_thread.start()
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop, daemon=True)
+        self.heartbeat_thread.start()
+
+    def next_seq(self):
+        with self.lock:
+            seq = self.seq
+            self.seq += 1
+            return seq
+
+    def send(self, packet):
+        """Stamp `packet` (a dict) with a sequence number and send it without blocking."""
+        seq = self.next_seq()
+        packet['seq'] = seq
+        return self.send_bytes(json.dumps(packet).encode(), seq)
+
+    def send_bytes(self, payload, seq):
+        now = time.time()
+        try:
+            self.sock.sendto(payload, self.address)
+        except (BlockingIOError, OSError) as e:
+            # A full socket buffer or unreachable port must never stall the capture loop
+            if self.is_connected:
+                print(f"Error sending to Unity: {e}")
+            return False
+
+        slot = seq % self.history
+        with self.lock:
+            self.send_times[slot] = now
+            self.sent_seqs[slot] = seq
+            self.packets_sent += 1
+            self.last_send_time = now
+        return True
+
+    def send_heartbeat(self):
+        return self.send({
+            'timestamp': float(f"{time.time():.3f}"),
+            'markers': {}  # Empty markers dict
+        })
+
+    def heartbeat_loop(self):
+        """Send a heartbeat whenever no data went out for a full interval."""
+        while self.running:
+            time.sleep(self.heartbeat_interval)
+            if time.time() - self.last_send_time >= self.heartbeat_interval:
+                self.send_heartbeat()
+            if self.is_connected and time.time() - self.last_ack_time > self.connection_timeout:
+                self.is_connected = False
+                print("Lost connection to Unity server (no acks).")
+
+    def receive_acks(self):
+        while self.running:
+            try:
+                events = self.selector.select(timeout=0.5)
+            except OSError as e:
+                # Keep the ack thread alive; rtt, loss and connected depend on it
+                print(f"Error waiting for Unity acks: {e}")
+                time.sleep(0.5)
+                continue
+            for _ in events:
+                while True:
+                    try:
+                        data, _ = self.sock.recvfrom(1024)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        # e.g. ICMP port unreachable on Windows while Unity is down
+                        break
+                    self.handle_ack(data, time.time())
+
+    def handle_ack(self, data, now):
+        parts = data.decode(errors='ignore').split()
+        if not parts or parts[0] != "ACK":
+            return
+
+        with self.lock:
+            self.acks_received += 1
+            self.last_ack_time = now
+            if len(parts) > 1 and parts[1].isdigit():
+                seq = int(parts[1])
+                slot = seq % self.history
+                if self.sent_seqs[slot] == seq:
+                    sample = now - self.send_times[slot]
+                    self.rtt = sample if self.rtt is None else 0.9 * self.rtt + 0.1 * sample
+
+        if not self.is_connected:
+            print("Successfully connected to Unity server!")
+            self.is_connected = True
+
+    def stats(self):
+        """Return a snapshot of connection statistics."""
+        with self.lock:
+            sent = self.packets_sent
+            acked = self.acks_received
+            rtt = self.rtt
+        loss = 1.0 - acked / sent if sent else 0.0
+        return {
+            'connected': self.is_connected,
+            'sent': sent,
+            'acked': acked,
+            'loss': max(0.0, loss),
+            'rtt_ms': rtt * 1000.0 if rtt is not None else None
+        }
+
+    def close(self):
+        self.running = False
+        self.receiver_thread.join(timeout=1.0)
+        self.heartbeat_thread.join(timeout=self.heartbeat_interval + 1.0)
+        self.selector.close()
+        self.sock.close()
@@ -68,11 +68,17 @@ class WebsocketClient:
                 print(f"Message received from server: {data}")
                 if data.get("command") == "REQUEST_ID":
                     await self.send_id(websocket, self.client_id_entry.get())
+                else:
+                    await self.handle_server_message(data)
         except websockets.ConnectionClosed:
             print("Connection to server closed.")
         except Exception as e:
             print(f"Error while listening to server: {e}")
 
+    async def handle_server_message(self, data):
+        """Hook for subclasses to react to server commands."""
+        pass
+
     def on_close(self):
         if self.websocket and not self.websocket.closed:
             self.loop.run_until_complete(self.websocket.close())
@@ -2,10 +2,23 @@ import asyncio
 import websockets
 import json
 import logging
+import secrets
 import socket
+import time
 import base64
 import numpy as np
 import cv2
+from calibration_service import CalibrationService
+from delta_stream import DeltaStreamState
+from marker_fusion import MarkerFusion
+from shm_transport import FrameRingCache
+from point_cloud import PointCloudService
+from stream_subscriptions import SubscriptionManager, ContentFilter
+import message_codec
+from message_codec import FanoutMessage
+from outbound_scheduler import OutboundScheduler, CONTROL, TRACKING, BULK, DEFAULT_CHUNK_SIZE
+from message_chunks import ChunkReassembler, is_chunk, MAX_MESSAGE_SIZE, LEGACY_MAX_SIZE
+from stream_relay import StreamRelay, load_relay_config
 
 from typing import TYPE_CHECKING, Dict, Any
 if TYPE_CHECKING:
@@ -13,6 +26,12 @@ if TYPE_CHECKING:
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
 
+# What this server can do, offered to clients in the welcome message
+SERVER_CAPABILITIES = {
+    "codecs": message_codec.available_codecs(),  # Most preferred first; binary ones only if installed
+    "binary_frames": False,
+    "chunked": True  # Large messages travel as chunks both ways (see message_chunks)
+}
 
 
 class WebSocketServer:
@@ -25,18 +44,48 @@ class WebSocketServer:
         self.should_stop = False
         self.clients: Dict[str, Any] = {}  # Dictionary to store client ID and WebSocket pairs
         self.streams: Dict[str, Any] = {}  # Dictionary to store active streams and their current values
+        self.delta_streams: Dict[str, DeltaStreamState] = {}  # Reconstructed state of delta-encoded streams
+        self.calibration = CalibrationService(self)  # Camera-to-VR extrinsics solved from marker samples
+        self.fusion = MarkerFusion(self)  # Merges cam/<serial>/aruco streams into aruco_position_stream
+        self.frame_rings = FrameRingCache()  # Shared-memory rings of same-host frame producers
+        self.point_cloud = PointCloudService(self)  # Depth frames -> point_cloud_stream
+        self.color_frames: Dict[str, Any] = {}  # Latest decoded color frame per stream, for point cloud colors
+        self.frame_info: Dict[str, Any] = {}  # frame_type (and shape for depth) of stream_frame streams
+        self.subscriptions = SubscriptionManager(self)  # Push fan-out for subscribed streams
+        self.client_capabilities: Dict[str, Any] = {}  # Per-client result of the handshake negotiation
+        self.client_codecs: Dict[str, Any] = {}  # Per-client message codec agreed in the handshake
+        self.outbound: Dict[str, OutboundScheduler] = {}  # Per-client prioritized send queue
+        self.node_id = f"{socket.gethostname()}-{secrets.token_hex(3)}"  # Identifies this server to relays
+        self.stream_origins: Dict[str, Any] = {}  # Relayed streams -> nodes they came through, origin first
+        self.relays = [StreamRelay(self, **link) for link in load_relay_config()]  # Links to upstream servers
         
     async def register(self, websocket):
-        await websocket.send(json.dumps({"command": "REQUEST_ID"}))
+        client_id = None
+        outbound = None
         try:
-            message = await websocket.recv()
-            data = json.loads(message)
+            # Clients that wait to be asked get REQUEST_ID right away; clients that send their
+            # hello (ID, capabilities, initial subscriptions) unprompted just ignore it
+            await websocket.send(json.dumps({"command": "REQUEST_ID"}))
+            data = message_codec.decode(await websocket.recv())  # The first message is always JSON
             client_id = data.get("client_id")
 
             if client_id:
+                previous = self.clients.get(client_id)
+                if previous is not None and previous is not websocket:
+                    # Reconnected before the old connection timed out; don't wait for it
+                    asyncio.create_task(previous.close())
                 self.clients[client_id] = websocket
-                self.app.log_message(f"New client connected: ID {client_id}")
-                self.app.add_client(client_id)  # Update the client list in the GUI
+                # Everything to this client goes through its queue: control before markers before frames
+                outbound = self.outbound[client_id] = OutboundScheduler(websocket)
+                if data.get("command") == "hello":
+                    await self.accept_hello(client_id, websocket, data)
+                else:
+                    # Plain ID: JSON, no session token and no welcome (a hello may still follow)
+                    self.subscriptions.attach(client_id, websocket)
+                    self.negotiate_capabilities(client_id, websocket, None)
+                    self.app.log_message(f"New client connected: ID {client_id}")
+                if previous is None:
+                    self.app.add_client(client_id)  # Update the client list in the GUI
                 await self.listen_to_client(client_id, websocket)
 
         except websockets.ConnectionClosed as e:
@@ -44,15 +93,110 @@ class WebSocketServer:
         except Exception as e:
             self.app.log_message(f"Error: {e}")
         finally:
-            if client_id in self.clients:
+            self.subscriptions.detach(client_id, websocket)
+            if outbound is not None:
+                outbound.stop()
+                if self.outbound.get(client_id) is outbound:
+                    del self.outbound[client_id]
+            if client_id is not None and self.clients.get(client_id) is websocket:
                 self.clients.pop(client_id)
+                self.client_capabilities.pop(client_id, None)
+                self.client_codecs.pop(client_id, None)
                 self.app.log_message(f"Client disconnected: ID {client_id}")
                 self.app.remove_client(client_id)
 
+    async def accept_hello(self, client_id, websocket, data):
+        """
+        Apply a client's hello (first message or any later one): resume its session if the token is
+        still valid, subscribe what it lists, agree on capabilities and confirm with a welcome.
+        """
+        # Resume the client's session (subscriptions, delivered seqs) if it brings a valid token
+        subscriber, resumed = self.subscriptions.attach(client_id, websocket, data.get("session"), data.get("seqs"))
+        subscriber.node_id = data.get("node_id")  # Another server relaying from us
+        errors = []
+        for subscription in data.get("subscriptions") or []:
+            if isinstance(subscription, str):
+                subscription = {"stream_name": subscription}
+            if not isinstance(subscription, dict):
+                errors.append((None, f"subscription entry must be a stream name or object, got {subscription!r}"))
+                continue
+            if subscription.get("stream_name") not in subscriber.streams:  # Resumed ones continue from their seq
+                try:
+                    self.subscriptions.subscribe(client_id, subscription.get("stream_name"),
+                                                 self.subscription_options(subscription))
+                except (KeyError, TypeError, ValueError) as e:
+                    errors.append((subscription.get("stream_name"), str(e)))
+        capabilities = self.negotiate_capabilities(client_id, websocket, data.get("capabilities"))
+        if capabilities["chunked"]:
+            # It sends large messages in chunks too, so whole frames never need to fit in one message
+            websocket.max_size = MAX_MESSAGE_SIZE
+        outbound = self.outbound[client_id]
+        outbound.configure(DEFAULT_CHUNK_SIZE if capabilities["chunked"] else None, capabilities["max_rate"])
+        await outbound.send(json.dumps({
+            "command": "welcome",
+            "client_id": client_id,
+            "node_id": self.node_id,
+            "token": subscriber.token,
+            "resumed": resumed,
+            "streams": list(subscriber.streams),
+            "capabilities": capabilities
+        }), CONTROL)
+        for stream_name, error in errors:
+            self.app.log_message(f"Invalid subscription from {client_id}: {error}")
+            await self.send_error(client_id, "hello", error, stream_name)
+        if resumed:
+            self.app.log_message(f"Client reconnected: ID {client_id} (session resumed, {len(subscriber.streams)} subscription(s))")
+        else:
+            self.app.log_message(f"New client connected: ID {client_id}")
+
+    async def send_error(self, client_id, request, error, stream_name=None):
+        """Tell a client that one of its requests was rejected (the connection stays up)."""
+        await self.send_message(client_id, {
+            "command": "error",
+            "request": request,
+            "stream_name": stream_name,
+            "message": error
+        })
+
+    def subscription_options(self, data):
+        """Options of a subscribe message or hello subscription entry; raises ValueError on a bad filter."""
+        return {
+            "local": data.get("local", False),
+            "filter": ContentFilter.from_message(data)
+        }
+
+    def negotiate_capabilities(self, client_id, websocket, offered):
+        """Pick what both sides support from the client's hello; clients that offer nothing get plain JSON."""
+        offered = offered or {}
+        codecs = [codec for codec in offered.get("codecs", []) if codec in SERVER_CAPABILITIES["codecs"]]
+        capabilities = {
+            "codec": codecs[0] if codecs else "json",
+            "binary_frames": bool(offered.get("binary_frames")) and SERVER_CAPABILITIES["binary_frames"],
+            "chunked": bool(offered.get("chunked")) and SERVER_CAPABILITIES["chunked"],
+            # Bandwidth cap (bytes per second) a relay link asks for, else none
+            "max_rate": offered.get("max_rate") if isinstance(offered.get("max_rate"), (int, float)) and offered["max_rate"] > 0 else None,
+            # permessage-deflate is negotiated by the WebSocket handshake itself; report the outcome
+            "compression": any(getattr(extension, "name", "") == "permessage-deflate"
+                               for extension in getattr(websocket, "extensions", []))
+        }
+        self.client_capabilities[client_id] = capabilities
+        self.client_codecs[client_id] = message_codec.get_codec(capabilities["codec"])
+        return capabilities
+
     async def listen_to_client(self, client_id, websocket):
+        chunks = ChunkReassembler()
         try:
             async for message in websocket:
-                data = json.loads(message)
+                if is_chunk(message):
+                    try:
+                        message = chunks.add(message)
+                    except ValueError as e:
+                        self.app.log_message(f"Dropped chunked message from {client_id}: {e}")
+                        continue
+                    if message is None:
+                        continue  # More chunks to come
+                # The codec can change when the client sends a hello after its plain ID
+                data = message_codec.decode(message, self.client_codecs.get(client_id, message_codec.JSON))
                 await self.handle_message(client_id, data)
         except websockets.ConnectionClosed as e:
             logging.warning(f"Connection closed: {e}")
@@ -65,11 +209,19 @@ class WebSocketServer:
         command = data.get("command")
         log_message = ""  # Initialize log_message to ensure it is always defined
 
-        if command == "send_to_client":
+        if command == "hello":
+            # A client that first sent its plain ID (or answered REQUEST_ID) upgrades the connection
+            await self.accept_hello(client_id, self.clients[client_id], data)
+
+        elif command in (None, "client_id") and data.get("client_id") == client_id:
+            # Its answer to REQUEST_ID after it already sent its ID unprompted
+            pass
+
+        elif command == "send_to_client":
             target_id = data.get("target_id")
             target_client = self.clients.get(target_id)
             if target_client:
-                await target_client.send(json.dumps(data))
+                await self.send_message(target_id, data)
                 log_message = f"Message from {client_id} sent to {target_id}"
                 logging.info(log_message)
                 self.app.log_message(log_message)
@@ -82,6 +234,16 @@ class WebSocketServer:
         # Combined handling for 'start_stream' and 'stream_data'
             stream_name = data.get("stream_name")
             stream_data = data.get("data")
+            if stream_name == self.fusion.output_stream and self.fusion.active(time.time()):
+                # Two producers would interleave their delta seqs in one stream state
+                if self.fusion.reject_producer(client_id):
+                    log_message = (f"Ignoring '{stream_name}' from {client_id}: it is the fused output of the "
+                                   f"per-camera streams; publish cam/<serial>/aruco instead")
+                    logging.warning(log_message)
+                    self.app.log_message(log_message)
+                    await self.send_error(client_id, "stream_data", log_message, stream_name)
+                return
+            self.stream_origins.pop(stream_name, None)  # Produced here, even if it was relayed before
 
             # Automatically register the stream if it doesn't exist yet
             if stream_name not in self.streams:
@@ -92,8 +254,34 @@ class WebSocketServer:
                 logging.info(log_message)
                 self.app.log_message(log_message)
 
+            # Delta-encoded streams: rebuild the full state so requests and late joiners get a snapshot
+            if data.get("encoding") in ("keyframe", "delta"):
+                state = self.delta_streams.setdefault(stream_name, DeltaStreamState())
+                if not state.apply(data):
+                    # A delta was missed; keep the last good state and ask the producer to resync
+                    await self.send_message(client_id, {
+                        "command": "request_keyframe",
+                        "stream_name": stream_name
+                    })
+                    log_message = f"Gap in stream '{stream_name}' at seq {data.get('seq')}, requested keyframe from {client_id}"
+                    logging.warning(log_message)
+                    self.app.log_message(log_message)
+                stream_data = state.snapshot()
+            else:
+                self.delta_streams.pop(stream_name, None)
+
             # Store the actual stream data
             self.streams[stream_name] = stream_data
+            self.subscriptions.notify(stream_name)
+
+            # Feed camera-frame marker observations to the calibration solver
+            if stream_name == "aruco_position_stream":
+                self.calibration.add_camera_observations(stream_data)
+
+            # Per-camera marker streams are merged by the fusion loop
+            serial = self.fusion.camera_serial(stream_name)
+            if serial is not None:
+                self.fusion.add_observations(serial, stream_data, data.get("timestamp"), data.get("keepalive"))
 
             # Log data reception
             log_message = f"Received data for stream '{stream_name}' from client {client_id}"
@@ -102,14 +290,24 @@ class WebSocketServer:
 
         elif command == "request_stream_data":
             stream_name = data.get("stream_name")
+            if stream_name == self.point_cloud.output_stream:
+                self.point_cloud.last_requested = time.time()  # Keeps clouds coming for polling clients
             if stream_name in self.streams:
-                current_data = self.streams.get(stream_name)
-                response = {
-                    "command": "stream_data",
-                    "stream_name": stream_name,
-                    "data": current_data
-                }
-                await self.clients[client_id].send(json.dumps(response))
+                try:
+                    content_filter = ContentFilter.from_message(data)
+                except (KeyError, TypeError, ValueError) as e:
+                    # Unfiltered data would hand the client every marker it tried to filter out
+                    log_message = f"Invalid filter in request for '{stream_name}' from {client_id}: {e}"
+                    logging.warning(log_message)
+                    self.app.log_message(log_message)
+                    await self.send_error(client_id, "request_stream_data", str(e), stream_name)
+                    return
+                response = self.build_stream_response(stream_name, data.get("local", False), data.get("since_seq"))
+                if response is None:
+                    return  # Frame unreadable or already overwritten; the next request gets a newer one
+                if content_filter is not None:
+                    response = content_filter.apply(response)
+                await self.send_message(client_id, response)
                 log_message = f"Sent current stream data for '{stream_name}' to {client_id}"
                 #logging.info(log_message)
                 self.app.log_message(log_message)
@@ -118,6 +316,35 @@ class WebSocketServer:
                 logging.warning(log_message)
                 self.app.log_message(log_message)
 
+        elif command == "subscribe":
+            # Push every update of the stream instead of being polled with request_stream_data.
+            # stream_name may be a wildcard pattern such as "cam/*/aruco"
+            # marker_ids / bbox / min_confidence filter what is pushed (see ContentFilter)
+            stream_name = data.get("stream_name")
+            try:
+                options = self.subscription_options(data)
+                self.subscriptions.subscribe(client_id, stream_name, options)
+                log_message = f"{client_id} subscribed to '{stream_name}'"
+                if options["filter"] is not None:
+                    log_message += " (filtered)"
+                logging.info(log_message)
+            except (KeyError, TypeError, ValueError) as e:
+                log_message = f"Invalid subscription to '{stream_name}' from {client_id}: {e}"
+                logging.warning(log_message)
+                await self.send_error(client_id, "subscribe", str(e), stream_name)
+            self.app.log_message(log_message)
+
+        elif command == "resync":
+            # A subscriber missed part of a delta-encoded stream
+            self.subscriptions.resync(client_id, data.get("stream_name"))
+
+        elif command == "unsubscribe":
+            stream_name = data.get("stream_name")
+            self.subscriptions.unsubscribe(client_id, stream_name)
+            log_message = f"{client_id} unsubscribed from '{stream_name}'"
+            logging.info(log_message)
+            self.app.log_message(log_message)
+
         elif command == "close_stream":
             stream_name = data.get("stream_name")
             self.app.log_message("stream to close: '{stream_name}'")
@@ -126,6 +353,10 @@ class WebSocketServer:
             if stream_name in self.streams:
                 log_message = f"Stream '{stream_name}' closed by {client_id}"
                 del self.streams[stream_name]
+                self.delta_streams.pop(stream_name, None)
+                self.frame_info.pop(stream_name, None)
+                self.stream_origins.pop(stream_name, None)
+                self.subscriptions.close_stream(stream_name)
                 self.app.refresh_stream_dropdown()  # Refresh the stream dropdown in the UI
                 logging.info(log_message)
                 self.app.log_message(log_message)
@@ -136,6 +367,7 @@ class WebSocketServer:
             stream_name = data.get("stream_name")
             frame_type = data.get("frame_type")  # e.g., "rgb" or "depth"
             frame_data = data.get("data")  # This should be a base64-encoded string
+            self.stream_origins.pop(stream_name, None)
 
             # Decode the frame data for verification and logging purposes (if needed)
             frame_bytes = base64.b64decode(frame_data)
@@ -147,21 +379,98 @@ class WebSocketServer:
                 if frame is not None:
                     # Store the raw base64-encoded frame data in the streams dictionary
                     self.streams[stream_name] = frame_data
+                    self.frame_info[stream_name] = {"frame_type": frame_type}
+                    self.color_frames[stream_name] = frame
+                    self.subscriptions.notify(stream_name)
                     self.app.log_message(f"Stored {frame_type} frame for stream '{stream_name}' from client {client_id}, data size: {len(frame_data)}")
                 else:
                     self.app.log_message(f"Failed to decode RGB frame from client {client_id}")
 
             elif frame_type == "depth":
                 # Convert the byte array back into an image (depth data)
-                frame = np.frombuffer(frame_bytes, dtype=np.uint16).reshape((480, 640))  # Adjust shape if necessary
+                intrinsics = data.get("intrinsics") or {}
+                shape = (intrinsics.get("height", 480), intrinsics.get("width", 640))
+                frame = np.frombuffer(frame_bytes, dtype=np.uint16).reshape(shape)
                 if frame is not None:
                     # Store the raw base64-encoded frame data in the streams dictionary
                     self.streams[stream_name] = frame_data
+                    self.frame_info[stream_name] = {"frame_type": frame_type, "width": shape[1], "height": shape[0]}
+                    self.subscriptions.notify(stream_name)
                     self.app.log_message(f"Stored {frame_type} frame for stream '{stream_name}' from client {client_id}, data size: {len(frame_data)}")
+                    if self.point_cloud.wanted():
+                        self.point_cloud.submit(stream_name, frame, data, self.color_frames.get(data.get("color_stream")))
                 else:
                     self.app.log_message(f"Failed to decode depth frame from client {client_id}")
 
-                    
+
+        elif command == "stream_frame_local":
+            # Same-host producer wrote the frame into its shared-memory ring; keep only the notification
+            stream_name = data.get("stream_name")
+            self.stream_origins.pop(stream_name, None)
+            if stream_name not in self.streams:
+                self.streams[stream_name] = None
+                self.app.refresh_stream_dropdown()
+                log_message = f"Local frame stream '{stream_name}' started by {client_id} (ring {data.get('shm_name')})"
+                logging.info(log_message)
+                self.app.log_message(log_message)
+            self.streams[stream_name] = {
+                "transport": "shm",
+                "frame_type": data.get("frame_type"),
+                "shm_name": data.get("shm_name"),
+                "generation": data.get("generation"),
+                "slot": data.get("slot"),
+                "seq": data.get("seq"),
+                "timestamp": data.get("timestamp")
+            }
+            self.subscriptions.notify(stream_name)
+            if data.get("frame_type") == "depth" and not self.point_cloud.busy and self.point_cloud.wanted():
+                frame = self.read_local_frame(self.streams[stream_name])
+                if frame is not None:
+                    color_frame = None
+                    color_stream = self.streams.get(data.get("color_stream"))
+                    if self.is_local_frame(color_stream):
+                        color_frame = self.read_local_frame(color_stream)
+                    self.point_cloud.submit(stream_name, frame, data, color_frame)
+
+        elif command == "set_depth_filter":
+            # Per-stream depth filter stages, e.g. {"decimation": 4, "temporal_alpha": null}
+            stream_name = data.get("stream_name")
+            try:
+                self.point_cloud.configure_filter(stream_name, data.get("options") or {})
+                log_message = f"Depth filter for '{stream_name}' updated by {client_id}: {data.get('options')}"
+            except (TypeError, ValueError) as e:
+                log_message = f"Invalid depth filter options for '{stream_name}' from {client_id}: {e}"
+                await self.send_error(client_id, "set_depth_filter", str(e), stream_name)
+            logging.info(log_message)
+            self.app.log_message(log_message)
+
+        elif command == "calibration_sample":
+            # VR-side world positions of markers, paired with the latest camera observations
+            paired = self.calibration.add_vr_samples(data.get("markers"))
+            log_message = f"Calibration sample from {client_id}: {paired} marker(s) paired, {self.calibration.count} total"
+            self.app.log_message(log_message)
+
+        elif command == "request_calibration":
+            await self.calibration.publish(client_id)
+
+        elif command == "reset_calibration":
+            self.calibration.reset()
+            log_message = f"Calibration samples cleared by {client_id}"
+            logging.info(log_message)
+            self.app.log_message(log_message)
+
+        elif command == "set_camera_extrinsics":
+            # Camera-to-world 4x4 matrix for one camera of the fused marker stream
+            serial = data.get("serial")
+            try:
+                self.fusion.set_extrinsics(serial, data.get("matrix"))
+                log_message = f"Extrinsics for camera {serial} set by {client_id}"
+                logging.info(log_message)
+            except (TypeError, ValueError) as e:
+                log_message = f"Invalid extrinsics for camera {serial} from {client_id}: {e}"
+                logging.warning(log_message)
+            self.app.log_message(log_message)
+
         elif command == "broadcast":
             broadcast_message = data.get("data")
             await self.broadcast_message(broadcast_message, exclude_client=client_id)
@@ -186,10 +495,128 @@ class WebSocketServer:
             logging.warning(log_message)
             self.app.log_message(log_message)
 
+    def build_stream_response(self, stream_name, local=False, since_seq=None):
+        """
+        The stream_data message for a stream's current value, shared by requests and subscription pushes.
+        Delta-tracked streams answer with a delta since `since_seq` when possible, else a keyframe.
+        Returns None when there is nothing to send (a local frame that is already gone).
+        """
+        current_data = self.streams.get(stream_name)
+        response = {
+            "command": "stream_data",
+            "stream_name": stream_name,
+            "data": current_data
+        }
+        if self.is_local_frame(current_data):
+            if not local:
+                # Remote consumer of a same-host frame stream: encode the frame the classic way
+                return self.encode_local_frame(stream_name, current_data)
+        elif stream_name in self.frame_info:
+            response.update(self.frame_info[stream_name])
+        state = self.delta_streams.get(stream_name)
+        if state is not None:
+            # Consumers that pass the last seq they applied get only what changed since then
+            delta = state.delta_since(since_seq) if since_seq is not None else None
+            if delta is not None:
+                response = {
+                    "command": "stream_data",
+                    "stream_name": stream_name,
+                    "encoding": "delta",
+                    "seq": state.seq,
+                    "base_seq": since_seq,
+                    "upserts": delta[0],
+                    "removed": delta[1]
+                }
+            else:
+                response["encoding"] = "keyframe"
+                response["seq"] = state.seq
+        if stream_name in self.stream_origins:
+            response["via"] = self.stream_origins[stream_name]  # Relays don't send it back to these nodes
+        return response
+
+    def republish(self, message, via):
+        """
+        Store a stream value relayed from another server (see StreamRelay) and push it to local
+        subscribers. `via` lists the nodes it came through, origin first. Returns False when a
+        delta doesn't apply to what we have, so the relay asks for a keyframe.
+        """
+        stream_name = message["stream_name"]
+        if stream_name not in self.streams:
+            self.streams[stream_name] = None
+            self.app.refresh_stream_dropdown()
+            log_message = f"Stream '{stream_name}' relayed from {via[-1]}"
+            logging.info(log_message)
+            self.app.log_message(log_message)
+        if message.get("encoding") in ("keyframe", "delta"):
+            state = self.delta_streams.setdefault(stream_name, DeltaStreamState())
+            if not state.apply(message):
+                return False
+            value = state.snapshot()
+        else:
+            self.delta_streams.pop(stream_name, None)
+            value = message.get("data")
+        if "frame_type" in message:
+            self.frame_info[stream_name] = {key: message[key] for key in ("frame_type", "width", "height") if key in message}
+        self.streams[stream_name] = value
+        self.stream_origins[stream_name] = via
+        self.subscriptions.notify(stream_name)
+        return True
+
+    def is_local_frame(self, stream_value):
+        return isinstance(stream_value, dict) and stream_value.get("transport") == "shm"
+
+    def read_local_frame(self, notification):
+        """Copy of the frame a shared-memory notification points to, or None if it is gone."""
+        try:
+            return self.frame_rings.read(notification)  # None: already overwritten by a newer frame
+        except (OSError, ValueError) as e:
+            logging.warning(f"Cannot read frame ring {notification['shm_name']}: {e}")
+            return None
+
+    def encode_local_frame(self, stream_name, notification):
+        """Read a frame announced through shared memory and return it as a classic base64 stream_data message."""
+        frame = self.read_local_frame(notification)
+        if frame is None:
+            return None
+        frame_type = notification.get("frame_type")
+        if frame_type == "rgb":
+            _, buffer = cv2.imencode('.jpg', frame)
+        else:
+            buffer = frame.tobytes()
+        return {
+            "command": "stream_data",
+            "stream_name": stream_name,
+            "frame_type": frame_type,
+            "data": base64.b64encode(buffer).decode('utf-8')
+        }
+
+    async def send_message(self, client_id, message, priority=None):
+        """
+        Send a message dict, or a FanoutMessage, to a client in its negotiated codec and wait until
+        it is written. The priority class defaults to what `priority_of` makes of the message.
+        """
+        codec = self.client_codecs.get(client_id, message_codec.JSON)
+        if isinstance(message, FanoutMessage):
+            payload, message = message.encode(codec), message.message
+        else:
+            payload = codec.encode(message)
+        if priority is None:
+            priority = self.priority_of(message)
+        await self.outbound[client_id].send(payload, priority)
+
+    def priority_of(self, message):
+        """Outbound priority class: stream values are tracking data, except frames and point clouds."""
+        if message.get("command") != "stream_data":
+            return CONTROL
+        stream_name = message.get("stream_name")
+        if stream_name in self.frame_info or stream_name == self.point_cloud.output_stream:
+            return BULK
+        return TRACKING
+
     async def send_to_client(self, client_id, message):
         client = self.clients.get(client_id)
         if client:
-            await client.send(json.dumps({"command": "message", "data": message}))
+            await self.send_message(client_id, {"command": "message", "data": message})
             log_message = f"Sent message to {client_id}: {message}"
             self.app.log_message(log_message)
         else:
@@ -197,12 +624,14 @@ class WebSocketServer:
             self.app.log_message(log_message)
 
     async def broadcast_message(self, message, exclude_client=None):
-        for cid, websocket in self.clients.items():
+        # Encoded once per codec in use, not once per client
+        broadcast = FanoutMessage({
+            "command": "broadcast",
+            "data": message
+        })
+        for cid in list(self.clients):
             if cid != exclude_client:
-                await websocket.send(json.dumps({
-                    "command": "broadcast",
-                    "data": message
-                }))
+                await self.send_message(cid, broadcast)
         logging.info(f"Broadcasted message: {message}")
         self.app.log_message(f"Broadcasted message: {message}")
 
@@ -210,23 +639,35 @@ class WebSocketServer:
         logging.info("Server started, waiting for clients to connect...")
         self.app.log_message("Server started, waiting for clients to connect...")
         
-        # Increase the buffer size by setting max_size and max_queue
+        # Clients that negotiate chunking get MAX_MESSAGE_SIZE after the handshake; the larger
+        # default is only for older clients that send whole frames
         self.server = await websockets.serve(
             self.register, 
             "0.0.0.0", 
             self.port,
-            max_size=10**7,   # Maximum size of each message (10MB in this case)
-            max_queue=10000    # Maximum number of messages that can be queued
+            max_size=LEGACY_MAX_SIZE,  # Maximum size of each message (10MB in this case)
+            max_queue=16    # Received messages buffered per connection before reading pauses
         )
         
         self.host = self.get_host_ip()
         self.app.update_IP_config(self.host, self.port)
         logging.info(f"host :{self.host}")
+
+        # Keep refining the calibration in the background
+        calibration_task = asyncio.create_task(self.calibration.run())
+        for relay in self.relays:
+            await relay.start()
+        fusion_task = asyncio.create_task(self.fusion.run())
         
         try:
             while not self.should_stop:
                 await asyncio.sleep(1)
         finally:
+            calibration_task.cancel()
+            fusion_task.cancel()
+            for relay in self.relays:
+                await relay.stop()
+            self.frame_rings.close()
             logging.info("Server stopping, disconnecting all clients...")
             self.app.log_message("Server stopping, disconnecting all clients...")
             await self.disconnect_all_clients()
@@ -254,8 +695,9 @@ class WebSocketServer:
             logging.info("Disconnecting all clients...")
             self.app.log_message("Disconnecting all clients...")
             disconnect_tasks = []
+            closing = FanoutMessage({"command": "SERVER_CLOSING"})
             for client_id, websocket in list(self.clients.items()):
-                await websocket.send(json.dumps({"command": "SERVER_CLOSING"}))
+                await self.send_message(client_id, closing)
                 disconnect_tasks.append(websocket.close())
             await asyncio.gather(*disconnect_tasks)
             self.clients.clear()